@@ -0,0 +1,89 @@
+"""
+Cache de autenticação por API key (LRU com TTL e cache negativo)
+"""
+import os
+import time
+import threading
+from collections import OrderedDict, namedtuple
+
+# Identidade mínima do cliente autenticado (mesmo nome de atributo do modelo: client.id)
+ClientIdentity = namedtuple('ClientIdentity', ['id', 'name'])
+
+_MISSING = object()
+
+
+class ApiKeyCache:
+    """API key → cliente ativo, com entradas negativas de vida curta para chaves inválidas"""
+
+    def __init__(self, max_size=None, ttl=None, negative_ttl=None):
+        self.max_size = max_size or int(os.getenv('API_KEY_CACHE_SIZE', '10000'))
+        self.ttl = ttl or int(os.getenv('API_KEY_CACHE_TTL', '300'))
+        self.negative_ttl = negative_ttl or int(os.getenv('API_KEY_NEGATIVE_TTL', '30'))
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()   # api_key -> (ClientIdentity ou None, expira_em)
+        self._lock = threading.Lock()
+
+    def authenticate(self, api_key, loader):
+        """Retorna a identidade do cliente ativo da chave, usando loader(api_key) em caso de falta"""
+        identity = self.get(api_key)
+        if identity is not _MISSING:
+            return identity
+
+        client = loader(api_key)
+        identity = ClientIdentity(client.id, client.name) if client else None
+        self.put(api_key, identity)
+        return identity
+
+    def get(self, api_key):
+        """Busca uma chave; retorna _MISSING se ausente ou expirada"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(api_key)
+            if entry is None or entry[1] <= now:
+                if entry is not None:
+                    del self._entries[api_key]
+                self.misses += 1
+                return _MISSING
+            self._entries.move_to_end(api_key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, api_key, identity):
+        """Armazena o resultado (None = chave inválida), descartando o menos usado se estiver cheio"""
+        ttl = self.ttl if identity else self.negative_ttl
+        with self._lock:
+            self._entries[api_key] = (identity, time.monotonic() + ttl)
+            self._entries.move_to_end(api_key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate_client(self, client_id):
+        """Remove as chaves do cliente e as entradas negativas (a chave pode ter sido reativada)"""
+        with self._lock:
+            for api_key in [key for key, (identity, _) in self._entries.items()
+                            if identity is None or identity.id == client_id]:
+                del self._entries[api_key]
+
+    def on_change(self, kind, entity_id):
+        """Callback das notificações de roteamento: clientes alterados perdem o cache"""
+        if kind == 'client':
+            self.invalidate_client(entity_id)
+        elif kind == 'all':
+            self.clear()
+
+    def clear(self):
+        """Remove todas as entradas"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Retorna estatísticas do cache"""
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': (self.hits / lookups * 100) if lookups > 0 else 0
+        }
@@ -0,0 +1,10 @@
+"""
+Espera entre tentativas: backoff exponencial com jitter
+"""
+import random
+
+
+def jittered_backoff(failures, base, cap):
+    """Espera antes da próxima tentativa: exponencial com jitter (metade fixa, metade aleatória)"""
+    delay = min(cap, base * 2 ** max(0, failures - 1))
+    return delay / 2 + random.uniform(0, delay / 2)
@@ -0,0 +1,156 @@
+"""
+Supervisão de bind SMPP: enquire_link periódico, detecção de sessão morta e rebind com backoff
+"""
+import os
+import sys
+import time
+import threading
+import smpplib.smpp
+
+# Adiciona o diretório src ao path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from backoff import jittered_backoff
+
+
+def reconnect_backoff(failures):
+    """Espera antes do próximo bind (SMPP_RECONNECT_BASE, limitada a SMPP_RECONNECT_MAX)"""
+    base = float(os.getenv('SMPP_RECONNECT_BASE', '1'))
+    cap = float(os.getenv('SMPP_RECONNECT_MAX', '60'))
+    return jittered_backoff(failures, base, cap)
+
+
+class BindSupervisor:
+    """
+    Vigia o bind de um conector fora do caminho dos callbacks de PDU
+
+    O conector fornece connect(), listen_in_background(), connection_lost(motivo),
+    requeue_in_flight(), log_system() e os atributos client/connected/running.
+    """
+
+    def __init__(self, connector, module='smpp'):
+        self.connector = connector
+        self.module = module
+
+        self.interval = float(os.getenv('SMPP_ENQUIRE_LINK_INTERVAL', '5'))
+        self.timeout = float(os.getenv('SMPP_ENQUIRE_LINK_TIMEOUT', '3'))
+        self.tick = 0.5
+
+        self.last_seen = time.monotonic()   # último PDU recebido do SMSC
+        self.enquire_sent_at = None         # enquire_link aguardando resposta
+        self.up = False
+        self.down_since = None
+        self.failures = 0
+        self.next_attempt = 0.0
+        self._stop = threading.Event()
+
+        # Estatísticas
+        self.enquire_links = 0
+        self.keepalive_timeouts = 0
+        self.reconnects = 0
+        self.last_reconnect_s = None
+        self.max_reconnect_s = 0.0
+
+    def attach(self, client):
+        """Instrumenta um cliente recém-conectado: qualquer PDU recebido prova que a sessão está viva"""
+        read_pdu = client.read_pdu
+
+        def read_and_mark():
+            pdu = read_pdu()
+            self.last_seen = time.monotonic()
+            self.enquire_sent_at = None
+            return pdu
+
+        client.read_pdu = read_and_mark
+        self.last_seen = time.monotonic()
+        self.enquire_sent_at = None
+        self.up = True
+
+    def keepalive(self):
+        """Envia enquire_link quando o bind está ocioso; False se a sessão estiver morta"""
+        connector = self.connector
+        if not self.up:
+            return False
+        if not connector.connected:
+            # Listener encerrou (socket fechado ou erro de leitura)
+            self._lost('listener encerrado')
+            return False
+
+        now = time.monotonic()
+        if self.enquire_sent_at is not None:
+            if now - self.enquire_sent_at > self.timeout:
+                self.keepalive_timeouts += 1
+                self._lost(f'sem resposta ao enquire_link em {self.timeout:.0f}s')
+                return False
+        elif now - self.last_seen >= self.interval:
+            try:
+                self.enquire_sent_at = now
+                connector.client.send_pdu(smpplib.smpp.make_pdu('enquire_link', client=connector.client))
+                self.enquire_links += 1
+            except Exception as e:
+                self._lost(f'falha ao enviar enquire_link: {e}')
+                return False
+        return True
+
+    def _lost(self, reason):
+        self.up = False
+        self.down_since = time.monotonic()
+        self.failures = 0
+        self.next_attempt = 0.0
+        self.connector.connection_lost(reason)
+        # submit_sm sem resposta nunca serão respondidos nesta sessão
+        requeued = self.connector.requeue_in_flight()
+        if requeued:
+            self.connector.log_system('WARNING', f'{requeued} submit_sm reenfileirados após queda do bind', self.module)
+
+    def check(self):
+        """Um passo de supervisão: keepalive com o bind ativo, rebind com backoff quando caído"""
+        if self.keepalive():
+            return
+
+        now = time.monotonic()
+        if now < self.next_attempt:
+            return
+        if self.down_since is None:
+            self.down_since = now
+
+        if self.connector.connect():
+            self.connector.listen_in_background()
+            elapsed = time.monotonic() - self.down_since
+            self.reconnects += 1
+            self.last_reconnect_s = elapsed
+            self.max_reconnect_s = max(self.max_reconnect_s, elapsed)
+            self.down_since = None
+            self.failures = 0
+            self.connector.log_system('INFO', f'Bind restabelecido em {elapsed:.1f}s', self.module)
+        else:
+            self.failures += 1
+            delay = reconnect_backoff(self.failures)
+            self.next_attempt = now + delay
+            self.connector.log_system('WARNING', f'Rebind falhou ({self.failures}x), nova tentativa em {delay:.1f}s',
+                                      self.module)
+
+    def run(self):
+        """Laço de supervisão (bloqueia até stop() ou o conector parar)"""
+        self._stop.clear()
+        while self.connector.running and not self._stop.is_set():
+            try:
+                self.check()
+            except Exception as e:
+                self.connector.log_system('ERROR', f'Erro na supervisão do bind: {e}', self.module)
+            self._stop.wait(self.tick)
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self):
+        """Estatísticas do bind"""
+        return {
+            'up': self.up,
+            'down_for_s': (time.monotonic() - self.down_since) if self.down_since is not None else 0.0,
+            'enquire_links': self.enquire_links,
+            'keepalive_timeouts': self.keepalive_timeouts,
+            'reconnects': self.reconnects,
+            'last_reconnect_s': self.last_reconnect_s,
+            'max_reconnect_s': self.max_reconnect_s
+        }
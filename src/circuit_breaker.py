@@ -0,0 +1,86 @@
+"""
+Circuit breaker por destino de webhook: falhas (ou lentidão) seguidas estacionam o cliente por um tempo
+"""
+import os
+import time
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+    """
+    closed → open após failure_threshold falhas seguidas (resposta acima de latency_threshold conta como falha);
+    open → half_open após open_seconds; half_open libera `probes` requisições: sucesso fecha, falha reabre.
+
+    Não é thread-safe: o chamador serializa o acesso (o motor de entrega usa o próprio lock).
+    """
+
+    def __init__(self, failure_threshold=None, latency_threshold=None, open_seconds=None, probes=None):
+        self.failure_threshold = failure_threshold or int(os.getenv('WEBHOOK_BREAKER_FAILURES', '5'))
+        self.latency_threshold = latency_threshold or float(os.getenv('WEBHOOK_BREAKER_LATENCY_MS', '10000')) / 1000
+        self.open_seconds = open_seconds or float(os.getenv('WEBHOOK_BREAKER_OPEN_SECONDS', '30'))
+        self.probes = probes or int(os.getenv('WEBHOOK_BREAKER_PROBES', '1'))
+
+        self.state = CLOSED
+        self.failures = 0
+        self.reopen_at = 0.0
+        self.changed_at = time.time()
+
+        # Estatísticas
+        self.opens = 0
+        self.successes = 0
+        self.errors = 0
+        self.slow = 0
+
+    def current(self):
+        """Estado atual, passando de open para half_open quando o tempo de espera acaba"""
+        if self.state == OPEN and time.monotonic() >= self.reopen_at:
+            self._change(HALF_OPEN)
+        return self.state
+
+    def limit(self, concurrency):
+        """Requisições simultâneas permitidas no estado atual"""
+        state = self.current()
+        if state == CLOSED:
+            return concurrency
+        if state == HALF_OPEN:
+            return self.probes
+        return 0
+
+    def record(self, success, elapsed):
+        """Registra o resultado de uma requisição; retorna o novo estado se ele mudou, senão None"""
+        previous = self.state
+        if success and elapsed <= self.latency_threshold:
+            self.successes += 1
+            self.failures = 0
+            if self.state == HALF_OPEN:
+                self._change(CLOSED)
+        else:
+            if success:
+                self.slow += 1
+            else:
+                self.errors += 1
+            self.failures += 1
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold):
+                self.opens += 1
+                self.reopen_at = time.monotonic() + self.open_seconds
+                self._change(OPEN)
+        return self.state if self.state != previous else None
+
+    def _change(self, state):
+        self.state = state
+        self.changed_at = time.time()
+
+    def snapshot(self):
+        """Estado para o painel"""
+        return {
+            'state': self.state,
+            'failures': self.failures,
+            'changed_at': self.changed_at,
+            'opens': self.opens,
+            'successes': self.successes,
+            'errors': self.errors,
+            'slow': self.slow
+        }
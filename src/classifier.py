@@ -3,20 +3,30 @@ Sistema de classificação automática de mensagens por serviço
 """
 import os
 import sys
-import re
 import json
 from datetime import datetime
 from flask import Flask
 from dotenv import load_dotenv
+import redis
 
 # Adiciona o diretório src ao path
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from models import db, Message, Service, SystemLog
+from service_cache import ServiceCache
 
 # Carrega variáveis de ambiente
 load_dotenv()
 
+# Configuração do Redis
+redis_client = redis.Redis(
+    host=os.getenv('REDIS_HOST', 'localhost'),
+    port=int(os.getenv('REDIS_PORT', '6379')),
+    password=os.getenv('REDIS_PASSWORD') or None,
+    db=int(os.getenv('REDIS_DB', '0')),
+    decode_responses=True
+)
+
 # Configuração da aplicação Flask para o classificador
 app = Flask(__name__)
 app.config['SQLALCHEMY_DATABASE_URI'] = f"mysql+pymysql://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{os.getenv('DB_NAME')}"
@@ -28,9 +38,19 @@ class MessageClassifier:
     """Classificador de mensagens por serviço"""
     
     def __init__(self):
-        self.services = {}
+        self.service_cache = ServiceCache(app, redis_client)
         self.load_services()
     
+    @property
+    def matcher(self):
+        """Motor de classificação do catálogo atual (recarregado quando a versão muda)"""
+        return self.service_cache.get_matcher()
+    
+    @property
+    def services(self):
+        """Serviços compilados do catálogo atual"""
+        return self.matcher.services
+    
     def log_system(self, level, message, module='classifier'):
         """Registra log no sistema"""
         try:
@@ -44,25 +64,8 @@ class MessageClassifier:
     def load_services(self):
         """Carrega serviços ativos do banco de dados"""
         try:
-            with app.app_context():
-                services = Service.query.filter_by(is_active=True).all()
-                self.services = {}
-                
-                for service in services:
-                    try:
-                        # Compila regex para melhor performance
-                        compiled_regex = re.compile(service.regex_pattern, re.IGNORECASE)
-                        self.services[service.id] = {
-                            'name': service.name,
-                            'regex': compiled_regex,
-                            'pattern': service.regex_pattern
-                        }
-                    except re.error as e:
-                        self.log_system('ERROR', f'Erro na regex do serviço {service.name}: {e}', 'classifier')
-                        continue
-                
-                self.log_system('INFO', f'{len(self.services)} serviços carregados para classificação', 'classifier')
-                
+            # O cache registra a quantidade de serviços e os erros de regex
+            self.service_cache.reload()
         except Exception as e:
             self.log_system('ERROR', f'Erro ao carregar serviços: {e}', 'classifier')
     
@@ -71,15 +74,15 @@ class MessageClassifier:
         if not message_text:
             return None
         
-        # Tenta classificar com cada serviço
-        for service_id, service_data in self.services.items():
-            try:
-                if service_data['regex'].search(message_text):
-                    self.log_system('DEBUG', f'Mensagem classificada como {service_data["name"]}', 'classifier')
-                    return service_id
-            except Exception as e:
-                self.log_system('ERROR', f'Erro ao classificar com serviço {service_data["name"]}: {e}', 'classifier')
-                continue
+        try:
+            match = self.matcher.match_first(message_text)
+        except Exception as e:
+            self.log_system('ERROR', f'Erro ao classificar mensagem: {e}', 'classifier')
+            return None
+        
+        if match:
+            self.log_system('DEBUG', f'Mensagem classificada como {match.name}', 'classifier')
+            return match.service_id
         
         return None
     
@@ -88,27 +91,28 @@ class MessageClassifier:
         if not message_text:
             return None, 0.0
         
+        matcher = self.matcher
+        
         best_match = None
         best_confidence = 0.0
         
-        for service_id, service_data in self.services.items():
-            try:
-                match = service_data['regex'].search(message_text)
-                if match:
-                    # Calcula confiança baseada no tamanho do match e posição
-                    match_length = len(match.group(0))
-                    message_length = len(message_text)
-                    position_factor = 1.0 - (match.start() / message_length) if message_length > 0 else 1.0
-                    
-                    confidence = (match_length / message_length) * position_factor
-                    
-                    if confidence > best_confidence:
-                        best_confidence = confidence
-                        best_match = service_id
-                        
-            except Exception as e:
-                self.log_system('ERROR', f'Erro ao classificar com confiança: {e}', 'classifier')
-                continue
+        try:
+            matches = matcher.match_all(message_text)
+        except Exception as e:
+            self.log_system('ERROR', f'Erro ao classificar com confiança: {e}', 'classifier')
+            return None, 0.0
+        
+        message_length = len(message_text)
+        for match in matches:
+            # Calcula confiança baseada no tamanho do match e posição
+            match_length = match.end - match.start
+            position_factor = 1.0 - (match.start / message_length) if message_length > 0 else 1.0
+            
+            confidence = (match_length / message_length) * position_factor
+            
+            if confidence > best_confidence:
+                best_confidence = confidence
+                best_match = match.service_id
         
         return best_match, best_confidence
     
@@ -181,7 +185,8 @@ class MessageClassifier:
                     'classified_messages': classified_messages,
                     'unclassified_messages': unclassified_messages,
                     'classification_rate': (classified_messages / total_messages * 100) if total_messages > 0 else 0,
-                    'service_stats': [{'name': stat.name, 'count': stat.count} for stat in service_stats]
+                    'service_stats': [{'name': stat.name, 'count': stat.count} for stat in service_stats],
+                    'cache': self.matcher.result_cache.stats()
                 }
                 
         except Exception as e:
@@ -0,0 +1,103 @@
+"""
+Correlação de DLR: message_id do SMSC → mensagem interna (Redis com TTL + coluna indexada)
+"""
+import os
+import sys
+import json
+
+# Adiciona o diretório src ao path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from models import db, Message
+
+CORRELATION_PREFIX = 'dlr:corr'
+EARLY_PREFIX = 'dlr:early'
+
+
+class DLRCorrelator:
+    """Resolve o message_id do SMSC de um recibo e guarda os recibos que chegam antes do submit_sm_resp"""
+
+    def __init__(self, app, redis_client, on_receipt=None):
+        self.app = app
+        self.redis = redis_client
+        self.on_receipt = on_receipt    # on_receipt(message_pk, recibo) para recibos reconciliados
+
+        # TTL igual à validade padrão do SMSC: depois disso não chegam mais recibos
+        self.ttl = int(os.getenv('DLR_CORRELATION_TTL', '172800'))
+        self.early_ttl = int(os.getenv('DLR_EARLY_TTL', '600'))
+
+        self.redis_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+        self.parked = 0
+        self.reconciled = 0
+
+    def record(self, pairs):
+        """Registra pares (message_id do SMSC, id da mensagem) já gravados no banco e reconcilia recibos antecipados"""
+        if not pairs:
+            return 0
+
+        pipeline = self.redis.pipeline(transaction=False)
+        for smpp_message_id, message_pk in pairs:
+            pipeline.set(f'{CORRELATION_PREFIX}:{smpp_message_id}', message_pk, ex=self.ttl)
+        for smpp_message_id, _ in pairs:
+            pipeline.exists(f'{EARLY_PREFIX}:{smpp_message_id}')
+        early = pipeline.execute()[len(pairs):]
+
+        for (smpp_message_id, message_pk), waiting in zip(pairs, early):
+            if waiting:
+                self._reconcile(smpp_message_id, message_pk)
+        return len(pairs)
+
+    def lookup(self, smpp_message_id):
+        """Id da mensagem de saída com esse message_id do SMSC, ou None"""
+        message_pk = self.redis.get(f'{CORRELATION_PREFIX}:{smpp_message_id}')
+        if message_pk is not None:
+            self.redis_hits += 1
+            return int(message_pk)
+
+        # Recibos tardios (TTL vencido ou Redis reiniciado): consulta pelo índice
+        with self.app.app_context():
+            message_pk = db.session.query(Message.id).filter(
+                Message.smpp_message_id == smpp_message_id,
+                Message.message_type == 'SMS'
+            ).limit(1).scalar()
+
+        if message_pk is None:
+            self.misses += 1
+            return None
+        self.db_hits += 1
+        self.redis.set(f'{CORRELATION_PREFIX}:{smpp_message_id}', message_pk, ex=self.ttl)
+        return message_pk
+
+    def park(self, smpp_message_id, receipt):
+        """Guarda um recibo cuja mensagem ainda não tem o submit_sm_resp gravado"""
+        self.redis.set(f'{EARLY_PREFIX}:{smpp_message_id}', json.dumps(receipt), ex=self.early_ttl)
+        self.parked += 1
+
+        # O resultado pode ter sido registrado entre a consulta e o SET acima
+        message_pk = self.redis.get(f'{CORRELATION_PREFIX}:{smpp_message_id}')
+        if message_pk is not None:
+            self._reconcile(smpp_message_id, int(message_pk))
+
+    def _reconcile(self, smpp_message_id, message_pk):
+        """Retira o recibo antecipado (uma única vez entre processos) e o aplica"""
+        pipeline = self.redis.pipeline(transaction=True)
+        pipeline.get(f'{EARLY_PREFIX}:{smpp_message_id}')
+        pipeline.delete(f'{EARLY_PREFIX}:{smpp_message_id}')
+        receipt = pipeline.execute()[0]
+        if receipt is None or not self.on_receipt:
+            return
+
+        self.reconciled += 1
+        self.on_receipt(int(message_pk), json.loads(receipt))
+
+    def stats(self):
+        """Estatísticas da correlação"""
+        return {
+            'redis_hits': self.redis_hits,
+            'db_hits': self.db_hits,
+            'misses': self.misses,
+            'parked': self.parked,
+            'reconciled': self.reconciled
+        }
@@ -0,0 +1,221 @@
+"""
+Parser de DLR (delivery receipt): TLVs receipted_message_id/message_state primeiro, texto padrão como alternativa
+
+Uso (microbenchmark):
+    python src/dlr_parser.py [iterações]
+"""
+import re
+import sys
+import time
+import types
+from collections import namedtuple
+from datetime import datetime
+import smpplib.consts
+
+# Formato de texto do apêndice B do SMPP 3.4, lido como pares chave:valor em qualquer ordem; chaves
+# desconhecidas são ignoradas e "submit date"/"submit_date" são equivalentes. O campo text: encerra o recibo.
+_FIELD_RE = re.compile(r'(?<!\S)((?:submit|done)[ _]date|\w+):(\S*)', re.IGNORECASE)
+_TEXT_RE = re.compile(r'(?<!\S)text:', re.IGNORECASE)
+_DATE_RE = re.compile(r'\d{10}(?:\d\d)?$')
+
+# message_state (TLV 0x0427) → stat do texto
+_STATE_STATS = {
+    smpplib.consts.SMPP_MESSAGE_STATE_ENROUTE: 'ENROUTE',
+    smpplib.consts.SMPP_MESSAGE_STATE_DELIVERED: 'DELIVRD',
+    smpplib.consts.SMPP_MESSAGE_STATE_EXPIRED: 'EXPIRED',
+    smpplib.consts.SMPP_MESSAGE_STATE_DELETED: 'DELETED',
+    smpplib.consts.SMPP_MESSAGE_STATE_UNDELIVERABLE: 'UNDELIV',
+    smpplib.consts.SMPP_MESSAGE_STATE_ACCEPTED: 'ACCEPTD',
+    smpplib.consts.SMPP_MESSAGE_STATE_UNKNOWN: 'UNKNOWN',
+    smpplib.consts.SMPP_MESSAGE_STATE_REJECTED: 'REJECTD',
+}
+_STAT_STATES = {stat: state for state, stat in _STATE_STATS.items()}
+# Grafias por extenso usadas por alguns SMSCs
+_STAT_STATES.update({
+    'DELIVERED': smpplib.consts.SMPP_MESSAGE_STATE_DELIVERED,
+    'UNDELIVERABLE': smpplib.consts.SMPP_MESSAGE_STATE_UNDELIVERABLE,
+    'ACCEPTED': smpplib.consts.SMPP_MESSAGE_STATE_ACCEPTED,
+    'REJECTED': smpplib.consts.SMPP_MESSAGE_STATE_REJECTED,
+})
+
+FINAL_STATES = frozenset((
+    smpplib.consts.SMPP_MESSAGE_STATE_DELIVERED,
+    smpplib.consts.SMPP_MESSAGE_STATE_EXPIRED,
+    smpplib.consts.SMPP_MESSAGE_STATE_DELETED,
+    smpplib.consts.SMPP_MESSAGE_STATE_UNDELIVERABLE,
+    smpplib.consts.SMPP_MESSAGE_STATE_REJECTED,
+))
+
+
+class DeliveryReceipt(namedtuple('DeliveryReceipt', ['id', 'state', 'stat', 'error', 'submit_date', 'done_date'])):
+    """
+    Recibo de entrega; state é o message_state do SMPP e stat a forma de texto (DELIVRD, UNDELIV...)
+
+    As datas ficam no formato do recibo (YYMMDDhhmm[ss]) e só viram datetime quando lidas
+    em submitted_at/done_at: a atualização de status não precisa delas.
+    """
+    __slots__ = ()
+
+    @property
+    def final(self):
+        return self.state in FINAL_STATES
+
+    @property
+    def submitted_at(self):
+        return _parse_time(self.submit_date)
+
+    @property
+    def done_at(self):
+        return _parse_time(self.done_date)
+
+    def to_dict(self):
+        """Forma serializável em JSON"""
+        return self._asdict()
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+
+def _text(value):
+    if isinstance(value, bytes):
+        value = value.decode('ascii', errors='ignore')
+    return value.rstrip('\x00') if value else None
+
+
+def _parse_time(value):
+    """YYMMDDhhmm[ss] sem strptime"""
+    if not value:
+        return None
+    try:
+        return datetime(2000 + int(value[0:2]), int(value[2:4]), int(value[4:6]),
+                        int(value[6:8]), int(value[8:10]), int(value[10:12] or 0))
+    except ValueError:
+        return None
+
+
+def _parse_error(value):
+    """err do texto: decimal na maioria dos SMSCs, hexadecimal em alguns"""
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        try:
+            return int(value, 16)
+        except ValueError:
+            return None
+
+
+def _network_error(value):
+    """TLV network_error_code: tipo de rede (1 octeto) + código (2 octetos)"""
+    if isinstance(value, bytes) and len(value) == 3:
+        return int.from_bytes(value[1:3], 'big')
+    return value if isinstance(value, int) else None
+
+
+def _receipt_fields(text):
+    """Pares chave:valor do recibo (chaves minúsculas com _; vale a primeira ocorrência)"""
+    cut = _TEXT_RE.search(text)
+    if cut:
+        text = text[:cut.start()]
+    fields = {}
+    for key, value in _FIELD_RE.findall(text):
+        key = key.lower().replace(' ', '_')
+        if key not in fields:
+            fields[key] = value
+    return fields
+
+
+def _date(value):
+    return value if value and _DATE_RE.match(value) else None
+
+
+def parse_receipt_text(text):
+    """Recibo a partir do texto do short_message; None se não houver id"""
+    fields = _receipt_fields(text)
+    id_ = fields.get('id')
+    if not id_:
+        return None
+
+    submit_date, done_date = _date(fields.get('submit_date')), _date(fields.get('done_date'))
+    stat, err = fields.get('stat'), fields.get('err')
+    state = smpplib.consts.SMPP_MESSAGE_STATE_UNKNOWN
+    if stat:
+        stat = stat.upper()
+        state = _STAT_STATES.get(stat, state)
+    return DeliveryReceipt(id_, state, _STATE_STATS[state], _parse_error(err), submit_date, done_date)
+
+
+def parse_receipt(pdu):
+    """Recibo de um deliver_sm com esm_class de DLR; None se não for possível identificá-lo"""
+    message_id = getattr(pdu, 'receipted_message_id', None)
+    state = getattr(pdu, 'message_state', None)
+    if message_id and state is not None:
+        # TLVs: sem parse de texto (datas ficam indisponíveis)
+        return DeliveryReceipt(_text(message_id), state, _STATE_STATS.get(state, 'UNKNOWN'),
+                               _network_error(getattr(pdu, 'network_error_code', None)), None, None)
+
+    text = pdu.short_message or getattr(pdu, 'message_payload', None)
+    if not text:
+        return None
+    receipt = parse_receipt_text(_text(text))
+    if receipt and message_id:
+        # Só o receipted_message_id veio em TLV: ele prevalece sobre o id do texto
+        receipt = receipt._replace(id=_text(message_id))
+    return receipt
+
+
+# Variações de recibo vistas em SMSCs: (texto, stat esperado, err esperado)
+SAMPLE_RECEIPTS = (
+    ('id:X sub:001 dlvrd:001 submit date:2501151230 done date:2501151231 stat:DELIVRD err:000 text:Oi', 'DELIVRD', 0),
+    ('id:X sub:001 dlvrd:001 submit_date:2501151230 done_date:2501151231 stat:DELIVRD err:000', 'DELIVRD', 0),
+    ('id:X stat:UNDELIV err:0B1 submit date:250115123015 done date:250115123120', 'UNDELIV', 0xB1),
+    ('id:X sub:001 dlvrd:000 imsi:724000000000000 submit date:2501151230 done date:2501151231 stat:EXPIRED err:027',
+     'EXPIRED', 27),
+    ('id:X submit date:2501151230 stat:REJECTD err:005 text:stat:DELIVRD', 'REJECTD', 5),
+)
+
+
+def check_samples():
+    """Confere o parser com as variações de SAMPLE_RECEIPTS; retorna as divergências"""
+    failures = []
+    for text, stat, error in SAMPLE_RECEIPTS:
+        receipt = parse_receipt_text(text)
+        if receipt is None or receipt.id != 'X' or receipt.stat != stat or receipt.error != error:
+            failures.append((text, receipt))
+    return failures
+
+
+def benchmark(iterations=100000):
+    """Mede o custo por recibo do parser (texto e TLV) comparado ao split por espaços anterior"""
+    text = (b'id:0A1B2C3D4E sub:001 dlvrd:001 submit date:2501151230 done date:2501151231 '
+            b'stat:DELIVRD err:000 text:Codigo de verificacao')
+    text_pdu = types.SimpleNamespace(short_message=text)
+    tlv_pdu = types.SimpleNamespace(short_message=text, receipted_message_id=b'0A1B2C3D4E\x00',
+                                    message_state=smpplib.consts.SMPP_MESSAGE_STATE_DELIVERED,
+                                    network_error_code=b'\x03\x00\x00')
+
+    def split_parse(pdu):
+        info = {}
+        for part in pdu.short_message.decode('utf-8', errors='ignore').split():
+            if ':' in part:
+                key, value = part.split(':', 1)
+                info[key] = value
+        return info
+
+    for text, receipt in check_samples():
+        print(f'Recibo mal interpretado: {text!r} -> {receipt}')
+
+    for name, func, pdu in (('split (anterior)', split_parse, text_pdu),
+                            ('texto', parse_receipt, text_pdu),
+                            ('TLV', parse_receipt, tlv_pdu)):
+        started = time.perf_counter()
+        for _ in range(iterations):
+            func(pdu)
+        elapsed = time.perf_counter() - started
+        print(f'{name:18s} {elapsed / iterations * 1e6:7.2f} µs/recibo  {iterations / elapsed:12,.0f} recibos/s')
+
+
+if __name__ == '__main__':
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,173 @@
+"""
+Atualização em lote do status das mensagens a partir de DLRs, com transições monotônicas
+"""
+import os
+import sys
+import time
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from sqlalchemy import update
+import smpplib.consts
+
+# Adiciona o diretório src ao path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from models import db, Message, SystemLog
+from dlr_parser import DeliveryReceipt
+
+# pending → sent → delivered/failed; um status nunca volta para um de ordem menor
+STATUS_RANK = {'pending': 0, 'sent': 1, 'delivered': 2, 'failed': 2}
+FINAL_STATUSES = ('delivered', 'failed')
+
+
+def receipt_status(receipt):
+    """Status da mensagem correspondente ao DLR (recibos intermediários apenas confirmam o envio)"""
+    if receipt.state == smpplib.consts.SMPP_MESSAGE_STATE_DELIVERED:
+        return 'delivered'
+    if receipt.final:
+        return 'failed'
+    return 'sent'
+
+
+class DLRStatusBuffer:
+    """Junta mudanças de status por uma janela curta e grava um UPDATE por status"""
+
+    def __init__(self, app, module='telecall'):
+        self.app = app
+        self.module = module
+
+        self.flush_interval = float(os.getenv('DLR_FLUSH_MS', '200')) / 1000
+        self.batch_size = int(os.getenv('DLR_BATCH_SIZE', '1000'))
+        self.final_cache_size = int(os.getenv('DLR_FINAL_CACHE', '100000'))
+
+        self._pending = {}              # id da mensagem -> status a gravar
+        self._final = OrderedDict()     # mensagens já finalizadas (LRU), para descartar recibos repetidos
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self.running = False
+        self.thread = None
+
+        # Estatísticas
+        self.received = 0
+        self.dropped = 0
+        self.applied = 0
+        self.flushes = 0
+        self.failures = 0
+
+    def log_system(self, level, message, module=None):
+        """Registra log no sistema"""
+        try:
+            with self.app.app_context():
+                log_entry = SystemLog(level=level, message=message, module=module or self.module)
+                db.session.add(log_entry)
+                db.session.commit()
+        except Exception as e:
+            print(f"Erro ao registrar log: {e}")
+
+    def add(self, message_pk, status):
+        """Agenda a mudança de status; False se o recibo for repetido ou fora de ordem"""
+        rank = STATUS_RANK[status]
+        with self._lock:
+            self.received += 1
+            if message_pk in self._final:
+                self.dropped += 1
+                return False
+            current = self._pending.get(message_pk)
+            if current is not None and STATUS_RANK[current] >= rank:
+                self.dropped += 1
+                return False
+
+            self._pending[message_pk] = status
+            if status in FINAL_STATUSES:
+                self._final[message_pk] = status
+                while len(self._final) > self.final_cache_size:
+                    self._final.popitem(last=False)
+            full = len(self._pending) >= self.batch_size
+
+        if full:
+            self._wakeup.set()
+        return True
+
+    def add_receipt(self, message_pk, receipt):
+        """Agenda a mudança de status conforme o DLR (ou sua forma em dict, guardada antes do submit_sm_resp)"""
+        if isinstance(receipt, dict):
+            receipt = DeliveryReceipt.from_dict(receipt)
+        return self.add(message_pk, receipt_status(receipt))
+
+    def start(self):
+        """Inicia a thread de gravação"""
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=10):
+        """Para a thread de gravação após gravar o que estiver pendente"""
+        self.running = False
+        self._wakeup.set()
+        if self.thread:
+            self.thread.join(timeout)
+
+    def _run(self):
+        backoff = 1
+        while self.running or self._pending:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+
+            with self._lock:
+                batch, self._pending = self._pending, {}
+            if not batch:
+                continue
+
+            try:
+                self.flush(batch)
+                backoff = 1
+            except Exception as e:
+                # Devolve o lote sem sobrescrever mudanças mais novas recebidas nesse meio tempo
+                self.failures += 1
+                with self._lock:
+                    for message_pk, status in batch.items():
+                        current = self._pending.get(message_pk)
+                        if current is None or STATUS_RANK[current] < STATUS_RANK[status]:
+                            self._pending[message_pk] = status
+                self.log_system('ERROR', f'Erro ao gravar {len(batch)} status de DLR: {e}')
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+
+    def flush(self, batch):
+        """Um UPDATE por status; a condição no status atual impede regressões vindas do banco"""
+        by_status = {}
+        for message_pk, status in batch.items():
+            by_status.setdefault(status, []).append(message_pk)
+
+        now = datetime.utcnow()
+        updated = 0
+        with self.app.app_context():
+            for status, message_pks in by_status.items():
+                higher_or_equal = [name for name, rank in STATUS_RANK.items() if rank >= STATUS_RANK[status]]
+                result = db.session.execute(
+                    update(Message)
+                    .where(Message.id.in_(message_pks), Message.status.notin_(higher_or_equal))
+                    .values(status=status, processed_at=now)
+                    .execution_options(synchronize_session=False)
+                )
+                updated += result.rowcount
+            db.session.commit()
+
+        self.flushes += 1
+        self.applied += updated
+        counts = ', '.join(f'{status}: {len(message_pks)}' for status, message_pks in by_status.items())
+        self.log_system('INFO', f'{len(batch)} DLRs aplicados em lote ({counts}; {updated} alterados)')
+
+    def stats(self):
+        """Estatísticas do buffer de status"""
+        return {
+            'pending': len(self._pending),
+            'received': self.received,
+            'dropped': self.dropped,
+            'applied': self.applied,
+            'flushes': self.flushes,
+            'failures': self.failures
+        }
@@ -0,0 +1,229 @@
+"""
+Buffer de escrita em lote para mensagens recebidas pelos conectores SMPP
+"""
+import os
+import sys
+import json
+import time
+import queue
+import threading
+from sqlalchemy import insert
+from sqlalchemy.exc import DBAPIError, IntegrityError, OperationalError
+
+# Adiciona o diretório src ao path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from models import db, Message, SystemLog
+from task_stream import TaskStream, MESSAGE_STREAM, WORKER_GROUP
+
+# Mensagens que o banco recusa (ex: campo longo demais) ficam aqui em vez de travar o buffer
+INBOUND_DEAD_LETTER = 'stream:inbound:dead'
+
+
+class _Batch:
+    """Lote em gravação; o progresso sobrevive às novas tentativas de _run"""
+
+    def __init__(self, rows):
+        self.rows = rows            # ainda não gravadas
+        self.inserted = []          # gravadas, a enfileirar para o worker
+        self.committed = False
+
+    def __len__(self):
+        return len(self.rows) + len(self.inserted)
+
+
+class InboundBuffer:
+    """Fila limitada de mensagens recebidas, gravadas em group commit por uma thread de fundo"""
+
+    def __init__(self, app, redis_client, module='smpp'):
+        self.app = app
+        self.redis = redis_client
+        self.module = module
+        self.message_stream = TaskStream(redis_client, MESSAGE_STREAM, WORKER_GROUP)
+
+        self.max_size = int(os.getenv('INBOUND_BUFFER_SIZE', '10000'))
+        self.batch_size = int(os.getenv('INBOUND_BATCH_SIZE', '500'))
+        self.flush_interval = float(os.getenv('INBOUND_FLUSH_MS', '50')) / 1000
+
+        self.queue = queue.Queue(maxsize=self.max_size)
+        self.running = False
+        self.thread = None
+
+        # Estatísticas
+        self.accepted = 0
+        self.rejected = 0
+        self.flushed = 0
+        self.flushes = 0
+        self.failures = 0
+        self.dead_lettered = 0
+        self.last_flush_ms = 0.0
+
+    def log_system(self, level, message, module=None):
+        """Registra log no sistema"""
+        try:
+            with self.app.app_context():
+                log_entry = SystemLog(level=level, message=message, module=module or self.module)
+                db.session.add(log_entry)
+                db.session.commit()
+        except Exception as e:
+            print(f"Erro ao registrar log: {e}")
+
+    def start(self):
+        """Inicia a thread de gravação"""
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=10):
+        """Para a thread de gravação após esvaziar o buffer"""
+        self.running = False
+        if self.thread:
+            self.thread.join(timeout)
+
+    def offer(self, row):
+        """Enfileira uma mensagem (dict de colunas de Message); False se o buffer estiver cheio"""
+        try:
+            self.queue.put_nowait(row)
+            self.accepted += 1
+            return True
+        except queue.Full:
+            self.rejected += 1
+            return False
+
+    def depth(self):
+        """Quantidade de mensagens aguardando gravação"""
+        return self.queue.qsize()
+
+    def _next_batch(self):
+        """Aguarda a primeira mensagem e junta as seguintes até o tamanho ou janela de tempo"""
+        try:
+            batch = [self.queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        backoff = 1
+        batch = None
+
+        while self.running or batch or not self.queue.empty():
+            if not batch:
+                rows = self._next_batch()
+                if not rows:
+                    continue
+                batch = _Batch(rows)
+
+            try:
+                self.flush(batch)
+                batch = None
+                backoff = 1
+            except Exception as e:
+                # Mantém o lote: as mensagens já foram confirmadas ao SMSC e não podem ser perdidas
+                self.failures += 1
+                self.log_system('ERROR', f'Erro ao gravar lote de {len(batch)} mensagens recebidas: {e}')
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+
+    def flush(self, batch):
+        """Grava o lote em um único commit e enfileira as mensagens para o worker
+
+        Uma nova tentativa do mesmo lote retoma de onde parou: linhas já gravadas não são reinseridas
+        (o que as faria parecer duplicadas) e só o enfileiramento é repetido.
+        """
+        started = time.perf_counter()
+
+        if not batch.committed:
+            with self.app.app_context():
+                self._insert(batch)
+            batch.committed = True
+
+        if batch.inserted:
+            message_ids = [row['message_id'] for row in batch.inserted]
+            with self.app.app_context():
+                ids = dict(
+                    db.session.query(Message.message_id, Message.id).filter(Message.message_id.in_(message_ids))
+                )
+            self.message_stream.add_many([
+                {'message_id': ids[message_id], 'action': 'classify_and_deliver'}
+                for message_id in message_ids if message_id in ids
+            ])
+
+        count = len(batch.inserted)
+        self.flushes += 1
+        self.flushed += count
+        self.last_flush_ms = (time.perf_counter() - started) * 1000
+
+        self.log_system('INFO', f'{count} mensagens recebidas gravadas em lote ({self.last_flush_ms:.0f}ms)')
+
+    def _insert(self, batch):
+        try:
+            db.session.execute(insert(Message), batch.rows)
+            db.session.commit()
+        except OperationalError:
+            # Banco indisponível: o lote inteiro é tentado de novo
+            db.session.rollback()
+            raise
+        except DBAPIError:
+            # Duplicata ou linha recusada: grava individualmente para isolar as linhas problemáticas
+            db.session.rollback()
+            self._insert_individually(batch)
+            return
+        batch.inserted.extend(batch.rows)
+        batch.rows = []
+
+    def _insert_individually(self, batch):
+        while batch.rows:
+            row = batch.rows[0]
+            try:
+                db.session.execute(insert(Message), [row])
+                db.session.commit()
+                batch.inserted.append(row)
+            except IntegrityError:
+                db.session.rollback()
+                self.log_system('WARNING', f'Mensagem duplicada ignorada: {row["message_id"]}')
+            except OperationalError:
+                # Banco indisponível: a nova tentativa retoma a partir desta linha
+                db.session.rollback()
+                raise
+            except DBAPIError as e:
+                db.session.rollback()
+                self._dead_letter(row, e)
+            batch.rows.pop(0)
+
+    def _dead_letter(self, row, error):
+        """Guarda no Redis uma mensagem que o banco recusa, para análise e regravação manual"""
+        self.redis.xadd(INBOUND_DEAD_LETTER, {
+            'row': json.dumps(row, default=str),
+            'module': self.module,
+            'error': str(getattr(error, 'orig', error))
+        })
+        self.dead_lettered += 1
+        self.log_system('ERROR', f'Mensagem recebida {row["message_id"]} recusada pelo banco e movida para '
+                                 f'{INBOUND_DEAD_LETTER}: {getattr(error, "orig", error)}')
+
+    def stats(self):
+        """Estatísticas do buffer"""
+        return {
+            'depth': self.depth(),
+            'capacity': self.max_size,
+            'accepted': self.accepted,
+            'rejected': self.rejected,
+            'flushed': self.flushed,
+            'flushes': self.flushes,
+            'avg_batch': (self.flushed / self.flushes) if self.flushes else 0.0,
+            'last_flush_ms': self.last_flush_ms,
+            'failures': self.failures,
+            'dead_lettered': self.dead_lettered
+        }
@@ -0,0 +1,85 @@
+"""
+Supressão de deliver_sm repetidos (retransmissões do SMSC quando o deliver_sm_resp atrasa)
+"""
+import os
+import sys
+import hashlib
+
+# Adiciona o diretório src ao path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from dlr_parser import parse_receipt
+
+DEDUP_PREFIX = 'inbound:seen'
+# Prefixo das impressões digitais baseadas no id do SMSC (recibos), que não se repetem entre mensagens
+RECEIPT_PREFIX = 'r:'
+
+# TLVs que distinguem PDUs com o mesmo texto (partes SAR, recibos via TLV)
+_FINGERPRINT_TLVS = ('sar_msg_ref_num', 'sar_segment_seqnum', 'receipted_message_id', 'message_state', 'message_payload')
+
+
+class InboundDeduplicator:
+    """Impressão digital do deliver_sm guardada no Redis com TTL (SET NX: uma ida ao Redis por PDU)"""
+
+    def __init__(self, redis_client, ttl=None, receipt_ttl=None):
+        self.redis = redis_client
+        # MO sem id do SMSC só se distingue pelo conteúdo: a janela cobre apenas as retransmissões
+        # (dezenas de segundos); o assinante que repete a mesma palavra-chave (ex: SIM, SAIR) para o
+        # mesmo número dentro dela é descartado, então aumentá-la troca duplicados por mensagens perdidas
+        self.ttl = ttl or int(os.getenv('INBOUND_DEDUP_TTL', '30'))
+        # Recibos têm o id da mensagem no SMSC: a janela pode ser longa sem descartar nada legítimo
+        self.receipt_ttl = receipt_ttl or int(os.getenv('INBOUND_DEDUP_RECEIPT_TTL', '300'))
+        self.checked = 0
+        self.suppressed = 0
+        self.errors = 0
+
+    def fingerprint(self, smsc, pdu):
+        """Id do recibo no SMSC quando houver; senão hash de SMSC, origem, destino, esm_class, data_coding,
+        conteúdo e TLVs relevantes"""
+        if pdu.esm_class & 0x04:  # Delivery receipt
+            receipt = parse_receipt(pdu)
+            if receipt:
+                # O mesmo id volta com outro estado (ex: ENROUTE e depois DELIVRD): o estado faz parte da chave
+                digest = hashlib.blake2b(f'{smsc}\x00{receipt.id}\x00{receipt.stat}'.encode(), digest_size=16)
+                return RECEIPT_PREFIX + digest.hexdigest()
+
+        digest = hashlib.blake2b(digest_size=16)
+        for value in (smsc, pdu.source_addr, pdu.dest_addr, pdu.esm_class, getattr(pdu, 'data_coding', None)):
+            digest.update(str(value).encode())
+            digest.update(b'\x00')
+        digest.update(pdu.short_message or b'')
+        for name in _FINGERPRINT_TLVS:
+            value = getattr(pdu, name, None)
+            if value is not None:
+                digest.update(b'\x00' + name.encode() + b'=' + (value if isinstance(value, bytes) else str(value).encode()))
+        return digest.hexdigest()
+
+    def seen(self, fingerprint):
+        """Marca a impressão digital; True se ela já existia (PDU repetido)"""
+        self.checked += 1
+        try:
+            ttl = self.receipt_ttl if fingerprint.startswith(RECEIPT_PREFIX) else self.ttl
+            first = self.redis.set(f'{DEDUP_PREFIX}:{fingerprint}', 1, nx=True, ex=ttl)
+        except Exception:
+            # Redis indisponível: melhor um possível duplicado que uma mensagem perdida
+            self.errors += 1
+            return False
+        if first:
+            return False
+        self.suppressed += 1
+        return True
+
+    def forget(self, fingerprint):
+        """Desfaz a marca de um PDU recusado (ex: buffer cheio), para aceitar a retransmissão"""
+        try:
+            self.redis.delete(f'{DEDUP_PREFIX}:{fingerprint}')
+        except Exception:
+            self.errors += 1
+
+    def stats(self):
+        """Estatísticas da deduplicação"""
+        return {
+            'checked': self.checked,
+            'suppressed': self.suppressed,
+            'errors': self.errors
+        }
@@ -4,9 +4,9 @@ Aplicação Flask principal do Sistema SMPP
 import os
 import sys
 import json
-import re
 import hashlib
 import hmac
+from uuid import uuid4
 from datetime import datetime, timedelta
 from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, session
 from flask_sqlalchemy import SQLAlchemy
@@ -14,6 +14,8 @@ from flask_socketio import SocketIO, emit, join_room, leave_room
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.exceptions import BadRequest
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
 import redis
 from dotenv import load_dotenv
 
@@ -21,6 +23,14 @@ from dotenv import load_dotenv
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from models import db, User, Client, Service, PhoneNumber, Message, MessageDelivery, SMSCConfig, SystemLog
+from service_cache import ServiceCache
+from routing_index import RoutingIndex
+from api_key_cache import ApiKeyCache
+from service_matcher import validate_pattern
+from metrics import read_metrics
+from sms_encoding import count_segments
+from task_stream import TaskStream, MESSAGE_STREAM, SEND_STREAM, WORKER_GROUP, SENDER_GROUP
+from webhook_delivery import read_breakers
 
 # Carrega variáveis de ambiente
 load_dotenv()
@@ -54,6 +64,29 @@ redis_client = redis.Redis(
     decode_responses=True
 )
 
+# Catálogo de serviços compilado, compartilhado pelas rotas deste processo
+service_cache = ServiceCache(app, redis_client)
+
+# Roteamento DID → cliente em memória, atualizado a cada criação/edição de DID ou cliente
+routing_index = RoutingIndex(app, redis_client)
+
+# Autenticação da API REST sem consulta ao banco a cada requisição
+api_key_cache = ApiKeyCache()
+routing_index.add_listener(api_key_cache.on_change)
+
+# Filas de tarefas do worker e dos conectores SMPP (Redis Streams)
+message_stream = TaskStream(redis_client, MESSAGE_STREAM, WORKER_GROUP)
+send_stream = TaskStream(redis_client, SEND_STREAM, SENDER_GROUP)
+
+# Máximo de registros aceitos por requisição em /api/v1/mo/batch
+MO_BATCH_MAX = int(os.getenv('MO_BATCH_MAX', '1000'))
+
+# Campos de texto de um registro do lote: obrigatório e tamanho máximo (None = sem limite)
+MO_RECORD_FIELDS = {
+    name: (name in ('source_addr', 'destination_addr', 'short_message'), Message.__table__.c[name].type.length)
+    for name in ('message_id', 'source_addr', 'destination_addr', 'short_message', 'message_type', 'smpp_message_id')
+}
+
 # ==================== UTILITÁRIOS ====================
 
 def log_system(level, message, module='main'):
@@ -76,27 +109,96 @@ def verify_webhook_signature(payload, signature, secret):
 
 def classify_message(message_text):
     """Classifica mensagem por serviço baseado em regex"""
-    services = Service.query.filter_by(is_active=True).all()
-    
-    for service in services:
-        try:
-            if re.search(service.regex_pattern, message_text, re.IGNORECASE):
-                return service
-        except re.error:
+    try:
+        return service_cache.get_matcher().match_first(message_text)
+    except Exception as e:
+        log_system('ERROR', f'Erro ao classificar mensagem: {e}', 'classifier')
+        return None
+
+def get_client_by_did(destination_addr):
+    """Obtém a rota (DID e cliente) baseada no DID, sem consultar o banco"""
+    return routing_index.lookup(destination_addr)
+
+def authenticate_api_key(api_key):
+    """Obtém o cliente ativo dono da API key (cache com TTL, inclusive para chaves inválidas)"""
+    routing_index.ensure_listener()
+    return api_key_cache.authenticate(
+        api_key,
+        lambda key: Client.query.filter_by(api_key=key, is_active=True).first()
+    )
+
+def enqueue_messages(message_ids, action='classify_and_deliver'):
+    """Envia várias mensagens para o worker em um único pipeline do Redis"""
+    message_stream.add_many([{'message_id': message_id, 'action': action} for message_id in message_ids])
+
+def parse_int_field(name, default, minimum=0):
+    """Campo inteiro do formulário, com valor padrão se vazio/inválido"""
+    try:
+        return max(minimum, int(request.form.get(name) or default))
+    except ValueError:
+        return default
+
+def validate_mo_record(record):
+    """Erro de um registro do lote de MO (tipo e tamanho de cada campo), ou None se válido"""
+    if not isinstance(record, dict):
+        return 'Invalid record'
+    for name, (required, max_length) in MO_RECORD_FIELDS.items():
+        value = record.get(name)
+        if value is None:
+            if required:
+                return f'Missing field: {name}'
             continue
-    
+        if not isinstance(value, str):
+            return f'Invalid field: {name} must be a string'
+        if required and not value:
+            return f'Missing field: {name}'
+        if max_length and len(value) > max_length:
+            return f'Invalid field: {name} longer than {max_length} characters'
     return None
 
-def get_client_by_did(destination_addr):
-    """Obtém cliente baseado no DID"""
-    phone_number = PhoneNumber.query.filter_by(
-        number=destination_addr,
-        is_active=True
-    ).first()
+def insert_mo_rows(rows, results, generated_ids=()):
+    """Grava as MO do lote em um INSERT; em conflito (retransmissão concorrente) grava uma a uma
+
+    Só ids enviados pelo cliente são reportados como 'duplicate': um conflito num id gerado aqui é erro.
+    """
+    try:
+        db.session.execute(insert(Message), [row for index, row in rows])
+        db.session.commit()
+        return rows
+    except IntegrityError:
+        db.session.rollback()
     
-    if phone_number:
-        return phone_number.client
-    return None
+    inserted = []
+    for index, row in rows:
+        try:
+            db.session.execute(insert(Message), [row])
+            db.session.commit()
+            inserted.append((index, row))
+        except IntegrityError:
+            db.session.rollback()
+            if row['message_id'] in generated_ids:
+                results[index] = {'index': index, 'status': 'error', 'error': 'conflict on insert'}
+            else:
+                results[index] = {'index': index, 'status': 'duplicate', 'message_id': row['message_id']}
+    return inserted
+
+def parse_batch_records():
+    """Lê os registros do lote em JSON (lista ou {"messages": [...]}) ou NDJSON"""
+    if request.mimetype in ('application/x-ndjson', 'application/ndjson'):
+        records = []
+        for line in request.get_data(as_text=True).splitlines():
+            if not line.strip():
+                continue
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                records.append(None)
+        return records
+    
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        data = data.get('messages')
+    return data if isinstance(data, list) else None
 
 # ==================== ROTAS DE AUTENTICAÇÃO ====================
 
@@ -162,7 +264,15 @@ def dashboard():
 def clients():
     """Lista de clientes"""
     clients = Client.query.order_by(Client.created_at.desc()).all()
-    return render_template('clients.html', clients=clients)
+    
+    # Circuit breaker da entrega de webhooks publicado pelos workers
+    try:
+        breakers = read_breakers(redis_client)
+    except Exception as e:
+        log_system('WARNING', f'Erro ao ler estado dos webhooks: {e}', 'clients')
+        breakers = {}
+    
+    return render_template('clients.html', clients=clients, breakers=breakers)
 
 @app.route('/clients/new', methods=['GET', 'POST'])
 @login_required
@@ -173,10 +283,14 @@ def new_client():
             name=request.form['name'],
             email=request.form['email'],
             webhook_url=request.form.get('webhook_url'),
+            webhook_weight=parse_int_field('webhook_weight', 1, minimum=1),
+            webhook_batch_size=parse_int_field('webhook_batch_size', 0),
+            webhook_batch_ms=parse_int_field('webhook_batch_ms', 1000, minimum=1),
             is_active=bool(request.form.get('is_active'))
         )
         db.session.add(client)
         db.session.commit()
+        routing_index.notify('client', client.id)
         log_system('INFO', f'Cliente {client.name} criado', 'clients')
         flash('Cliente criado com sucesso', 'success')
         return redirect(url_for('clients'))
@@ -193,9 +307,13 @@ def edit_client(client_id):
         client.name = request.form['name']
         client.email = request.form['email']
         client.webhook_url = request.form.get('webhook_url')
+        client.webhook_weight = parse_int_field('webhook_weight', 1, minimum=1)
+        client.webhook_batch_size = parse_int_field('webhook_batch_size', 0)
+        client.webhook_batch_ms = parse_int_field('webhook_batch_ms', 1000, minimum=1)
         client.is_active = bool(request.form.get('is_active'))
         client.updated_at = datetime.utcnow()
         db.session.commit()
+        routing_index.notify('client', client.id)
         log_system('INFO', f'Cliente {client.name} atualizado', 'clients')
         flash('Cliente atualizado com sucesso', 'success')
         return redirect(url_for('clients'))
@@ -216,20 +334,120 @@ def services():
 def new_service():
     """Criar novo serviço"""
     if request.method == 'POST':
+        # Rejeita regex inválidas ou com risco de backtracking catastrófico
+        problems = validate_pattern(request.form['regex_pattern'])
+        if problems:
+            flash(f'Regex rejeitada: {"; ".join(problems)}', 'error')
+            return render_template('service_form.html')
+        
         service = Service(
             name=request.form['name'],
             description=request.form.get('description'),
             regex_pattern=request.form['regex_pattern'],
+            priority=request.form.get('priority', 100, type=int),
             is_active=bool(request.form.get('is_active'))
         )
         db.session.add(service)
         db.session.commit()
+        
+        # Notifica API, worker e conectores para recarregarem o catálogo
+        service_cache.bump_version()
+        
         log_system('INFO', f'Serviço {service.name} criado', 'services')
         flash('Serviço criado com sucesso', 'success')
         return redirect(url_for('services'))
     
     return render_template('service_form.html')
 
+@app.route('/api/v1/services/profile')
+@login_required
+def api_services_profile():
+    """Custo de classificação por serviço, somado entre os processos"""
+    try:
+        snapshots = read_metrics(redis_client, 'classifier')
+    except Exception as e:
+        log_system('ERROR', f'Erro ao ler perfil dos serviços: {e}', 'services')
+        return jsonify({'error': 'Internal server error'}), 500
+    
+    services = {}
+    for instance, profile in snapshots.items():
+        for entry in profile:
+            service = services.setdefault(entry['service_id'], {
+                'service_id': entry['service_id'],
+                'name': entry['name'],
+                'priority': entry['priority'],
+                'rank': entry['rank'],
+                'evaluations': 0,
+                'hits': 0,
+                'total_us': 0.0,
+                'p99_us': [],
+                'suspended': False
+            })
+            service['evaluations'] += entry['evaluations']
+            service['hits'] += entry['hits']
+            service['rank'] = min(service['rank'], entry['rank'])
+            service['total_us'] += entry['total_us']
+            service['p99_us'].append(entry['p99_us'])
+            service['suspended'] = service['suspended'] or entry['suspended']
+    
+    result = []
+    for service in services.values():
+        # p99 agregado aproximado: o pior p99 entre os processos
+        service['p99_us'] = max(service['p99_us']) if service['p99_us'] else 0.0
+        service['avg_us'] = service['total_us'] / service['evaluations'] if service['evaluations'] else 0.0
+        result.append(service)
+    
+    result.sort(key=lambda service: service['total_us'], reverse=True)
+    return jsonify({'services': result, 'processes': len(snapshots)})
+
+@app.route('/api/v1/services/<int:service_id>/resume', methods=['POST'])
+@login_required
+def api_resume_service(service_id):
+    """Libera um serviço suspenso por custo recarregando o catálogo em todos os processos"""
+    service = Service.query.get_or_404(service_id)
+    
+    # Suspensões não sobrevivem ao recarregamento; se a regex continuar lenta volta a ser suspensa
+    service_cache.bump_version()
+    
+    log_system('INFO', f'Suspensão da regex do serviço {service.name} liberada pelo painel', 'services')
+    return jsonify({'status': 'ok'})
+
+@app.route('/api/v1/connector/metrics')
+@login_required
+def api_connector_metrics():
+    """Métricas dos conectores SMPP em execução (buffer de entrada, latência do deliver_sm_resp)"""
+    try:
+        snapshots = read_metrics(redis_client, 'connector')
+    except Exception as e:
+        log_system('ERROR', f'Erro ao ler métricas dos conectores: {e}', 'smpp')
+        return jsonify({'error': 'Internal server error'}), 500
+
+    return jsonify({'connectors': snapshots})
+
+@app.route('/api/v1/delivery/metrics')
+@login_required
+def api_delivery_metrics():
+    """Métricas do motor de entrega de webhooks de cada worker (concorrência, latência por requisição)"""
+    try:
+        snapshots = read_metrics(redis_client, 'delivery')
+    except Exception as e:
+        log_system('ERROR', f'Erro ao ler métricas de entrega: {e}', 'delivery')
+        return jsonify({'error': 'Internal server error'}), 500
+
+    return jsonify({'workers': snapshots})
+
+@app.route('/api/v1/queues')
+@login_required
+def api_queues():
+    """Tamanho, pendentes e atraso (lag) dos grupos de consumidores das filas de tarefas"""
+    try:
+        streams = [message_stream.stats(), send_stream.stats()]
+    except Exception as e:
+        log_system('ERROR', f'Erro ao ler estado das filas: {e}', 'worker')
+        return jsonify({'error': 'Internal server error'}), 500
+
+    return jsonify({'queues': streams})
+
 # ==================== GESTÃO DE DIDs ====================
 
 @app.route('/phone-numbers')
@@ -252,6 +470,7 @@ def new_phone_number():
         )
         db.session.add(phone_number)
         db.session.commit()
+        routing_index.notify('did', phone_number.id)
         log_system('INFO', f'DID {phone_number.number} criado', 'phone_numbers')
         flash('Número telefônico criado com sucesso', 'success')
         return redirect(url_for('phone_numbers'))
@@ -283,7 +502,7 @@ def api_get_messages():
     if not api_key:
         return jsonify({'error': 'API key required'}), 401
     
-    client = Client.query.filter_by(api_key=api_key, is_active=True).first()
+    client = authenticate_api_key(api_key)
     if not client:
         return jsonify({'error': 'Invalid API key'}), 401
     
@@ -343,28 +562,23 @@ def api_receive_mo():
         )
         
         # Classifica por serviço
-        service = classify_message(data['short_message'])
-        if service:
-            message.service_id = service.id
+        match = classify_message(data['short_message'])
+        if match:
+            message.service_id = match.service_id
         
         # Associa ao cliente via DID
-        client = get_client_by_did(data['destination_addr'])
-        if client:
-            phone_number = PhoneNumber.query.filter_by(
-                number=data['destination_addr'],
-                client_id=client.id
-            ).first()
-            if phone_number:
-                message.phone_number_id = phone_number.id
+        route = get_client_by_did(data['destination_addr'])
+        if route:
+            message.phone_number_id = route.phone_number_id
         
         db.session.add(message)
         db.session.commit()
         
         # Envia para processamento assíncrono
-        redis_client.lpush('message_queue', json.dumps({
+        message_stream.add({
             'message_id': message.id,
             'action': 'classify_and_deliver'
-        }))
+        })
         
         log_system('INFO', f'MO recebida: {message.message_id}', 'api')
         
@@ -374,6 +588,95 @@ def api_receive_mo():
         log_system('ERROR', f'Erro ao processar MO: {str(e)}', 'api')
         return jsonify({'error': 'Internal server error'}), 500
 
+@app.route('/api/v1/mo/batch', methods=['POST'])
+def api_receive_mo_batch():
+    """API para recebimento de lotes de MO/DLR (JSON ou NDJSON)"""
+    records = parse_batch_records()
+    if records is None:
+        return jsonify({'error': 'Expected a JSON array, {"messages": [...]} or NDJSON body'}), 400
+    if len(records) > MO_BATCH_MAX:
+        return jsonify({'error': f'Batch too large (max {MO_BATCH_MAX} records)'}), 413
+    
+    try:
+        results = [None] * len(records)
+        accepted = []
+        seen_ids = set()
+        generated_ids = set()
+        
+        # Validação por registro (presença, tipo e tamanho): um registro inválido não derruba o lote
+        for index, record in enumerate(records):
+            error = validate_mo_record(record)
+            if error:
+                results[index] = {'index': index, 'status': 'error', 'error': error}
+                continue
+            
+            message_id = record.get('message_id')
+            if not message_id:
+                # Id gerado: único entre lotes concorrentes, nunca é uma retransmissão
+                message_id = f"mo_{uuid4().hex}"
+                generated_ids.add(message_id)
+                accepted.append((index, message_id, record))
+                continue
+            if message_id in seen_ids:
+                results[index] = {'index': index, 'status': 'duplicate', 'message_id': message_id}
+                continue
+            seen_ids.add(message_id)
+            accepted.append((index, message_id, record))
+        
+        # Retransmissões já gravadas (ids enviados pelo cliente) com uma única consulta
+        existing_ids = set()
+        if seen_ids:
+            existing_ids = {
+                row.message_id for row in
+                db.session.query(Message.message_id).filter(Message.message_id.in_(seen_ids))
+            }
+        
+        rows = []
+        for index, message_id, record in accepted:
+            if message_id in existing_ids:
+                results[index] = {'index': index, 'status': 'duplicate', 'message_id': message_id}
+                continue
+            
+            match = classify_message(record['short_message'])
+            route = get_client_by_did(record['destination_addr'])
+            rows.append((index, {
+                'message_id': message_id,
+                'source_addr': record['source_addr'],
+                'destination_addr': record['destination_addr'],
+                'short_message': record['short_message'],
+                'message_type': record.get('message_type') or 'MO',
+                'smpp_message_id': record.get('smpp_message_id'),
+                'service_id': match.service_id if match else None,
+                'phone_number_id': route.phone_number_id if route else None
+            }))
+            results[index] = {'index': index, 'status': 'success', 'message_id': message_id}
+        
+        if rows:
+            # INSERT multi-linha único para todo o lote
+            rows = insert_mo_rows(rows, results, generated_ids)
+        
+        if rows:
+            inserted = dict(
+                db.session.query(Message.message_id, Message.id).filter(
+                    Message.message_id.in_([row['message_id'] for index, row in rows])
+                )
+            )
+            enqueue_messages([inserted[row['message_id']] for index, row in rows])
+            
+            log_system('INFO', f'Lote de MO recebido: {len(rows)} de {len(records)} registros aceitos', 'api')
+        
+        return jsonify({
+            'status': 'success',
+            'accepted': len(rows),
+            'rejected': len(records) - len(rows),
+            'results': results
+        })
+        
+    except Exception as e:
+        db.session.rollback()
+        log_system('ERROR', f'Erro ao processar lote de MO: {str(e)}', 'api')
+        return jsonify({'error': 'Internal server error'}), 500
+
 @app.route('/api/v1/send', methods=['POST'])
 def api_send_sms():
     """API para envio de SMS"""
@@ -381,7 +684,7 @@ def api_send_sms():
     if not api_key:
         return jsonify({'error': 'API key required'}), 401
     
-    client = Client.query.filter_by(api_key=api_key, is_active=True).first()
+    client = authenticate_api_key(api_key)
     if not client:
         return jsonify({'error': 'Invalid API key'}), 401
     
@@ -394,6 +697,12 @@ def api_send_sms():
             if field not in data:
                 return jsonify({'error': f'Missing field: {field}'}), 400
         
+        # Segmentos necessários (GSM-7 ou UCS-2 concatenado)
+        try:
+            segments = count_segments(data['short_message'])
+        except Exception:
+            return jsonify({'error': 'Message too long'}), 400
+        
         # Cria mensagem de envio
         message = Message(
             message_id=f"send_{datetime.utcnow().timestamp()}",
@@ -401,25 +710,27 @@ def api_send_sms():
             destination_addr=data['destination_addr'],
             short_message=data['short_message'],
             message_type='SMS',
-            status='pending'
+            status='pending',
+            segments=segments
         )
         
         db.session.add(message)
         db.session.commit()
         
         # Envia para fila de envio SMPP
-        redis_client.lpush('send_queue', json.dumps({
+        send_stream.add({
             'message_id': message.id,
             'destination_addr': data['destination_addr'],
             'short_message': data['short_message']
-        }))
+        })
         
         log_system('INFO', f'SMS enviado via API: {message.message_id}', 'api')
         
         return jsonify({
             'status': 'success',
             'message_id': message.message_id,
-            'status': 'queued'
+            'status': 'queued',
+            'segments': segments
         })
         
     except Exception as e:
@@ -449,18 +760,18 @@ def webhook_sms():
         )
         
         # Classifica por serviço
-        service = classify_message(data.get('short_message', ''))
-        if service:
-            message.service_id = service.id
+        match = classify_message(data.get('short_message', ''))
+        if match:
+            message.service_id = match.service_id
         
         db.session.add(message)
         db.session.commit()
         
         # Envia para processamento
-        redis_client.lpush('message_queue', json.dumps({
+        message_stream.add({
             'message_id': message.id,
             'action': 'classify_and_deliver'
-        }))
+        })
         
         log_system('INFO', f'Webhook recebido: {message.message_id}', 'webhook')
         
@@ -499,12 +810,14 @@ def create_app():
     """Factory para criar a aplicação"""
     with app.app_context():
         db.create_all()
+    routing_index.load()
     return app
 
 if __name__ == '__main__':
     # Cria tabelas se não existirem
     with app.app_context():
         db.create_all()
+    routing_index.load()
     
     # Inicia aplicação
     socketio.run(app, 
@@ -0,0 +1,69 @@
+"""
+Métricas de desempenho por processo, publicadas no Redis para o painel administrativo
+"""
+import os
+import json
+import time
+import socket
+
+# Hash por componente (metrics:classifier, metrics:connector, ...) com um campo por processo
+METRICS_KEY_PREFIX = 'metrics:'
+METRICS_TTL = int(os.getenv('METRICS_TTL', '120'))
+
+
+def instance_id():
+    """Identificador do processo atual (host:pid)"""
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def percentile(samples, fraction):
+    """Percentil simples sobre uma amostra (ex: fraction=0.99)"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def publish_metrics(redis_client, component, payload):
+    """Publica o snapshot de métricas deste processo"""
+    key = f'{METRICS_KEY_PREFIX}{component}'
+    redis_client.hset(key, instance_id(), json.dumps({'updated_at': time.time(), 'data': payload}))
+    redis_client.expire(key, METRICS_TTL)
+
+
+def read_metrics(redis_client, component):
+    """Lê os snapshots recentes de todos os processos de um componente"""
+    snapshots = {}
+    now = time.time()
+    for instance, raw in redis_client.hgetall(f'{METRICS_KEY_PREFIX}{component}').items():
+        try:
+            snapshot = json.loads(raw)
+        except ValueError:
+            continue
+        if now - snapshot.get('updated_at', 0) <= METRICS_TTL:
+            snapshots[instance] = snapshot['data']
+    return snapshots
+
+
+class MetricsPublisher:
+    """Publica periodicamente um snapshot de métricas, chamado a partir do laço do processo"""
+
+    def __init__(self, redis_client, component, interval=None):
+        self.redis = redis_client
+        self.component = component
+        self.interval = interval or int(os.getenv('METRICS_PUBLISH_INTERVAL', '10'))
+        self._last_publish = 0.0
+
+    def maybe_publish(self, snapshot_func):
+        """Publica se o intervalo expirou; nunca propaga erros do Redis"""
+        now = time.monotonic()
+        if now - self._last_publish < self.interval:
+            return False
+        self._last_publish = now
+        try:
+            publish_metrics(self.redis, self.component, snapshot_func())
+            return True
+        except Exception as e:
+            print(f"Erro ao publicar métricas {self.component}: {e}")
+            return False
@@ -5,7 +5,8 @@ import os
 import sys
 from datetime import datetime
 from dotenv import load_dotenv
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, text, inspect
+from sqlalchemy.schema import CreateColumn
 from sqlalchemy.exc import OperationalError
 import pymysql
 
@@ -65,6 +66,37 @@ def create_tables():
         print(f"❌ Erro ao criar tabelas: {e}")
         return False
 
+def upgrade_schema():
+    """Adiciona colunas e índices novos às tabelas já existentes"""
+    try:
+        database_url = get_database_url()
+        engine = create_engine(database_url)
+        inspector = inspect(engine)
+        
+        with engine.begin() as conn:
+            for table in db.metadata.sorted_tables:
+                if not inspector.has_table(table.name):
+                    continue
+                
+                existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+                for column in table.columns:
+                    if column.name in existing_columns:
+                        continue
+                    column_ddl = CreateColumn(column).compile(dialect=engine.dialect)
+                    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column_ddl}"))
+                    print(f"✅ Coluna {table.name}.{column.name} adicionada")
+                
+                existing_indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+                for index in table.indexes:
+                    if index.name not in existing_indexes:
+                        index.create(conn)
+                        print(f"✅ Índice {index.name} criado")
+        
+        return True
+    except Exception as e:
+        print(f"❌ Erro ao atualizar tabelas: {e}")
+        return False
+
 def create_default_data():
     """Cria dados padrão do sistema"""
     try:
@@ -207,6 +239,10 @@ def main():
     if not create_tables():
         return False
     
+    # Atualiza tabelas criadas por versões anteriores
+    if not upgrade_schema():
+        return False
+    
     # Cria dados padrão
     if not create_default_data():
         return False
@@ -0,0 +1,193 @@
+"""
+Remontagem de MO concatenadas (UDH/SAR) e decodificação do short_message pelo data_coding
+"""
+import os
+import json
+import time
+from collections import namedtuple
+import smpplib.gsm
+import smpplib.consts
+
+# Partes guardadas em hashes mo_concat:<origem>:<referência>:<total>; prazo de cada uma no ZSET
+CONCAT_PREFIX = 'mo_concat'
+CONCAT_DEADLINES = 'mo_concat:deadlines'
+
+ConcatPart = namedtuple('ConcatPart', ['reference', 'total', 'number'])
+
+ReassembledMessage = namedtuple('ReassembledMessage', [
+    'key', 'source_addr', 'destination_addr', 'text', 'received', 'total', 'complete', 'sequence_number', 'fields'
+])
+
+
+def _gsm7_decode(data):
+    """Septetos GSM-7 não compactados (um por byte), incluindo a tabela de extensão"""
+    table = smpplib.gsm.GSM_CHARACTER_TABLE
+    chars = []
+    escape = False
+    for byte in data:
+        if escape:
+            char = table[byte + 0x80] if byte < 0x80 else '?'
+            chars.append(' ' if char == '`' else char)
+            escape = False
+        elif byte == 0x1B:
+            escape = True
+        else:
+            chars.append(table[byte] if byte < 0x80 else '?')
+    return ''.join(chars)
+
+
+def decode_short_message(data, data_coding):
+    """Decodifica o short_message conforme o data_coding do deliver_sm"""
+    if not data:
+        return ''
+    if isinstance(data, str):
+        return data
+
+    data_coding = data_coding or 0
+    if data_coding == smpplib.consts.SMPP_ENCODING_ISO10646 or data_coding & 0xFC == 0x18:
+        # UCS-2 (também com classe de mensagem)
+        return data.decode('utf-16-be', errors='replace')
+    if data_coding == smpplib.consts.SMPP_ENCODING_ISO88591:
+        return data.decode('latin-1')
+    if data_coding == smpplib.consts.SMPP_ENCODING_IA5:
+        return data.decode('ascii', errors='replace')
+    if data_coding == smpplib.consts.SMPP_ENCODING_DEFAULT:
+        # Alfabeto padrão do SMSC: GSM-7 pela especificação, mas há SMSCs que usam ASCII/Latin-1
+        encoding = os.getenv('SMPP_DEFAULT_ENCODING', 'gsm7')
+        if encoding == 'gsm7':
+            return _gsm7_decode(data)
+        return data.decode(encoding, errors='replace')
+    if data_coding & 0xFC == 0x10 or data_coding & 0xF4 == 0xF0:
+        # Grupos de classe de mensagem com alfabeto GSM-7
+        return _gsm7_decode(data)
+    return data.decode('utf-8', errors='ignore')
+
+
+def split_concat(pdu, data):
+    """Separa o cabeçalho de concatenação (UDH ou TLVs SAR); retorna (ConcatPart ou None, conteúdo)"""
+    part = None
+    if pdu.esm_class & smpplib.consts.SMPP_GSMFEAT_UDHI and data:
+        length = data[0]
+        header = data[1:1 + length]
+        data = data[1 + length:]
+        index = 0
+        while index + 1 < len(header):
+            iei, iel = header[index], header[index + 1]
+            value = header[index + 2:index + 2 + iel]
+            if iei == 0x00 and iel == 3:
+                part = ConcatPart(value[0], value[1], value[2])
+            elif iei == 0x08 and iel == 4:
+                part = ConcatPart((value[0] << 8) | value[1], value[2], value[3])
+            index += 2 + iel
+    elif getattr(pdu, 'sar_msg_ref_num', None) is not None:
+        part = ConcatPart(pdu.sar_msg_ref_num, getattr(pdu, 'sar_total_segments', None) or 0,
+                          getattr(pdu, 'sar_segment_seqnum', None) or 0)
+
+    # Cabeçalho inválido ou mensagem de uma parte só: trata como mensagem simples
+    if part and not (1 <= part.number <= part.total and part.total > 1):
+        part = None
+    return part, data
+
+
+class MOReassembler:
+    """Junta as partes de uma MO longa no Redis (compartilhado entre binds) até completar ou expirar"""
+
+    def __init__(self, redis_client, timeout=None):
+        self.redis = redis_client
+        self.timeout = timeout or float(os.getenv('MO_CONCAT_TIMEOUT', '60'))
+        self.flush_interval = 1.0
+        self._next_flush = 0.0
+
+        self.parts = 0
+        self.completed = 0
+        self.expired = 0
+
+    def add(self, source_addr, destination_addr, data_coding, part, data, sequence_number):
+        """Guarda uma parte; retorna a mensagem remontada quando todas as partes chegaram"""
+        key = f'{CONCAT_PREFIX}:{source_addr}:{part.reference}:{part.total}'
+        meta = json.dumps({
+            'destination_addr': destination_addr,
+            'data_coding': data_coding,
+            'sequence_number': sequence_number
+        })
+
+        # Partes repetidas (reenvio do SMSC) sobrescrevem o mesmo campo
+        pipeline = self.redis.pipeline(transaction=True)
+        pipeline.hset(key, str(part.number), data.hex())
+        pipeline.hsetnx(key, 'meta', meta)
+        pipeline.hlen(key)
+        pipeline.expire(key, int(self.timeout * 2) + 1)
+        pipeline.zadd(CONCAT_DEADLINES, {key: time.time() + self.timeout}, nx=True)
+        received = pipeline.execute()[2] - 1
+        self.parts += 1
+
+        if received < part.total:
+            return None
+
+        message = self._claim(key, source_addr, part.total, complete=True, sequence_number=sequence_number)
+        if message:
+            self.completed += 1
+        return message
+
+    def flush_expired(self, limit=100):
+        """Retira as mensagens incompletas cujo prazo venceu (no máximo uma vez por segundo)"""
+        now = time.time()
+        if now < self._next_flush:
+            return []
+        self._next_flush = now + self.flush_interval
+
+        messages = []
+        for key in self.redis.zrangebyscore(CONCAT_DEADLINES, 0, now, start=0, num=limit):
+            # ZREM decide qual bind/processo entrega a mensagem
+            if not self.redis.zrem(CONCAT_DEADLINES, key):
+                continue
+            source_addr, _, total = key[len(CONCAT_PREFIX) + 1:].rsplit(':', 2)
+            message = self._claim(key, source_addr, int(total), complete=False)
+            if message:
+                self.expired += 1
+                messages.append(message)
+        return messages
+
+    def restore(self, message, exclude=None):
+        """Devolve as partes ao Redis (ex: buffer de entrada cheio); exclude = parte que o SMSC reenviará"""
+        fields = {field: value for field, value in message.fields.items() if field != str(exclude)}
+        pipeline = self.redis.pipeline(transaction=True)
+        pipeline.hset(message.key, mapping=fields)
+        pipeline.expire(message.key, int(self.timeout * 2) + 1)
+        pipeline.zadd(CONCAT_DEADLINES, {message.key: time.time() + self.timeout}, nx=True)
+        pipeline.execute()
+
+    def _claim(self, key, source_addr, total, complete, sequence_number=None):
+        """Lê e apaga as partes atomicamente; None se outro processo já as retirou"""
+        pipeline = self.redis.pipeline(transaction=True)
+        pipeline.hgetall(key)
+        pipeline.delete(key)
+        pipeline.zrem(CONCAT_DEADLINES, key)
+        fields = pipeline.execute()[0]
+        if not fields:
+            return None
+
+        meta = json.loads(fields.get('meta') or '{}')
+        numbers = sorted(int(field) for field in fields if field != 'meta')
+        # Junta os bytes antes de decodificar: caracteres podem estar divididos entre partes
+        data = b''.join(bytes.fromhex(fields[str(number)]) for number in numbers)
+
+        return ReassembledMessage(
+            key=key,
+            source_addr=source_addr,
+            destination_addr=meta.get('destination_addr'),
+            text=decode_short_message(data, meta.get('data_coding')),
+            received=len(numbers),
+            total=total,
+            complete=complete and len(numbers) >= total,
+            sequence_number=sequence_number or meta.get('sequence_number'),
+            fields=fields
+        )
+
+    def stats(self):
+        """Estatísticas da remontagem"""
+        return {
+            'parts': self.parts,
+            'completed': self.completed,
+            'expired': self.expired
+        }
@@ -42,6 +42,9 @@ class Client(db.Model):
     api_key = db.Column(db.String(64), unique=True, nullable=False, default=lambda: Client.generate_api_key())
     webhook_url = db.Column(db.String(500))
     webhook_secret = db.Column(db.String(64), default=lambda: Client.generate_webhook_secret())
+    webhook_weight = db.Column(db.Integer, default=1)  # peso no round-robin da entrega de webhooks
+    webhook_batch_size = db.Column(db.Integer, default=0)  # > 1: webhooks em lote (array JSON) de até N mensagens
+    webhook_batch_ms = db.Column(db.Integer, default=1000)  # espera máxima para completar um lote
     is_active = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -69,6 +72,7 @@ class Service(db.Model):
     name = db.Column(db.String(100), nullable=False, unique=True)
     description = db.Column(db.Text)
     regex_pattern = db.Column(db.Text, nullable=False)
+    priority = db.Column(db.Integer, default=100, server_default='100', nullable=False)  # menor valor = avaliado primeiro
     is_active = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -109,7 +113,8 @@ class Message(db.Model):
     status = db.Column(db.String(20), default='received')  # received, processed, delivered, failed
     service_id = db.Column(db.Integer, db.ForeignKey('services.id'))
     phone_number_id = db.Column(db.Integer, db.ForeignKey('phone_numbers.id'))
-    smpp_message_id = db.Column(db.String(100))
+    smpp_message_id = db.Column(db.String(100), index=True)  # correlação de DLR
+    segments = db.Column(db.Integer)  # submit_sm usados no envio (SMS de saída)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     processed_at = db.Column(db.DateTime)
     
@@ -124,9 +129,10 @@ class MessageDelivery(db.Model):
     message_id = db.Column(db.Integer, db.ForeignKey('messages.id'), nullable=False)
     client_id = db.Column(db.Integer, db.ForeignKey('clients.id'), nullable=False)
     webhook_url = db.Column(db.String(500))
-    webhook_status = db.Column(db.String(20), default='pending')  # pending, sent, failed
+    webhook_status = db.Column(db.String(20), default='pending')  # pending, spooled, sent, retrying, failed
     webhook_response = db.Column(db.Text)
     webhook_attempts = db.Column(db.Integer, default=0)
+    latency_ms = db.Column(db.Float)  # duração da última requisição ao webhook
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     sent_at = db.Column(db.DateTime)
     
@@ -147,6 +153,10 @@ class SMSCConfig(db.Model):
     username = db.Column(db.String(100), nullable=False)
     password = db.Column(db.String(100), nullable=False)
     system_type = db.Column(db.String(50), default='OTP')
+    bind_count = db.Column(db.Integer, default=1, server_default='1', nullable=False)  # binds simultâneos no modo pool
+    weight = db.Column(db.Integer, default=1, server_default='1', nullable=False)  # peso no round-robin ponderado
+    max_tps = db.Column(db.Integer)  # taxa contratada (mensagens/s); vazio = sem limite
+    burst = db.Column(db.Integer)  # rajada máxima; vazio = max_tps
     is_active = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -0,0 +1,103 @@
+"""
+Limitador de TPS (token bucket) por conta SMSC, com recuo automático em throttling
+"""
+import os
+import time
+import threading
+
+# Saldo informado pelos limitadores sem taxa configurada
+UNLIMITED = 2 ** 31
+
+
+class TokenBucket:
+    """Taxa sustentada em mensagens/s com rajada; rate vazio ou 0 = sem limite"""
+
+    def __init__(self, rate=None, burst=None):
+        self.base_rate = float(rate or 0)
+        self.rate = self.base_rate
+        self.capacity = max(1.0, float(burst or rate or 0))
+        self.tokens = self.capacity
+
+        # Recuo em ESME_RTHROTTLED/ESME_RMSGQFUL: pausa e reduz a taxa, que volta aos poucos
+        self.pause = float(os.getenv('SMPP_THROTTLE_PAUSE_MS', '1000')) / 1000
+        self.min_rate = max(1.0, self.base_rate * float(os.getenv('SMPP_THROTTLE_MIN_FRACTION', '0.1')))
+        self.recovery = float(os.getenv('SMPP_THROTTLE_RECOVERY', '0.01'))
+
+        self.throttle_events = 0
+        self._paused_until = 0.0
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def unlimited(self):
+        return self.base_rate <= 0
+
+    def _refill(self, now):
+        elapsed = now - self._updated_at
+        self._updated_at = now
+        if now >= self._paused_until:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+
+    def available(self):
+        """Quantidade de mensagens que podem ser enviadas agora"""
+        if self.unlimited:
+            return UNLIMITED
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if now < self._paused_until:
+                return 0
+            return int(self.tokens)
+
+    def take(self, count=1):
+        """Consome tokens se houver saldo (mensagens maiores que a rajada deixam o saldo negativo)"""
+        if self.unlimited:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if now < self._paused_until or self.tokens < min(count, self.capacity):
+                return False
+            self.tokens -= count
+            return True
+
+    def wait_time(self, count=1):
+        """Segundos até haver saldo para count mensagens"""
+        if self.unlimited:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            paused = max(0.0, self._paused_until - now)
+            missing = max(0.0, count - self.tokens)
+            return paused + missing / self.rate
+
+    def throttled(self):
+        """SMSC pediu para reduzir: esvazia o balde, pausa e corta a taxa pela metade"""
+        with self._lock:
+            self.throttle_events += 1
+            if self.unlimited:
+                return
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens = 0.0
+            self._paused_until = max(self._paused_until, now + self.pause)
+            self.rate = max(self.min_rate, self.rate / 2)
+
+    def success(self):
+        """Resposta aceita: recupera a taxa gradualmente até a contratada"""
+        if self.unlimited or self.rate >= self.base_rate:
+            return
+        with self._lock:
+            self.rate = min(self.base_rate, self.rate + self.base_rate * self.recovery)
+
+    def stats(self):
+        """Estatísticas do limitador"""
+        return {
+            'rate': self.rate,
+            'base_rate': self.base_rate,
+            'burst': self.capacity,
+            'tokens': self.tokens,
+            'throttle_events': self.throttle_events,
+            'paused': time.monotonic() < self._paused_until
+        }
@@ -0,0 +1,276 @@
+"""
+Reclassificação em massa das mensagens históricas por serviço
+
+Uso:
+    python src/reclassify.py [--dry-run] [--resume] [--chunk-size 5000] [--workers 4] [--types MO]
+
+Por padrão só mensagens MO são reclassificadas (os SMS enviados mantêm o serviço de origem).
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from collections import Counter, deque
+from datetime import datetime
+from multiprocessing import Pool, cpu_count
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, text, bindparam
+
+# Adiciona o diretório src ao path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from migrate import get_database_url
+from service_matcher import ServiceMatcher
+
+# Carrega variáveis de ambiente
+load_dotenv()
+
+# Status que indicam apenas o resultado da classificação (os demais são preservados)
+CLASSIFICATION_STATUSES = ('received', 'classified', 'unclassified')
+
+DEFAULT_CHECKPOINT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'reclassify.checkpoint.json')
+
+# Motor de classificação de cada processo do pool
+_matcher = None
+
+
+def _init_worker(services):
+    """Compila os serviços uma vez por processo do pool"""
+    global _matcher
+    _matcher = ServiceMatcher(services, adaptive=False)
+
+
+def _classify_chunk(rows):
+    """Classifica um lote de (id, texto) e retorna (id, service_id)"""
+    results = []
+    for message_id, short_message in rows:
+        match = _matcher.match_first(short_message) if short_message else None
+        results.append((message_id, match.service_id if match else None))
+    return results
+
+
+def load_services(engine):
+    """Carrega serviços ativos na mesma ordem usada pelo cache de serviços"""
+    with engine.connect() as conn:
+        rows = conn.execute(text(
+            "SELECT id, name, regex_pattern, priority FROM services WHERE is_active = 1 ORDER BY priority, id"
+        )).all()
+    return [(row.id, row.name, row.regex_pattern, row.priority) for row in rows]
+
+
+def read_checkpoint(path):
+    """Lê o último id processado do checkpoint"""
+    try:
+        with open(path) as f:
+            return int(json.load(f).get('last_id', 0))
+    except (OSError, ValueError):
+        return 0
+
+
+def write_checkpoint(path, last_id, stats):
+    """Grava o checkpoint de forma atômica"""
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({'last_id': last_id, 'updated_at': datetime.utcnow().isoformat(), **stats}, f)
+    os.replace(tmp_path, path)
+
+
+def type_filter(message_types):
+    """Trecho SQL e parâmetros que restringem os tipos de mensagem (None: todos)"""
+    if not message_types:
+        return '', {}
+    return " AND message_type IN :message_types", {'message_types': list(message_types)}
+
+
+def stream_chunks(engine, start_id, max_id, chunk_size, message_types=None):
+    """Lê as mensagens em ordem de id em lotes por chave (WHERE id > último), uma consulta curta por lote
+
+    Nenhum cursor fica aberto entre os lotes: a conexão volta ao pool enquanto os UPDATEs são gravados.
+    """
+    type_clause, type_params = type_filter(message_types)
+    statement = text(
+        "SELECT id, short_message, service_id, status FROM messages "
+        "WHERE id > :last_id AND id <= :max_id" + type_clause + " ORDER BY id LIMIT :limit"
+    )
+    if message_types:
+        statement = statement.bindparams(bindparam('message_types', expanding=True))
+
+    last_id = start_id
+    while True:
+        with engine.connect() as conn:
+            rows = conn.execute(statement, {'last_id': last_id, 'max_id': max_id, 'limit': chunk_size, **type_params}).all()
+        if not rows:
+            return
+        yield [(row.id, row.short_message, row.service_id, row.status) for row in rows]
+        last_id = rows[-1].id
+
+
+def build_updates(chunk, classified):
+    """Agrupa as mudanças de um lote por (service_id, status) novos"""
+    new_service_ids = dict(classified)
+    updates = {}
+    changes = []
+
+    for message_id, _, old_service_id, old_status in chunk:
+        new_service_id = new_service_ids[message_id]
+        if old_status in CLASSIFICATION_STATUSES:
+            new_status = 'classified' if new_service_id else 'unclassified'
+        else:
+            new_status = old_status
+
+        if new_service_id == old_service_id and new_status == old_status:
+            continue
+
+        updates.setdefault((new_service_id, new_status), []).append(message_id)
+        changes.append((message_id, old_service_id, new_service_id, old_status, new_status))
+
+    return updates, changes
+
+
+def apply_updates(engine, updates):
+    """Aplica as mudanças com um UPDATE por grupo (service_id, status)"""
+    statement = text(
+        "UPDATE messages SET service_id = :service_id, status = :status, processed_at = :processed_at "
+        "WHERE id IN :ids"
+    ).bindparams(bindparam('ids', expanding=True))
+
+    processed_at = datetime.utcnow()
+    with engine.begin() as conn:
+        for (service_id, status), ids in updates.items():
+            conn.execute(statement, {
+                'service_id': service_id,
+                'status': status,
+                'processed_at': processed_at,
+                'ids': ids
+            })
+
+
+def reclassify(args):
+    """Executa a reclassificação"""
+    engine = create_engine(get_database_url())
+
+    services = load_services(engine)
+    matcher = ServiceMatcher(services, adaptive=False)
+    service_names = {service_id: data['name'] for service_id, data in matcher.services.items()}
+
+    def label(service_id):
+        if service_id is None:
+            return 'Não classificado'
+        return service_names.get(service_id, f'#{service_id}')
+
+    for service_id, name, error in matcher.errors:
+        print(f"⚠️  Regex inválida no serviço {name}: {error}")
+    print(f"🔎 {len(matcher)} serviços ativos carregados")
+
+    start_id = args.start_id
+    if args.resume:
+        start_id = max(start_id, read_checkpoint(args.checkpoint))
+
+    type_clause, type_params = type_filter(args.types)
+    count_statement = text("SELECT COUNT(*) FROM messages WHERE id > :start_id AND id <= :max_id" + type_clause)
+    if args.types:
+        count_statement = count_statement.bindparams(bindparam('message_types', expanding=True))
+
+    with engine.connect() as conn:
+        max_id = conn.execute(text("SELECT COALESCE(MAX(id), 0) FROM messages")).scalar()
+        total = conn.execute(count_statement, {'start_id': start_id, 'max_id': max_id, **type_params}).scalar()
+
+    mode = 'dry-run' if args.dry_run else 'gravação'
+    types = ','.join(args.types) if args.types else 'todos'
+    print(f"🚀 Reclassificando {total} mensagens (id {start_id + 1}..{max_id}, tipos {types}, modo {mode})")
+
+    processed = 0
+    changed = 0
+    transitions = Counter()
+    diff_lines = 0
+    started = time.monotonic()
+    last_id = start_id
+
+    with Pool(args.workers, initializer=_init_worker, initargs=(services,)) as pool:
+        pending = deque()
+        chunks = stream_chunks(engine, start_id, max_id, args.chunk_size, args.types)
+
+        def collect():
+            nonlocal processed, changed, diff_lines, last_id
+            chunk, async_result = pending.popleft()
+            classified = async_result.get()
+            updates, changes = build_updates(chunk, classified)
+
+            if args.dry_run:
+                for message_id, old_service_id, new_service_id, old_status, new_status in changes:
+                    transitions[(old_service_id, new_service_id)] += 1
+                    if diff_lines < args.diff_limit:
+                        print(f"  ~ {message_id}: {label(old_service_id)} → {label(new_service_id)} "
+                              f"({old_status} → {new_status})")
+                        diff_lines += 1
+            elif updates:
+                apply_updates(engine, updates)
+
+            processed += len(chunk)
+            changed += len(changes)
+            last_id = chunk[-1][0]
+
+            if not args.dry_run:
+                write_checkpoint(args.checkpoint, last_id, {'processed': processed, 'changed': changed})
+
+            elapsed = time.monotonic() - started
+            rate = processed / elapsed if elapsed > 0 else 0.0
+            percent = processed / total * 100 if total else 100.0
+            print(f"📊 {processed}/{total} ({percent:.1f}%) - {changed} alteradas - "
+                  f"{rate:.0f} msg/s - último id {last_id}")
+
+        # Mantém um número limitado de lotes em voo para não carregar a tabela em memória
+        for chunk in chunks:
+            pending.append((chunk, pool.apply_async(_classify_chunk, ([(row[0], row[1]) for row in chunk],))))
+            if len(pending) >= args.workers * 2:
+                collect()
+
+        while pending:
+            collect()
+
+    elapsed = time.monotonic() - started
+    print(f"🎉 Concluído: {processed} mensagens em {elapsed:.1f}s, {changed} alteradas")
+
+    if args.dry_run and transitions:
+        print("\n📋 Resumo das mudanças (serviço atual → novo):")
+        for (old_service_id, new_service_id), count in transitions.most_common():
+            print(f"   {label(old_service_id)} → {label(new_service_id)}: {count}")
+
+    return True
+
+
+def parse_types(value):
+    """Lista de tipos de mensagem do argumento --types ('all': sem restrição)"""
+    if value.strip().lower() == 'all':
+        return None
+    return [message_type.strip() for message_type in value.split(',') if message_type.strip()]
+
+
+def parse_args(argv=None):
+    """Interpreta os argumentos da linha de comando"""
+    parser = argparse.ArgumentParser(description='Reclassifica mensagens históricas por serviço')
+    parser.add_argument('--chunk-size', type=int, default=5000, help='mensagens por lote')
+    parser.add_argument('--workers', type=int, default=cpu_count(), help='processos de classificação')
+    parser.add_argument('--checkpoint', default=DEFAULT_CHECKPOINT, help='arquivo de checkpoint')
+    parser.add_argument('--resume', action='store_true', help='continua a partir do checkpoint')
+    parser.add_argument('--start-id', type=int, default=0, help='processa apenas ids maiores que este')
+    parser.add_argument('--types', type=parse_types, default=['MO'],
+                        help='tipos de mensagem (padrão: MO; ex: MO,WEBHOOK ou all para todos)')
+    parser.add_argument('--dry-run', action='store_true', help='mostra as diferenças sem gravar')
+    parser.add_argument('--diff-limit', type=int, default=100, help='máximo de linhas de diferença no dry-run')
+    return parser.parse_args(argv)
+
+
+def main():
+    """Função principal da reclassificação"""
+    args = parse_args()
+    try:
+        return reclassify(args)
+    except KeyboardInterrupt:
+        print("\n⏸️  Interrompido. Use --resume para continuar do último checkpoint")
+        return False
+
+
+if __name__ == '__main__':
+    main()
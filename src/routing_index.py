@@ -0,0 +1,288 @@
+"""
+Índice em memória de roteamento DID → cliente, atualizado via Redis pub/sub
+"""
+import os
+import sys
+import json
+import time
+import threading
+from collections import namedtuple
+
+# Adiciona o diretório src ao path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from models import db, Client, PhoneNumber, SystemLog
+
+# Contador de versão das mudanças de DIDs/clientes e canal com cada mudança
+ROUTING_VERSION_KEY = 'routing:version'
+ROUTING_CHANNEL = 'routing:changed'
+
+Route = namedtuple('Route', ['phone_number_id', 'number', 'client_id', 'webhook_url', 'is_active'])
+ClientRoute = namedtuple('ClientRoute', ['client_id', 'webhook_url', 'is_active', 'webhook_weight', 'webhook_batching'])
+
+
+class RoutingIndex:
+    """DIDs e clientes carregados em lote, com atualização incremental por notificação"""
+
+    def __init__(self, app, redis_client):
+        self.app = app
+        self.redis = redis_client
+        self.check_interval = int(os.getenv('ROUTING_CHECK_INTERVAL', '60'))
+
+        self.routes = {}        # phone_number_id -> Route
+        self.by_number = {}     # número do DID -> Route
+        self.clients = {}       # client_id -> ClientRoute
+        self.version = None
+
+        self._stale = True
+        self._pending = set()   # ('did' | 'client', id) aguardando recarga
+        self._seen_versions = set()
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+        self._listener = None
+        self._listener_pid = None
+        self._callbacks = []
+
+    def log_system(self, level, message, module='routing'):
+        """Registra log no sistema"""
+        try:
+            with self.app.app_context():
+                log_entry = SystemLog(level=level, message=message, module=module)
+                db.session.add(log_entry)
+                db.session.commit()
+        except Exception as e:
+            print(f"Erro ao registrar log: {e}")
+
+    def lookup(self, number):
+        """Rota do DID ativo com este número, ou None"""
+        self._sync()
+        route = self.by_number.get(number)
+        if route and route.is_active:
+            return route
+        return None
+
+    def get(self, phone_number_id):
+        """Rota de um DID pelo id (ativo ou não), ou None"""
+        self._sync()
+        return self.routes.get(phone_number_id)
+
+    def active_clients(self):
+        """Clientes ativos, para mensagens sem DID associado"""
+        self._sync()
+        return [client for client in self.clients.values() if client.is_active]
+
+    def client_weight(self, client_id):
+        """Peso do cliente no round-robin da entrega de webhooks (sem sincronizar: chamado com lock do motor)"""
+        client = self.clients.get(client_id)
+        return client.webhook_weight if client else 1
+
+    def client_batching(self, client_id):
+        """(máximo de mensagens, espera máxima em segundos) se o cliente recebe webhooks em lote, senão None"""
+        client = self.clients.get(client_id)
+        return client.webhook_batching if client else None
+
+    def add_listener(self, callback):
+        """Registra callback(kind, entity_id) chamado a cada mudança ('all' se mudanças podem ter sido perdidas)"""
+        self._callbacks.append(callback)
+
+    def notify(self, kind, entity_id):
+        """Avisa todos os processos que um DID ('did') ou cliente ('client') foi criado ou alterado"""
+        with self._lock:
+            self._pending.add((kind, int(entity_id)))
+        self._fire(kind, int(entity_id))
+        try:
+            version = self.redis.incr(ROUTING_VERSION_KEY)
+            self.redis.publish(ROUTING_CHANNEL, json.dumps({'kind': kind, 'id': int(entity_id), 'version': version}))
+            return version
+        except Exception as e:
+            self._stale = True
+            self.log_system('ERROR', f'Erro ao publicar mudança de roteamento: {e}')
+            return None
+
+    def _fire(self, kind, entity_id):
+        for callback in self._callbacks:
+            try:
+                callback(kind, entity_id)
+            except Exception as e:
+                print(f"Erro em callback de roteamento: {e}")
+
+    def load(self):
+        """Carrega todos os DIDs e clientes (chamado na inicialização do processo)"""
+        with self._lock:
+            self._load_all()
+
+    def invalidate(self):
+        """Força a recarga completa na próxima consulta"""
+        self._stale = True
+
+    def _sync(self):
+        self.ensure_listener()
+
+        if not self._stale and not self._pending and time.monotonic() - self._last_check < self.check_interval:
+            return
+
+        with self._lock:
+            if time.monotonic() - self._last_check >= self.check_interval:
+                # Confere se alguma notificação foi perdida
+                self._last_check = time.monotonic()
+                applied = self._applied_version()
+                if self._remote_version() != applied:
+                    self._stale = True
+                else:
+                    self.version = applied
+                    self._seen_versions = {seen for seen in self._seen_versions if seen > applied}
+
+            if self._stale:
+                self._load_all()
+            elif self._pending:
+                self._load_pending()
+
+    def _applied_version(self):
+        """Maior versão contínua já recebida a partir da última carga completa"""
+        version = self.version
+        if version is None:
+            return None
+        while version + 1 in self._seen_versions:
+            version += 1
+        return version
+
+    def _remote_version(self):
+        try:
+            return int(self.redis.get(ROUTING_VERSION_KEY) or 0)
+        except Exception as e:
+            self.log_system('WARNING', f'Erro ao ler versão do roteamento no Redis: {e}')
+            return self._applied_version()
+
+    def _load_all(self):
+        # Lê a versão antes dos dados: no pior caso recarrega de novo na próxima verificação
+        version = self._remote_version()
+        pending = self._pending
+        self._pending = set()
+        try:
+            with self.app.app_context():
+                clients = {
+                    client.id: self._client_route(client)
+                    for client in Client.query.all()
+                }
+                phone_numbers = PhoneNumber.query.all()
+                routes = {
+                    phone_number.id: self._route(phone_number, clients.get(phone_number.client_id))
+                    for phone_number in phone_numbers
+                }
+        except Exception as e:
+            self._pending |= pending
+            self.log_system('ERROR', f'Erro ao carregar índice de roteamento: {e}')
+            return
+
+        self.clients = clients
+        self.routes = routes
+        self.by_number = {route.number: route for route in routes.values()}
+        self.version = version
+        self._seen_versions = {seen for seen in self._seen_versions if seen > version}
+        self._stale = False
+        self._last_check = time.monotonic()
+
+        # Uma carga completa cobre mudanças cujas notificações se perderam: os caches derivados
+        # (ex: API keys de clientes desativados) também precisam ser descartados
+        self._fire('all', None)
+
+        self.log_system('INFO', f'Índice de roteamento carregado: {len(routes)} DIDs, {len(clients)} clientes (versão {version})')
+
+    def _load_pending(self):
+        pending = self._pending
+        self._pending = set()
+        did_ids = {entity_id for kind, entity_id in pending if kind == 'did'}
+        client_ids = {entity_id for kind, entity_id in pending if kind == 'client'}
+
+        try:
+            with self.app.app_context():
+                for client in Client.query.filter(Client.id.in_(client_ids)).all() if client_ids else []:
+                    self.clients[client.id] = self._client_route(client)
+
+                # DIDs alterados e DIDs dos clientes alterados (webhook/ativo mudam a rota)
+                query = PhoneNumber.query
+                if did_ids and client_ids:
+                    query = query.filter(db.or_(PhoneNumber.id.in_(did_ids), PhoneNumber.client_id.in_(client_ids)))
+                elif did_ids:
+                    query = query.filter(PhoneNumber.id.in_(did_ids))
+                else:
+                    query = query.filter(PhoneNumber.client_id.in_(client_ids))
+                phone_numbers = query.all()
+
+                missing_clients = {
+                    phone_number.client_id for phone_number in phone_numbers
+                    if phone_number.client_id not in self.clients
+                }
+                for client in Client.query.filter(Client.id.in_(missing_clients)).all() if missing_clients else []:
+                    self.clients[client.id] = self._client_route(client)
+        except Exception as e:
+            self._pending |= pending
+            self.log_system('ERROR', f'Erro ao atualizar índice de roteamento: {e}')
+            return
+
+        for phone_number in phone_numbers:
+            route = self._route(phone_number, self.clients.get(phone_number.client_id))
+            previous = self.routes.get(route.phone_number_id)
+            if previous and previous.number != route.number and self.by_number.get(previous.number) is previous:
+                del self.by_number[previous.number]
+            self.routes[route.phone_number_id] = route
+            self.by_number[route.number] = route
+
+    @staticmethod
+    def _client_route(client):
+        batching = None
+        if (client.webhook_batch_size or 0) > 1:
+            batching = (client.webhook_batch_size, (client.webhook_batch_ms or 1000) / 1000)
+        return ClientRoute(client.id, client.webhook_url, client.is_active, client.webhook_weight or 1, batching)
+
+    @staticmethod
+    def _route(phone_number, client):
+        return Route(
+            phone_number.id,
+            phone_number.number,
+            phone_number.client_id,
+            client.webhook_url if client else None,
+            bool(phone_number.is_active)
+        )
+
+    def ensure_listener(self):
+        """Garante a escuta de mudanças neste processo"""
+        # Inicia a escuta por processo (após fork do gunicorn a thread herdada não existe)
+        if self._listener_pid == os.getpid():
+            return
+
+        with self._lock:
+            if self._listener_pid == os.getpid():
+                return
+            self._listener_pid = os.getpid()
+            self._listener = threading.Thread(target=self._listen, daemon=True)
+            self._listener.start()
+
+    def _listen(self):
+        """Escuta o canal de mudanças e agenda a recarga das entidades alteradas"""
+        while True:
+            try:
+                pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(ROUTING_CHANNEL)
+
+                for message in pubsub.listen():
+                    try:
+                        change = json.loads(message['data'])
+                        entry = (change['kind'], int(change['id']))
+                        version = int(change['version'])
+                    except (TypeError, ValueError, KeyError):
+                        self._stale = True
+                        self._fire('all', None)
+                        continue
+
+                    with self._lock:
+                        self._pending.add(entry)
+                        self._seen_versions.add(version)
+                    self._fire(*entry)
+
+            except Exception as e:
+                # Mensagens podem ter sido perdidas durante a desconexão
+                self._stale = True
+                self._fire('all', None)
+                self.log_system('WARNING', f'Escuta de mudanças de roteamento interrompida: {e}')
+                time.sleep(5)
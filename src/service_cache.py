@@ -0,0 +1,161 @@
+"""
+Cache local de serviços compilados, versionado e invalidado via Redis pub/sub
+"""
+import os
+import sys
+import time
+import threading
+
+# Adiciona o diretório src ao path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from models import db, Service, SystemLog
+from service_matcher import ServiceMatcher
+from metrics import MetricsPublisher
+
+# Chave com o contador de versão do catálogo e canal de notificação das mudanças
+SERVICES_VERSION_KEY = 'services:version'
+SERVICES_CHANNEL = 'services:changed'
+
+
+class ServiceCache:
+    """Catálogo de serviços compilado, recarregado apenas quando a versão muda"""
+
+    def __init__(self, app, redis_client):
+        self.app = app
+        self.redis = redis_client
+        self.check_interval = int(os.getenv('SERVICE_CACHE_CHECK_INTERVAL', '30'))
+
+        self.matcher = ServiceMatcher([])
+        self.version = None
+        self._stale = True
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+        self._listener = None
+        self._listener_pid = None
+        self.profile_publisher = MetricsPublisher(redis_client, 'classifier')
+
+    def log_system(self, level, message, module='service_cache'):
+        """Registra log no sistema"""
+        try:
+            with self.app.app_context():
+                log_entry = SystemLog(level=level, message=message, module=module)
+                db.session.add(log_entry)
+                db.session.commit()
+        except Exception as e:
+            print(f"Erro ao registrar log: {e}")
+
+    def get_matcher(self):
+        """Retorna o motor de classificação, recarregando se o catálogo mudou"""
+        self._ensure_listener()
+
+        if self._stale or time.monotonic() - self._last_check >= self.check_interval:
+            self.refresh()
+
+        matcher = self.matcher
+        for service_id, service_name, elapsed, overruns in matcher.pop_suspensions():
+            self.log_system('ERROR', f'Regex do serviço {service_name} ficou lenta {overruns} vezes '
+                                     f'(última: {elapsed * 1000:.0f}ms) e foi suspensa até o próximo recarregamento '
+                                     f'do catálogo', 'classifier')
+        self.profile_publisher.maybe_publish(matcher.profile)
+
+        return matcher
+
+    def get_version(self):
+        """Versão do catálogo atualmente carregada"""
+        return self.version
+
+    def refresh(self, force=False):
+        """Confere a versão no Redis e recarrega o catálogo se necessário"""
+        with self._lock:
+            self._last_check = time.monotonic()
+            remote_version = self._remote_version()
+
+            if not force and not self._stale and remote_version == self.version:
+                return False
+
+            # Lê a versão antes dos dados: no pior caso recarrega de novo na próxima mudança
+            self._stale = False
+            self._load(remote_version)
+            return True
+
+    def reload(self):
+        """Força a recarga do catálogo a partir do banco"""
+        return self.refresh(force=True)
+
+    def invalidate(self):
+        """Marca o catálogo local como desatualizado"""
+        self._stale = True
+
+    def bump_version(self):
+        """Incrementa a versão do catálogo e notifica os demais processos"""
+        self.invalidate()
+        try:
+            version = self.redis.incr(SERVICES_VERSION_KEY)
+            self.redis.publish(SERVICES_CHANNEL, version)
+            return version
+        except Exception as e:
+            self.log_system('ERROR', f'Erro ao publicar nova versão dos serviços: {e}')
+            return None
+
+    def _remote_version(self):
+        try:
+            return int(self.redis.get(SERVICES_VERSION_KEY) or 0)
+        except Exception as e:
+            self.log_system('WARNING', f'Erro ao ler versão dos serviços no Redis: {e}')
+            return self.version
+
+    def _load(self, version):
+        try:
+            with self.app.app_context():
+                services = Service.query.filter_by(is_active=True).order_by(Service.priority, Service.id).all()
+                matcher = ServiceMatcher(
+                    ((service.id, service.name, service.regex_pattern, service.priority) for service in services),
+                    previous=self.matcher
+                )
+        except Exception as e:
+            self._stale = True
+            self.log_system('ERROR', f'Erro ao carregar serviços: {e}')
+            return
+
+        self.matcher = matcher
+        self.version = version
+
+        for service_id, service_name, error in matcher.errors:
+            self.log_system('ERROR', f'Erro na regex do serviço {service_name}: {error}', 'classifier')
+
+        self.log_system('INFO', f'{len(matcher)} serviços carregados (versão {version})')
+
+    def _ensure_listener(self):
+        # Inicia a escuta por processo (após fork do gunicorn a thread herdada não existe)
+        if self._listener_pid == os.getpid():
+            return
+
+        with self._lock:
+            if self._listener_pid == os.getpid():
+                return
+            self._listener_pid = os.getpid()
+            self._listener = threading.Thread(target=self._listen, daemon=True)
+            self._listener.start()
+
+    def _listen(self):
+        """Escuta o canal de mudanças e marca o catálogo como desatualizado"""
+        while True:
+            try:
+                pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(SERVICES_CHANNEL)
+
+                for message in pubsub.listen():
+                    try:
+                        version = int(message['data'])
+                    except (TypeError, ValueError):
+                        version = None
+
+                    if version is None or version != self.version:
+                        self._stale = True
+
+            except Exception as e:
+                # Mensagens podem ter sido perdidas durante a desconexão
+                self._stale = True
+                self.log_system('WARNING', f'Escuta de mudanças de serviços interrompida: {e}')
+                time.sleep(5)
@@ -0,0 +1,655 @@
+"""
+Motor de classificação multi-padrão para as regex de serviços
+"""
+import os
+import re
+import time
+from collections import namedtuple, deque
+
+try:
+    from re import _parser as sre_parse
+    from re import _compiler as sre_compile
+except ImportError:  # Python < 3.11
+    import sre_parse
+    import sre_compile
+
+from metrics import percentile
+from template_cache import TemplateCache, template_key
+
+# Resultado de um match: serviço encontrado e posição do trecho na mensagem
+ServiceMatch = namedtuple('ServiceMatch', ['service_id', 'name', 'start', 'end', 'text'])
+
+# Limite de combinações ao expandir alternativas literais (ex: (wa|whats)(app|\.me))
+MAX_LITERAL_EXPANSION = 64
+
+_REPEAT_OPS = tuple(op for op in (
+    sre_parse.MAX_REPEAT,
+    sre_parse.MIN_REPEAT,
+    getattr(sre_parse, 'POSSESSIVE_REPEAT', None)
+) if op is not None)
+
+_LEADING_FLAGS = re.compile(r'^\(\?([aiLmsux]+)\)')
+
+# Limites da verificação de custo feita ao salvar um serviço
+MAX_PATTERN_LENGTH = 500
+# Caracteres usados para testar se alternativas começam de forma ambígua
+_PROBE_CHARS = ''.join(chr(code) for code in range(32, 0x250))
+
+# Amostras recentes mantidas por serviço para o cálculo do p99
+PROFILE_SAMPLES = 1024
+
+# Letras que o re.IGNORECASE equipara a 'i' mas que o casefold() não normaliza
+_FOLD_FIXES = str.maketrans({'\u0131': 'i', '\u0130': 'i'})
+
+
+def fold_text(text):
+    """Normaliza o texto para comparação de literais sem diferenciar maiúsculas"""
+    return text.translate(_FOLD_FIXES).casefold()
+
+
+def walk_pattern(parsed):
+    """Percorre recursivamente os nós (op, av) de um padrão já parseado"""
+    for op, av in parsed:
+        yield op, av
+        if op is sre_parse.SUBPATTERN:
+            yield from walk_pattern(av[-1])
+        elif op is sre_parse.BRANCH:
+            for alternative in av[1]:
+                yield from walk_pattern(alternative)
+        elif op in _REPEAT_OPS:
+            yield from walk_pattern(av[2])
+        elif op in (sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+            yield from walk_pattern(av[1])
+        elif op is getattr(sre_parse, 'ATOMIC_GROUP', None):
+            yield from walk_pattern(av)
+        elif op is sre_parse.GROUPREF_EXISTS:
+            yield from walk_pattern(av[1])
+            if av[2] is not None:
+                yield from walk_pattern(av[2])
+
+
+def _exact_strings(parsed):
+    """Retorna o conjunto exato de strings aceitas pelo padrão, ou None se não for finito/pequeno"""
+    results = {''}
+    for op, av in parsed:
+        options = _exact_item(op, av)
+        if options is None:
+            return None
+        results = {prefix + suffix for prefix in results for suffix in options}
+        if len(results) > MAX_LITERAL_EXPANSION:
+            return None
+    return results
+
+
+def _exact_item(op, av):
+    """Conjunto exato de strings para um único nó do padrão"""
+    if op is sre_parse.LITERAL:
+        return {chr(av)}
+    if op is sre_parse.IN:
+        chars = set()
+        for item_op, item_av in av:
+            if item_op is not sre_parse.LITERAL:
+                return None
+            chars.add(chr(item_av))
+        return chars if len(chars) <= MAX_LITERAL_EXPANSION else None
+    if op is sre_parse.SUBPATTERN:
+        return _exact_strings(av[-1])
+    if op is sre_parse.BRANCH:
+        options = set()
+        for alternative in av[1]:
+            alternative_options = _exact_strings(alternative)
+            if alternative_options is None:
+                return None
+            options |= alternative_options
+        return options if len(options) <= MAX_LITERAL_EXPANSION else None
+    return None
+
+
+def _better_literals(current, candidate):
+    """Escolhe o conjunto de literais mais seletivo (maior literal mínimo, depois menos literais)"""
+    if not candidate or '' in candidate:
+        return current
+    if current is None:
+        return candidate
+    current_key = (min(map(len, current)), -len(current))
+    candidate_key = (min(map(len, candidate)), -len(candidate))
+    return candidate if candidate_key > current_key else current
+
+
+def _required_literals(parsed):
+    """Conjunto de literais dos quais pelo menos um aparece em todo match, ou None"""
+    best = None
+    run = {''}
+
+    for op, av in parsed:
+        options = _exact_item(op, av)
+        if options is not None and '' not in options:
+            expanded = {prefix + suffix for prefix in run for suffix in options}
+            if len(expanded) <= MAX_LITERAL_EXPANSION:
+                run = expanded
+                continue
+            best = _better_literals(best, run)
+            run = options
+            continue
+
+        best = _better_literals(best, run)
+        run = {''}
+
+        if op is sre_parse.SUBPATTERN:
+            best = _better_literals(best, _required_literals(av[-1]))
+        elif op is sre_parse.BRANCH:
+            union = set()
+            for alternative in av[1]:
+                literals = _required_literals(alternative)
+                if literals is None:
+                    union = None
+                    break
+                union |= literals
+            best = _better_literals(best, union)
+        elif op in _REPEAT_OPS and av[0] >= 1:
+            best = _better_literals(best, _required_literals(av[2]))
+        elif op is getattr(sre_parse, 'ATOMIC_GROUP', None):
+            best = _better_literals(best, _required_literals(av))
+
+    return _better_literals(best, run)
+
+
+def extract_literals(pattern):
+    """Extrai os literais obrigatórios (casefold) de uma regex, ou None se não houver"""
+    literals = _required_literals(sre_parse.parse(pattern, re.IGNORECASE))
+    if not literals:
+        return None
+    return frozenset(fold_text(literal) for literal in literals)
+
+
+def is_combinable(pattern):
+    """Indica se o padrão pode ser embutido numa alternação sem mudar de significado"""
+    parsed = sre_parse.parse(pattern, re.IGNORECASE)
+    if parsed.state.groupdict:
+        return False
+    for op, av in walk_pattern(parsed):
+        if op in (sre_parse.GROUPREF, sre_parse.GROUPREF_EXISTS):
+            return False
+    return True
+
+
+def _splits_digits(low, high):
+    """Indica se o intervalo [low, high] contém só parte dos dígitos ASCII"""
+    return low <= ord('9') and high >= ord('0') and not (low <= ord('0') and high >= ord('9'))
+
+
+def is_digit_sensitive(pattern):
+    """Indica se o padrão distingue valores de dígitos (ex: literal '7' ou [1-3])"""
+    parsed = sre_parse.parse(pattern, re.IGNORECASE)
+    for op, av in walk_pattern(parsed):
+        if op in (sre_parse.GROUPREF, sre_parse.GROUPREF_EXISTS):
+            return True
+        if op in (sre_parse.LITERAL, sre_parse.NOT_LITERAL) and chr(av).isascii() and chr(av).isdigit():
+            return True
+        if op is sre_parse.IN:
+            for item_op, item_av in av:
+                if item_op in (sre_parse.LITERAL, sre_parse.NOT_LITERAL):
+                    if chr(item_av).isascii() and chr(item_av).isdigit():
+                        return True
+                elif item_op is sre_parse.RANGE and _splits_digits(*item_av):
+                    return True
+    return False
+
+
+def _first_node(parsed):
+    """Primeiro nó que consome caractere em uma sequência, descendo em grupos e repetições"""
+    for op, av in parsed:
+        if op is sre_parse.AT:
+            continue
+        if op is sre_parse.SUBPATTERN:
+            return _first_node(av[-1])
+        if op in _REPEAT_OPS and av[0] >= 1:
+            return _first_node(av[2])
+        if op in (sre_parse.LITERAL, sre_parse.NOT_LITERAL, sre_parse.IN, sre_parse.ANY):
+            return op, av
+        return None
+    return None
+
+
+def _first_chars(parsed, state):
+    """Caracteres de teste que podem iniciar a sequência, ou None se indeterminado"""
+    node = _first_node(parsed)
+    if node is None:
+        return None
+    single = sre_compile.compile(sre_parse.SubPattern(state, [node]), state.flags | re.IGNORECASE)
+    return {char for char in _PROBE_CHARS if single.match(char)}
+
+
+def _can_match_empty(parsed, state):
+    """Indica se a sequência pode casar sem consumir caracteres"""
+    return sre_parse.SubPattern(state, list(parsed)).getwidth()[0] == 0
+
+
+def _has_unbounded_repeat(parsed):
+    """Indica se há repetição ilimitada sujeita a backtracking dentro da sequência"""
+    possessive = getattr(sre_parse, 'POSSESSIVE_REPEAT', None)
+    atomic = getattr(sre_parse, 'ATOMIC_GROUP', None)
+    for op, av in parsed:
+        if op is atomic or op is possessive:
+            continue
+        if op in _REPEAT_OPS and av[1] == sre_parse.MAXREPEAT:
+            return True
+        if op in _REPEAT_OPS and _has_unbounded_repeat(av[2]):
+            return True
+        if op is sre_parse.SUBPATTERN and _has_unbounded_repeat(av[-1]):
+            return True
+        if op is sre_parse.BRANCH and any(_has_unbounded_repeat(alt) for alt in av[1]):
+            return True
+    return False
+
+
+def find_costly_constructs(pattern, check_length=True):
+    """Lista construções com risco de backtracking catastrófico no padrão"""
+    problems = []
+    if check_length and len(pattern) > MAX_PATTERN_LENGTH:
+        problems.append(f'padrão com mais de {MAX_PATTERN_LENGTH} caracteres')
+
+    parsed = sre_parse.parse(pattern, re.IGNORECASE)
+    possessive = getattr(sre_parse, 'POSSESSIVE_REPEAT', None)
+
+    for op, av in walk_pattern(parsed):
+        # Repetições possessivas não devolvem caracteres, então não causam explosão
+        if op not in _REPEAT_OPS or op is possessive or av[1] <= 1:
+            continue
+
+        body = av[2]
+        if _has_unbounded_repeat(body):
+            problems.append('quantificador ilimitado aninhado em outra repetição (ex: (a+)+)')
+        if _can_match_empty(body, parsed.state):
+            # Cada repetição pode consumir ou não: (a?){25}a{25} testa 2^25 divisões
+            problems.append('repetição de grupo que pode casar vazio (ex: (a?){n})')
+
+        for inner_op, inner_av in walk_pattern(body):
+            if inner_op is not sre_parse.BRANCH:
+                continue
+            # O sre_parse fatora o prefixo comum ((a|aa) vira a(|a)): alternativa vazia ou opcional
+            # se sobrepõe ao que vem depois dela
+            if any(_can_match_empty(alternative, parsed.state) for alternative in inner_av[1]):
+                problems.append('alternativas sobrepostas dentro de repetição (ex: (a|a)*)')
+                continue
+            starts = [_first_chars(alternative, parsed.state) for alternative in inner_av[1]]
+            seen = set()
+            for chars in starts:
+                if chars is None:
+                    continue
+                if seen & chars:
+                    problems.append('alternativas sobrepostas dentro de repetição (ex: (a|a)*)')
+                    break
+                seen |= chars
+
+    # Remove duplicatas preservando a ordem
+    return list(dict.fromkeys(problems))
+
+
+def validate_pattern(pattern):
+    """Valida um padrão de serviço; retorna a lista de erros (vazia se aceito)"""
+    try:
+        re.compile(pattern, re.IGNORECASE)
+    except re.error as e:
+        return [f'regex inválida: {e}']
+    try:
+        return find_costly_constructs(pattern)
+    except RecursionError:
+        return ['padrão aninhado demais']
+
+
+def scoped_pattern(pattern):
+    """Converte flags globais iniciais (ex: (?i)) em grupo com escopo para permitir a combinação"""
+    match = _LEADING_FLAGS.match(pattern)
+    if match:
+        return f'(?{match.group(1)}:{pattern[match.end():]})'
+    return f'(?:{pattern})'
+
+
+class LiteralAutomaton:
+    """Autômato Aho-Corasick para localizar vários literais em uma única passada"""
+
+    def __init__(self, keywords):
+        # keywords: iterável de (literal, índice do serviço)
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [set()]
+
+        for keyword, index in keywords:
+            state = 0
+            for char in keyword:
+                next_state = self.goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto[state][char] = next_state
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append(set())
+                state = next_state
+            self.output[state].add(index)
+
+        # Calcula links de falha em largura
+        queue = list(self.goto[0].values())
+        for state in queue:
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                candidate = self.goto[fallback].get(char, 0)
+                self.fail[next_state] = candidate if candidate != next_state else 0
+                self.output[next_state] |= self.output[self.fail[next_state]]
+
+        self.output = [frozenset(indexes) for indexes in self.output]
+
+    def search(self, text):
+        """Retorna os índices dos serviços cujos literais aparecem no texto"""
+        goto = self.goto
+        fail = self.fail
+        output = self.output
+        found = set()
+        state = 0
+
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                found |= output[state]
+
+        return found
+
+
+class ServiceMatcher:
+    """Conjunto compilado de regex de serviços com pré-filtro por literais"""
+
+    def __init__(self, services, previous=None, slow_threshold=None, adaptive=None):
+        # services: iterável de (id, nome, padrão, prioridade) já ordenado por prioridade
+        self.services = {}
+        self.errors = []
+        self._entries = []
+        self._unfiltered = []
+        # Serviços cujo padrão depende do valor dos dígitos: sempre avaliados sobre o texto original
+        self._digit_sensitive = set()
+        # Matches dos demais serviços por template (dígitos mascarados); um cache por catálogo
+        self.result_cache = TemplateCache()
+
+        # O tempo de cada avaliação só é conhecido depois que a regex retorna: é profiling, não um limite.
+        # A proteção contra backtracking catastrófico é a verificação de custo (ao salvar e ao carregar);
+        # um serviço lento max_overruns vezes nas últimas PROFILE_SAMPLES avaliações é suspenso deste
+        # catálogo para não seguir ocupando as threads (uma amostra isolada pode ser pausa do GC/GIL)
+        if slow_threshold is None:
+            slow_threshold = float(os.getenv('CLASSIFIER_REGEX_SLOW_MS', '50')) / 1000
+        self.slow_threshold = slow_threshold
+        self.max_overruns = max(1, int(os.getenv('CLASSIFIER_REGEX_OVERRUNS', '3')))
+        self.suspended = {}
+        self._new_suspensions = []
+        self._overruns = []
+
+        # Contadores de avaliação por serviço (mesmos índices de _entries)
+        self._evaluations = []
+        self._hits = []
+        self._total_time = []
+        self._samples = []
+
+        # Modo adaptativo: entre serviços de mesma prioridade, avalia primeiro os que mais casam
+        if adaptive is None:
+            adaptive = os.getenv('CLASSIFIER_ADAPTIVE_ORDER', '0') == '1'
+        self.adaptive = adaptive
+        self.reorder_interval = int(os.getenv('CLASSIFIER_REORDER_INTERVAL', '1000'))
+        self._priorities = []
+        self._recent_hits = []
+        self._recent_total = 0.0
+        self._since_reorder = 0
+
+        keywords = []
+        combinable = []
+
+        for service_id, name, pattern, priority in services:
+            try:
+                compiled_regex = re.compile(pattern, re.IGNORECASE)
+                literals = extract_literals(pattern)
+                digit_sensitive = is_digit_sensitive(pattern)
+                problems = find_costly_constructs(pattern, check_length=False)
+            except (re.error, RecursionError) as e:
+                self.errors.append((service_id, name, str(e)))
+                continue
+
+            if problems:
+                # Padrões gravados antes da verificação ao salvar: a execução não pode ser interrompida
+                self.errors.append((service_id, name, f'risco de backtracking: {"; ".join(problems)}'))
+                continue
+
+            index = len(self._entries)
+            self._entries.append((service_id, name, compiled_regex))
+            self.services[service_id] = {
+                'name': name,
+                'regex': compiled_regex,
+                'pattern': pattern,
+                'priority': priority,
+                'literals': sorted(literals) if literals else None
+            }
+            self._priorities.append(priority)
+            self._recent_hits.append(0.0)
+            self._evaluations.append(0)
+            self._hits.append(0)
+            self._total_time.append(0.0)
+            self._samples.append(deque(maxlen=PROFILE_SAMPLES))
+            if digit_sensitive:
+                self._digit_sensitive.add(index)
+            self._overruns.append(deque(maxlen=self.max_overruns))
+
+            if literals:
+                keywords.extend((literal, index) for literal in literals)
+            else:
+                self._unfiltered.append(index)
+                if is_combinable(pattern):
+                    combinable.append(scoped_pattern(pattern))
+
+        self._automaton = LiteralAutomaton(keywords)
+        # Posição de avaliação de cada índice (começa na ordem de prioridade recebida)
+        self._rank = list(range(len(self._entries)))
+
+        # Alternação única dos padrões sem literais: um search descarta todos de uma vez
+        self._unfiltered_regex = None
+        if self._unfiltered and len(combinable) == len(self._unfiltered):
+            try:
+                self._unfiltered_regex = re.compile('|'.join(combinable), re.IGNORECASE)
+            except re.error:
+                self._unfiltered_regex = None
+
+        if previous is not None:
+            self._inherit_profile(previous)
+            if self.adaptive:
+                self._reorder()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _inherit_profile(self, previous):
+        """Mantém os contadores de serviços cujo padrão não mudou (suspensões não passam para o novo catálogo)"""
+        previous_indexes = {
+            (service_id, compiled_regex.pattern): index
+            for index, (service_id, name, compiled_regex) in enumerate(previous._entries)
+        }
+        for index, (service_id, name, compiled_regex) in enumerate(self._entries):
+            old_index = previous_indexes.get((service_id, compiled_regex.pattern))
+            if old_index is None:
+                continue
+            self._evaluations[index] = previous._evaluations[old_index]
+            self._hits[index] = previous._hits[old_index]
+            self._total_time[index] = previous._total_time[old_index]
+            self._samples[index].extend(previous._samples[old_index])
+            self._recent_hits[index] = previous._recent_hits[old_index]
+
+    def _overrun(self, index, elapsed):
+        """Registra uma avaliação lenta; suspende o serviço se elas se repetem"""
+        overruns = self._overruns[index]
+        overruns.append(self._evaluations[index])
+        if len(overruns) < self.max_overruns or self._evaluations[index] - overruns[0] >= PROFILE_SAMPLES:
+            return
+        self.suspended[index] = elapsed
+        if index in self._unfiltered:
+            # A alternação combinada também executaria o padrão suspenso
+            self._unfiltered_regex = None
+        service_id, name, compiled_regex = self._entries[index]
+        self._new_suspensions.append((service_id, name, elapsed, len(overruns)))
+
+    def pop_suspensions(self):
+        """Retorna (e esquece) os serviços suspensos desde a última chamada"""
+        suspensions, self._new_suspensions = self._new_suspensions, []
+        return suspensions
+
+    def candidates(self, message_text):
+        """Índices dos serviços que podem casar com a mensagem, na ordem de avaliação"""
+        found = self._automaton.search(fold_text(message_text))
+        if self._unfiltered:
+            if self._unfiltered_regex is None or self._unfiltered_regex.search(message_text):
+                found.update(self._unfiltered)
+        if self.suspended:
+            found.difference_update(self.suspended)
+        return sorted(found)
+
+    def _match(self, index, message_text):
+        service_id, name, compiled_regex = self._entries[index]
+
+        started = time.perf_counter()
+        match = compiled_regex.search(message_text)
+        elapsed = time.perf_counter() - started
+
+        self._evaluations[index] += 1
+        self._total_time[index] += elapsed
+        self._samples[index].append(elapsed)
+        if elapsed > self.slow_threshold and index not in self.suspended:
+            self._overrun(index, elapsed)
+
+        if match:
+            self._hits[index] += 1
+            return ServiceMatch(service_id, name, match.start(), match.end(), match.group(0))
+        return None
+
+    def _template_matches(self, message_text, candidates):
+        """(índice, início, fim) dos serviços que não olham o valor dos dígitos e casam com o template
+
+        O resultado vale para qualquer mensagem do mesmo template: a máscara mantém tamanho e classe
+        dos caracteres, então os spans são os mesmos. Serviços suspensos depois do cache são filtrados.
+        """
+        key = template_key(message_text)
+        matches = self.result_cache.get(key)
+        if matches is None:
+            if candidates is None:
+                candidates = self.candidates(message_text)
+            found = []
+            for index in candidates:
+                if index in self._digit_sensitive:
+                    continue
+                match = self._match(index, message_text)
+                if match:
+                    found.append((index, match.start, match.end))
+            matches = tuple(found)
+            self.result_cache.put(key, matches)
+        if self.suspended:
+            matches = tuple(item for item in matches if item[0] not in self.suspended)
+        return matches
+
+    def _service_match(self, index, message_text, start, end):
+        service_id, name, compiled_regex = self._entries[index]
+        return ServiceMatch(service_id, name, start, end, message_text[start:end])
+
+    def match_first(self, message_text):
+        """Retorna o primeiro serviço (na ordem de avaliação) que casa com a mensagem"""
+        if not message_text:
+            return None
+
+        if self.adaptive:
+            self._since_reorder += 1
+            if self._since_reorder >= self.reorder_interval:
+                self._reorder()
+        rank = self._rank.__getitem__
+
+        # Pré-filtro só é necessário com serviços sensíveis a dígitos ou quando o template não está no cache
+        candidates = self.candidates(message_text) if self._digit_sensitive else None
+        best = min(self._template_matches(message_text, candidates), key=lambda item: rank(item[0]), default=None)
+
+        if self._digit_sensitive:
+            sensitive = sorted((index for index in candidates if index in self._digit_sensitive), key=rank)
+            for index in sensitive:
+                if best is not None and rank(index) > rank(best[0]):
+                    break
+                match = self._match(index, message_text)
+                if match:
+                    best = (index, match.start, match.end)
+                    break
+
+        # Taxa de acerto recente: só classificações por match_first, acertos e total contados juntos
+        self._recent_total += 1
+        if best is None:
+            return None
+        self._recent_hits[best[0]] += 1
+        return self._service_match(best[0], message_text, best[1], best[2])
+
+    def _reorder(self):
+        """Reordena a avaliação por prioridade explícita e, no empate, por acertos recentes"""
+        order = sorted(
+            range(len(self._entries)),
+            key=lambda index: (self._priorities[index], -self._recent_hits[index], index)
+        )
+        rank = [0] * len(order)
+        for position, index in enumerate(order):
+            rank[index] = position
+        self._rank = rank
+
+        # Decaimento: acertos antigos pesam metade a cada reordenação
+        self._recent_hits = [hits / 2 for hits in self._recent_hits]
+        self._recent_total /= 2
+        self._since_reorder = 0
+
+    def ordering(self):
+        """Ordem de avaliação atual com a taxa de acerto recente de cada serviço"""
+        result = []
+        for index in sorted(range(len(self._entries)), key=self._rank.__getitem__):
+            service_id, name, compiled_regex = self._entries[index]
+            result.append({
+                'service_id': service_id,
+                'name': name,
+                'priority': self._priorities[index],
+                'rank': self._rank[index],
+                'recent_hit_rate': (self._recent_hits[index] / self._recent_total * 100) if self._recent_total else 0.0
+            })
+        return result
+
+    def match_all(self, message_text):
+        """Retorna todos os serviços que casam com a mensagem, na ordem de prioridade"""
+        if not message_text:
+            return []
+
+        candidates = self.candidates(message_text) if self._digit_sensitive else None
+        found = list(self._template_matches(message_text, candidates))
+        if self._digit_sensitive:
+            for index in candidates:
+                if index in self._digit_sensitive:
+                    match = self._match(index, message_text)
+                    if match:
+                        found.append((index, match.start, match.end))
+
+        return [self._service_match(index, message_text, start, end) for index, start, end in sorted(found)]
+
+    def profile(self):
+        """Custo de avaliação por serviço (tempos em microssegundos)"""
+        result = []
+        for index, (service_id, name, compiled_regex) in enumerate(self._entries):
+            evaluations = self._evaluations[index]
+            total_time = self._total_time[index]
+            result.append({
+                'service_id': service_id,
+                'name': name,
+                'evaluations': evaluations,
+                'hits': self._hits[index],
+                'total_us': total_time * 1e6,
+                'avg_us': (total_time / evaluations * 1e6) if evaluations else 0.0,
+                'p99_us': percentile(list(self._samples[index]), 0.99) * 1e6,
+                'priority': self._priorities[index],
+                'rank': self._rank[index],
+                'suspended': index in self.suspended
+            })
+        return result
@@ -0,0 +1,503 @@
+"""
+Base comum dos conectores SMPP: janela de submit_sm, limite de TPS, remontagem e deduplicação de MO e DLRs
+"""
+import os
+import sys
+import time
+import threading
+from collections import deque
+import smpplib.client
+import smpplib.smpp
+import smpplib.consts
+
+# Adiciona o diretório src ao path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from models import db, SystemLog
+from inbound_buffer import InboundBuffer
+from metrics import MetricsPublisher, percentile
+from submit_window import (SubmitWindow, THROTTLING_STATUSES, fetch_send_tasks, requeue_send_tasks,
+                           apply_submit_results, submit_result, pop_all, PendingSubmit, close_pending)
+from sms_encoding import encode_message
+from mo_reassembly import MOReassembler, split_concat, decode_short_message
+from bind_supervisor import BindSupervisor
+from task_stream import TaskStream, SEND_STREAM, SENDER_GROUP
+from inbound_dedup import InboundDeduplicator
+from dlr_correlation import DLRCorrelator
+from dlr_parser import parse_receipt
+from dlr_status import DLRStatusBuffer
+
+
+class BaseConnector:
+    """
+    Bind SMPP transceiver com envio em janela e recepção em lote
+
+    As subclasses definem self.config (com 'name', 'host', 'port', 'username', 'password' e 'system_type')
+    e self.bucket, e podem ajustar bind_params() e submit_params().
+    """
+
+    module = 'smpp'
+    mo_id_prefix = 'smpp'
+
+    def __init__(self, app, redis_client, inbound=None, correlator=None, dlr_status=None):
+        self.app = app
+        self.client = None
+        self.connected = False
+        self.running = False
+        self.thread = None
+        self.listener = None
+        self.bucket = None
+
+        # Mensagens recebidas são confirmadas ao SMSC e gravadas em lote em segundo plano
+        # (no modo pool o buffer é compartilhado entre os binds)
+        self.inbound = inbound or InboundBuffer(app, redis_client, self.module)
+        self.resp_latencies = deque(maxlen=1024)
+
+        # Partes de MO concatenadas aguardam as demais no Redis
+        self.reassembler = MOReassembler(redis_client)
+
+        # Retransmissões do SMSC são confirmadas sem nova gravação
+        self.dedup = InboundDeduplicator(redis_client)
+
+        # submit_sm enviados sem aguardar a resposta, até o tamanho da janela
+        self.window = SubmitWindow()
+        self.submit_results = deque()
+        self.throttled_tasks = deque()
+        self.send_stream = TaskStream(redis_client, SEND_STREAM, SENDER_GROUP)
+        self.metrics = MetricsPublisher(redis_client, 'connector')
+
+        # DLR: message_id do SMSC → mensagem, gravado após o resultado do submit_sm; os status são
+        # gravados em lote (no modo pool a correlação e o buffer são compartilhados entre os binds)
+        self.dlr_status = dlr_status or DLRStatusBuffer(app, self.module)
+        self.correlator = correlator or DLRCorrelator(app, redis_client, on_receipt=self.dlr_status.add_receipt)
+
+        # enquire_link periódico e rebind com backoff fora dos callbacks de PDU
+        self.supervisor = BindSupervisor(self, self.module)
+
+    def log_system(self, level, message, module=None):
+        """Registra log no sistema"""
+        try:
+            with self.app.app_context():
+                log_entry = SystemLog(level=level, message=message, module=module or self.module)
+                db.session.add(log_entry)
+                db.session.commit()
+        except Exception as e:
+            print(f"Erro ao registrar log: {e}")
+
+    @property
+    def name(self):
+        return self.config['name']
+
+    def bind_params(self):
+        """Parâmetros do bind_transceiver"""
+        return {
+            'system_id': self.config['username'],
+            'password': self.config['password'],
+            'system_type': self.config['system_type']
+        }
+
+    def set_handlers(self, client):
+        """Registra os callbacks de PDU no cliente"""
+        client.set_message_received_handler(self.handle_message_received)
+        client.set_message_sent_handler(self.handle_message_sent)
+
+    def connect(self):
+        """Conecta e faz o bind no SMSC"""
+        try:
+            self.client = smpplib.client.Client(
+                self.config['host'],
+                self.config['port']
+            )
+            self.set_handlers(self.client)
+            self.client.connect()
+            self.client.bind_transceiver(**self.bind_params())
+
+            self.connected = True
+            self.supervisor.attach(self.client)
+            self.log_system('INFO', f'Conectado ao SMSC {self.name} {self.config["host"]}:{self.config["port"]}')
+            return True
+
+        except Exception as e:
+            self.log_system('ERROR', f'Erro ao conectar ao SMSC {self.name}: {e}')
+            self.connected = False
+            return False
+
+    def listen_in_background(self):
+        """Escuta o bind em uma thread própria; o supervisor a substitui a cada rebind"""
+        self.listener = threading.Thread(target=self._listen, daemon=True)
+        self.listener.start()
+
+    def _listen(self):
+        client = self.client
+        try:
+            client.listen()
+        except Exception as e:
+            if self.connected:
+                self.log_system('ERROR', f'Erro no listener SMPP ({self.name}): {e}')
+        finally:
+            # Um listener antigo não derruba o bind que o substituiu
+            if self.client is client:
+                self.connected = False
+
+    def is_alive(self):
+        """Bind conectado e com listener ativo"""
+        return self.connected and (self.listener is None or self.listener.is_alive())
+
+    def connection_lost(self, reason):
+        """Marca o bind como caído e fecha o socket para encerrar o listener"""
+        self.connected = False
+        self.log_system('WARNING', f'Conexão SMPP ({self.name}) perdida ({reason})')
+        try:
+            self.client.disconnect()
+        except Exception:
+            pass
+
+    def requeue_in_flight(self):
+        """Devolve à fila os submit_sm sem resposta e os recusados por throttling"""
+        pending = pop_all(self.throttled_tasks) + close_pending(self.window.drain())
+        requeue_send_tasks(self.send_stream, pending)
+        return len(pending)
+
+    def disconnect(self):
+        """Faz o unbind e desconecta do SMSC"""
+        try:
+            if self.client and self.connected:
+                self.client.unbind()
+                self.client.disconnect()
+                self.connected = False
+                self.log_system('INFO', f'Desconectado do SMSC {self.name}')
+        except Exception as e:
+            self.log_system('ERROR', f'Erro ao desconectar do SMSC {self.name}: {e}')
+
+    def handle_message_received(self, pdu):
+        """Processa mensagem recebida (MO/DLR)"""
+        try:
+            if pdu.command != smpplib.consts.SMPP_ESME_DELIVER_SM:
+                return
+            received_at = time.perf_counter()
+
+            # Retransmissão (nosso deliver_sm_resp atrasou): apenas confirma
+            fingerprint = self.dedup.fingerprint(self.name, pdu)
+            if self.dedup.seen(fingerprint):
+                self.client.send_pdu(pdu.create_response())
+                self.resp_latencies.append(time.perf_counter() - received_at)
+                return
+
+            is_receipt = pdu.esm_class & 0x04  # Delivery receipt
+            accepted = True
+            if not is_receipt:
+                accepted = self.process_mo(pdu)
+
+            # Responde com deliver_sm_resp antes de qualquer acesso ao banco
+            response = pdu.create_response()
+            if not accepted:
+                # Buffer cheio: erro temporário para o SMSC reenviar depois
+                response.status = smpplib.consts.SMPP_ESME_RX_T_APPN
+                self.dedup.forget(fingerprint)
+            self.client.send_pdu(response)
+            self.resp_latencies.append(time.perf_counter() - received_at)
+
+            if is_receipt:
+                self.process_dlr(pdu)
+
+        except Exception as e:
+            self.log_system('ERROR', f'Erro ao processar mensagem recebida: {e}')
+
+    def process_mo(self, pdu):
+        """Entrega a MO (Mobile Originated) ao buffer de gravação; False para o SMSC reenviar"""
+        try:
+            return self.receive_mo(pdu, pdu.source_addr, pdu.dest_addr)
+        except Exception as e:
+            self.log_system('ERROR', f'Erro ao processar MO: {e}')
+            return False
+
+    def process_dlr(self, pdu):
+        """Atualiza o status da mensagem enviada conforme o DLR (Delivery Receipt)"""
+        try:
+            # TLVs receipted_message_id/message_state ou texto padrão (id:... submit date:... stat:... err:...)
+            receipt = parse_receipt(pdu)
+            if receipt is None:
+                self.log_system('WARNING', f'DLR sem message_id reconhecível: {pdu.short_message!r}')
+                return
+
+            # Busca a mensagem original pelo message_id do SMSC (Redis, depois índice no banco)
+            message_pk = self.correlator.lookup(receipt.id)
+            if message_pk is None:
+                # Recibo antes do submit_sm_resp gravado: aplicado quando o resultado for registrado
+                self.correlator.park(receipt.id, receipt.to_dict())
+                return
+
+            self.dlr_status.add_receipt(message_pk, receipt)
+
+        except Exception as e:
+            self.log_system('ERROR', f'Erro ao processar DLR: {e}')
+
+    def receive_mo(self, pdu, source_addr, destination_addr):
+        """Decodifica a MO; partes de mensagens concatenadas só seguem para o buffer quando completas"""
+        data = pdu.short_message or getattr(pdu, 'message_payload', None) or b''
+        part, data = split_concat(pdu, data)
+        if part is None:
+            return self.inbound.offer(self.mo_row(
+                source_addr, destination_addr, decode_short_message(data, pdu.data_coding), pdu.sequence_number
+            ))
+
+        message = self.reassembler.add(source_addr, destination_addr, pdu.data_coding, part, data, pdu.sequence_number)
+        if message is None:
+            return True
+        if self.inbound.offer(self.mo_row(
+            message.source_addr, message.destination_addr, message.text, message.sequence_number
+        )):
+            return True
+
+        # Buffer cheio: guarda as demais partes e recusa esta, que o SMSC reenviará
+        self.reassembler.restore(message, exclude=part.number)
+        return False
+
+    def flush_concat(self):
+        """Entrega as MO concatenadas incompletas cujo prazo de remontagem venceu"""
+        for message in self.reassembler.flush_expired():
+            if not self.inbound.offer(self.mo_row(
+                message.source_addr, message.destination_addr, message.text, message.sequence_number
+            )):
+                self.reassembler.restore(message)
+                continue
+            self.log_system('WARNING', f'MO concatenada de {message.source_addr} entregue incompleta '
+                                       f'({message.received}/{message.total} partes)')
+
+    def mo_row(self, source_addr, destination_addr, text, sequence_number):
+        """Linha de Message para uma MO recebida"""
+        return {
+            'message_id': f"{self.mo_id_prefix}_{int(time.time() * 1000)}_{sequence_number}",
+            'source_addr': source_addr,
+            'destination_addr': destination_addr,
+            'short_message': text,
+            'message_type': 'MO',
+            'smpp_message_id': str(sequence_number),
+            'status': 'received'
+        }
+
+    def handle_message_sent(self, pdu):
+        """Processa confirmação de envio"""
+        try:
+            if pdu.command == smpplib.consts.SMPP_ESME_SUBMIT_SM_RESP:
+                status = pdu.command_status
+
+                # Correlaciona pelo número de sequência do submit_sm
+                throttled = status in THROTTLING_STATUSES
+                pending, _ = self.window.complete(pdu.sequence_number, throttled=throttled)
+                if pending is None:
+                    self.log_system('WARNING', f'submit_sm_resp sem submit_sm pendente: seq {pdu.sequence_number}')
+                    return
+
+                if throttled:
+                    # SMSC acima da capacidade: reduz a taxa
+                    self.bucket.throttled()
+                elif status == 0:
+                    self.bucket.success()
+
+                # Aguarda a resposta de todos os segmentos da mensagem
+                if not pending.record(status, pdu.message_id, throttled):
+                    return
+
+                self.finish_submit(pending)
+
+        except Exception as e:
+            self.log_system('ERROR', f'Erro ao processar confirmação de envio: {e}')
+
+    def finish_submit(self, pending):
+        """Encaminha o resultado de uma mensagem com todos os segmentos respondidos"""
+        if pending.throttled and not pending.accepted:
+            # Nenhum segmento aceito: reenvia a mensagem depois
+            self.throttled_tasks.append(pending.task)
+            return
+
+        # Gravado em lote pela thread de envio
+        self.submit_results.append(pending.result())
+
+    def submit_params(self):
+        """Campos adicionais do submit_sm (específicos do provedor)"""
+        return {}
+
+    def submit_pdus(self, destination_addr, source_addr, encoded):
+        """Um submit_sm por segmento, ainda não enviados"""
+        extra = self.submit_params()
+        return [
+            smpplib.smpp.make_pdu(
+                'submit_sm',
+                client=self.client,
+                source_addr_ton=0,
+                source_addr_npi=0,
+                source_addr=source_addr,
+                dest_addr_ton=1,
+                dest_addr_npi=1,
+                destination_addr=destination_addr,
+                short_message=part,
+                data_coding=encoded.data_coding,
+                esm_class=encoded.esm_class,
+                registered_delivery=1,  # Solicita DLR
+                **extra,
+                **sar
+            )
+            for part, sar in zip(encoded.parts, encoded.sar)
+        ]
+
+    def apply_results(self):
+        """Grava os resultados de submit_sm acumulados e registra a correlação dos DLRs"""
+        return apply_submit_results(self.app, self.submit_results, self.correlator, stream=self.send_stream)
+
+    def process_send_queue(self):
+        """Processa fila de envio de SMS mantendo até a janela de submit_sm em voo"""
+        while self.running:
+            self.metrics.maybe_publish(self.metrics_snapshot)
+            try:
+                self.apply_results()
+                requeue_send_tasks(self.send_stream, pop_all(self.throttled_tasks))
+                self.expire_submits()
+                self.flush_concat()
+
+                if not self.connected:
+                    time.sleep(1)
+                    continue
+                if not self.window.acquire(timeout=1):
+                    continue
+
+                # Limita pela janela e pelo saldo de TPS da conta
+                allowed = min(self.window.free_slots(), self.bucket.available())
+                if not allowed:
+                    time.sleep(min(1.0, self.bucket.wait_time()))
+                    continue
+
+                # Retira da fila apenas o que pode ser enviado agora
+                tasks = fetch_send_tasks(self.send_stream, allowed)
+                for index, task in enumerate(tasks):
+                    encoded = self.encode_task(task)
+                    if encoded is None:
+                        continue
+                    # Cada segmento consome um token
+                    if not self.bucket.take(encoded.segments):
+                        requeue_send_tasks(self.send_stream, tasks[index:])
+                        break
+                    if not self.submit(task, encoded):
+                        # Sem conexão: devolve o restante à fila para a próxima tentativa
+                        requeue_send_tasks(self.send_stream, tasks[index:])
+                        time.sleep(1)
+                        break
+
+            except Exception as e:
+                self.log_system('ERROR', f'Erro ao processar fila de envio: {e}')
+                time.sleep(5)
+
+        self.apply_results()
+
+    def encode_task(self, task):
+        """Codifica o texto da tarefa; mensagens impossíveis de enviar são marcadas como falha"""
+        try:
+            return encode_message(task.get('short_message') or '')
+        except Exception as e:
+            self.log_system('ERROR', f'Mensagem {task.get("message_id")} não pode ser codificada: {e}')
+            self.submit_results.append(submit_result(task, None, 'failed'))
+            return None
+
+    def submit(self, task, encoded=None):
+        """Envia os submit_sm de uma tarefa, cada um registrado na janela antes de sair"""
+        if not self.connected and not self.connect():
+            return False
+
+        try:
+            encoded = encoded or encode_message(task.get('short_message') or '')
+            pdus = self.submit_pdus(task.get('destination_addr'), task.get('source_addr') or 'SMPP', encoded)
+        except Exception as e:
+            self.log_system('ERROR', f'Erro ao montar submit_sm: {e}')
+            return False
+
+        pending = PendingSubmit(task, len(pdus))
+        for index, pdu in enumerate(pdus):
+            self.window.add(pdu.sequence_number, pending)
+            try:
+                self.client.send_pdu(pdu)
+            except Exception as e:
+                self.window.discard(pdu.sequence_number)
+                self.log_system('ERROR', f'Erro ao enviar submit_sm ({index + 1}/{len(pdus)}): {e}')
+                if index == 0:
+                    pending.close()
+                    return False
+                # Segmentos anteriores já estão no SMSC: a mensagem não é reenviada inteira
+                if pending.truncate(index):
+                    self.finish_submit(pending)
+                return True
+        return True
+
+    def expire_submits(self):
+        """Reenvia (ou marca como falha) os submit_sm sem resposta dentro do timeout"""
+        expired = close_pending(self.window.expire())
+        if not expired:
+            return
+
+        retry = []
+        for task in expired:
+            task['attempts'] = task.get('attempts', 0) + 1
+            if task['attempts'] < self.window.max_attempts:
+                retry.append(task)
+            else:
+                self.submit_results.append(submit_result(task, None, 'failed'))
+
+        requeue_send_tasks(self.send_stream, retry)
+        self.log_system('WARNING', f'{len(expired)} submit_sm sem resposta em {self.window.timeout:.0f}s '
+                                   f'({len(retry)} reenfileirados)')
+
+    def metrics_snapshot(self):
+        """Métricas do conector publicadas para o painel"""
+        latencies = list(self.resp_latencies)
+        return {
+            'module': self.module,
+            'connected': self.connected,
+            'inbound': self.inbound.stats(),
+            'concat': self.reassembler.stats(),
+            'duplicates': self.dedup.stats(),
+            'dlr': self.correlator.stats(),
+            'dlr_status': self.dlr_status.stats(),
+            'submit': self.window.stats(),
+            'rate_limit': self.bucket.stats(),
+            'link': self.supervisor.stats(),
+            'deliver_sm_resp_p50_ms': percentile(latencies, 0.5) * 1000,
+            'deliver_sm_resp_p99_ms': percentile(latencies, 0.99) * 1000
+        }
+
+    def start(self):
+        """Inicia o conector"""
+        if self.running:
+            return
+
+        self.running = True
+        self.inbound.start()
+        self.dlr_status.start()
+
+        # Conecta (em caso de falha o supervisor tenta novamente com backoff; a fila continua acumulando)
+        if self.connect():
+            self.listen_in_background()
+        else:
+            self.log_system('ERROR', f'Falha ao conectar ao SMSC {self.name}')
+
+        # Inicia thread para processar fila de envio
+        self.thread = threading.Thread(target=self.process_send_queue, daemon=True)
+        self.thread.start()
+
+        # Supervisiona o bind até o conector parar
+        try:
+            self.supervisor.run()
+        except KeyboardInterrupt:
+            self.stop()
+
+    def stop(self):
+        """Para o conector"""
+        self.running = False
+        self.supervisor.stop()
+        self.disconnect()
+        self.inbound.stop()
+
+        # submit_sm sem resposta voltam para a fila (entrega pelo menos uma vez)
+        if self.thread:
+            self.thread.join(10)
+        self.requeue_in_flight()
+        self.dlr_status.stop()
+        self.log_system('INFO', f'Conector SMPP ({self.name}) parado')
@@ -0,0 +1,285 @@
+"""
+Pool de binds SMPP com balanceamento de carga entre as configurações SMSC ativas
+
+Uso:
+    python src/smpp_pool.py
+"""
+import os
+import sys
+import time
+
+# Adiciona o diretório src ao path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from models import db, SMSCConfig, SystemLog
+from smpp_connector import app, redis_client, SMPPConnector
+from inbound_buffer import InboundBuffer
+from metrics import MetricsPublisher
+from submit_window import fetch_send_tasks, requeue_send_tasks, pop_all
+from dlr_correlation import DLRCorrelator
+from dlr_status import DLRStatusBuffer
+from rate_limiter import TokenBucket
+from bind_supervisor import reconnect_backoff
+from task_stream import TaskStream, SEND_STREAM, SENDER_GROUP
+
+STRATEGIES = ('least_inflight', 'weighted')
+
+
+class BindSlot:
+    """Posição de um bind no pool; o bind é substituído quando cai"""
+
+    def __init__(self, config_id, name, index, weight):
+        self.config_id = config_id
+        self.name = name
+        self.index = index
+        self.weight = max(1, weight or 1)
+        self.bind = None
+        self.failures = 0
+        self.next_attempt = 0.0
+        self.current_weight = 0     # round-robin ponderado suave
+        self.down_since = None
+        self.reconnects = 0
+        self.last_reconnect_s = None
+
+    def label(self):
+        return f'{self.name}#{self.index}'
+
+
+class SMPPPool:
+    """Vários binds por SMSCConfig ativa, compartilhando a fila de envio e o buffer de entrada"""
+
+    def __init__(self, strategy=None):
+        self.strategy = strategy or os.getenv('SMPP_POOL_STRATEGY', 'least_inflight')
+        if self.strategy not in STRATEGIES:
+            raise ValueError(f'Estratégia de balanceamento inválida: {self.strategy}')
+
+        self.supervise_interval = float(os.getenv('SMPP_POOL_SUPERVISE_INTERVAL', '1'))
+        self.inbound = InboundBuffer(app, redis_client, 'smpp')
+        # DLRs chegam por qualquer bind da conta: correlação e gravação de status compartilhadas
+        self.dlr_status = DLRStatusBuffer(app, 'smpp')
+        self.correlator = DLRCorrelator(app, redis_client, on_receipt=self.dlr_status.add_receipt)
+        self.metrics = MetricsPublisher(redis_client, 'connector')
+        self.send_stream = TaskStream(redis_client, SEND_STREAM, SENDER_GROUP)
+        self.slots = []
+        self.buckets = {}   # config_id -> TokenBucket compartilhado pelos binds da conta
+        self.running = False
+        self._last_supervise = 0.0
+
+    def log_system(self, level, message, module='smpp'):
+        """Registra log no sistema"""
+        try:
+            with app.app_context():
+                log_entry = SystemLog(level=level, message=message, module=module)
+                db.session.add(log_entry)
+                db.session.commit()
+        except Exception as e:
+            print(f"Erro ao registrar log: {e}")
+
+    def load_slots(self):
+        """Cria bind_count posições para cada configuração SMSC ativa"""
+        with app.app_context():
+            configs = SMSCConfig.query.filter_by(is_active=True).order_by(SMSCConfig.id).all()
+            self.buckets = {config.id: TokenBucket(config.max_tps, config.burst) for config in configs}
+            self.slots = [
+                BindSlot(config.id, config.name, index, config.weight)
+                for config in configs
+                for index in range(max(1, config.bind_count or 1))
+            ]
+
+        if not self.slots:
+            raise Exception("Nenhuma configuração SMSC ativa encontrada")
+        self.log_system('INFO', f'Pool SMPP com {len(self.slots)} binds em {len(configs)} configurações '
+                                f'(estratégia {self.strategy})')
+
+    def open_bind(self, slot):
+        """Abre um novo bind para a posição, com backoff em caso de falha"""
+        try:
+            bind = SMPPConnector(slot.config_id, inbound=self.inbound, bucket=self.buckets[slot.config_id],
+                                 correlator=self.correlator, dlr_status=self.dlr_status)
+            bind.running = True
+            connected = bind.connect()
+        except Exception as e:
+            self.log_system('ERROR', f'Erro ao criar bind {slot.label()}: {e}')
+            connected = False
+
+        if not connected:
+            slot.failures += 1
+            slot.next_attempt = time.monotonic() + reconnect_backoff(slot.failures)
+            return False
+
+        bind.listen_in_background()
+        slot.bind = bind
+        slot.failures = 0
+        if slot.down_since is not None:
+            # Tempo até reconectar: da queda do bind anterior até o novo bind
+            slot.last_reconnect_s = time.monotonic() - slot.down_since
+            slot.reconnects += 1
+            slot.down_since = None
+            self.log_system('INFO', f'Bind {slot.label()} restabelecido em {slot.last_reconnect_s:.1f}s')
+        return True
+
+    def retire_bind(self, slot, reason):
+        """Remove um bind morto: submit_sm sem resposta voltam para a fila de envio"""
+        bind = slot.bind
+        slot.bind = None
+        slot.down_since = time.monotonic()
+
+        pending = bind.requeue_in_flight()
+        try:
+            bind.apply_results()
+        except Exception as e:
+            self.log_system('ERROR', f'Erro ao gravar resultados do bind {slot.label()}: {e}')
+
+        bind.running = False
+        if bind.connected:
+            bind.disconnect()
+        else:
+            try:
+                bind.client.disconnect()
+            except Exception:
+                pass
+        self.log_system('WARNING', f'Bind {slot.label()} removido ({reason}), {pending} submit_sm reenfileirados')
+
+    def supervise(self):
+        """Substitui binds mortos e reabre posições vazias"""
+        now = time.monotonic()
+        if now - self._last_supervise < self.supervise_interval:
+            return
+        self._last_supervise = now
+
+        for slot in self.slots:
+            # enquire_link nos binds ociosos; sessão sem resposta é derrubada aqui
+            if slot.bind and slot.bind.is_alive():
+                slot.bind.supervisor.keepalive()
+            if slot.bind and not slot.bind.is_alive():
+                self.retire_bind(slot, 'conexão perdida')
+            if slot.bind is None and now >= slot.next_attempt:
+                self.open_bind(slot)
+
+    def live_slots(self):
+        return [slot for slot in self.slots if slot.bind and slot.bind.is_alive()]
+
+    def choose(self, slots):
+        """Escolhe o bind para o próximo submit_sm entre os que têm espaço na janela"""
+        eligible = [
+            slot for slot in slots
+            if slot.bind.window.free_slots() > 0 and slot.bind.bucket.available() > 0
+        ]
+        if not eligible:
+            return None
+
+        if self.strategy == 'least_inflight':
+            return min(eligible, key=lambda slot: len(slot.bind.window) / slot.weight)
+
+        # Round-robin ponderado suave (mesma sequência do nginx)
+        total = sum(slot.weight for slot in eligible)
+        for slot in eligible:
+            slot.current_weight += slot.weight
+        chosen = max(eligible, key=lambda slot: slot.current_weight)
+        chosen.current_weight -= total
+        return chosen
+
+    def dispatch(self):
+        """Distribui as tarefas da fila de envio entre os binds vivos"""
+        slots = self.live_slots()
+        if not slots:
+            time.sleep(1)
+            return
+
+        # Capacidade por conta: espaço nas janelas dos binds limitado pelo saldo de TPS da conta
+        free_by_config = {}
+        for slot in slots:
+            free_by_config[slot.config_id] = free_by_config.get(slot.config_id, 0) + slot.bind.window.free_slots()
+        free = sum(min(window_free, self.buckets[config_id].available())
+                   for config_id, window_free in free_by_config.items())
+        if not free:
+            time.sleep(0.01)
+            return
+
+        tasks = fetch_send_tasks(self.send_stream, free)
+        for index, task in enumerate(tasks):
+            slot = self.choose(slots)
+            if slot is None:
+                requeue_send_tasks(self.send_stream, tasks[index:])
+                break
+            encoded = slot.bind.encode_task(task)
+            if encoded is None:
+                continue
+            # Cada segmento consome um token da conta
+            if not slot.bind.bucket.take(encoded.segments):
+                requeue_send_tasks(self.send_stream, tasks[index:])
+                break
+            if not slot.bind.submit(task, encoded):
+                # Falha no envio: o bind será substituído na próxima supervisão
+                slot.bind.connected = False
+                slots.remove(slot)
+                requeue_send_tasks(self.send_stream, tasks[index:])
+                break
+
+    def run(self):
+        """Laço principal do pool"""
+        self.running = True
+        self.inbound.start()
+        self.dlr_status.start()
+        self.load_slots()
+
+        while self.running:
+            self.metrics.maybe_publish(self.metrics_snapshot)
+            try:
+                self.supervise()
+                for slot in self.live_slots():
+                    slot.bind.apply_results()
+                    requeue_send_tasks(self.send_stream, pop_all(slot.bind.throttled_tasks))
+                    slot.bind.expire_submits()
+                    slot.bind.flush_concat()
+                self.dispatch()
+            except Exception as e:
+                self.log_system('ERROR', f'Erro no pool SMPP: {e}')
+                time.sleep(5)
+
+    def stop(self):
+        """Para o pool devolvendo à fila os submit_sm sem resposta"""
+        self.running = False
+        for slot in self.slots:
+            if slot.bind:
+                self.retire_bind(slot, 'pool parado')
+        self.inbound.stop()
+        self.dlr_status.stop()
+        self.log_system('INFO', 'Pool SMPP parado')
+
+    def metrics_snapshot(self):
+        """Métricas do pool publicadas para o painel"""
+        return {
+            'module': 'smpp_pool',
+            'strategy': self.strategy,
+            'inbound': self.inbound.stats(),
+            'dlr': self.correlator.stats(),
+            'dlr_status': self.dlr_status.stats(),
+            'rate_limits': {config_id: bucket.stats() for config_id, bucket in self.buckets.items()},
+            'binds': [
+                {
+                    'bind': slot.label(),
+                    'connected': bool(slot.bind and slot.bind.is_alive()),
+                    'failures': slot.failures,
+                    'reconnects': slot.reconnects,
+                    'last_reconnect_s': slot.last_reconnect_s,
+                    'link': slot.bind.supervisor.stats() if slot.bind else None,
+                    'submit': slot.bind.window.stats() if slot.bind else None
+                }
+                for slot in self.slots
+            ]
+        }
+
+
+def main():
+    """Função principal do pool SMPP"""
+    pool = SMPPPool()
+
+    try:
+        pool.run()
+    except KeyboardInterrupt:
+        pool.stop()
+
+
+if __name__ == '__main__':
+    main()
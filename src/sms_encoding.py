@@ -0,0 +1,97 @@
+"""
+Codificação de SMS de saída: GSM-7 quando possível, UCS-2 caso contrário, com concatenação UDH/SAR
+"""
+import os
+import random
+from collections import namedtuple
+import smpplib.gsm
+import smpplib.consts
+import smpplib.exceptions
+
+# A tabela do smpplib usa '`' como posição vazia e '\x1b' como escape: nenhum dos dois é texto GSM-7
+_GSM_INVALID = {'`', '\x1b'}
+
+EncodedMessage = namedtuple('EncodedMessage', ['parts', 'data_coding', 'esm_class', 'encoding', 'segments', 'sar'])
+
+
+def is_gsm7(text):
+    """Verifica se o texto cabe no alfabeto GSM-7 (tabela básica + extensão)"""
+    return not any(char in _GSM_INVALID or char not in smpplib.gsm.GSM_CHARACTER_TABLE for char in text)
+
+
+def _split_gsm7(encoded, part_size):
+    """Divide septetos sem separar o escape (0x1B) do caractere de extensão"""
+    chunks = []
+    start = 0
+    while start < len(encoded):
+        end = min(start + part_size, len(encoded))
+        if end < len(encoded) and encoded[end - 1] == 0x1B:
+            end -= 1
+        chunks.append(encoded[start:end])
+        start = end
+    return chunks
+
+
+def _split_ucs2(encoded, part_size):
+    """Divide UTF-16 sem separar pares substitutos (emoji e outros fora do BMP)"""
+    chunks = []
+    start = 0
+    while start < len(encoded):
+        end = min(start + part_size, len(encoded))
+        if end < len(encoded) and 0xD8 <= encoded[end - 2] <= 0xDB:
+            end -= 2
+        chunks.append(encoded[start:end])
+        start = end
+    return chunks
+
+
+def encode_message(text, concat_mode=None, reference=None):
+    """
+    Codifica o texto no menor número de segmentos
+
+    concat_mode: 'udh' (cabeçalho no short_message, esm_class UDHI) ou 'sar' (TLVs sar_*)
+    Retorna EncodedMessage; sar traz os TLVs de cada parte (vazios se não for SAR)
+    """
+    concat_mode = concat_mode or os.getenv('SMPP_CONCAT_MODE', 'udh')
+
+    if is_gsm7(text):
+        data_coding = smpplib.consts.SMPP_ENCODING_DEFAULT
+        encoding = 'GSM-7'
+        encoded = smpplib.gsm.gsm_encode(text)
+        single_length, part_size = smpplib.consts.SEVENBIT_LENGTH, smpplib.consts.SEVENBIT_PART_SIZE
+        split = _split_gsm7
+    else:
+        data_coding = smpplib.consts.SMPP_ENCODING_ISO10646
+        encoding = 'UCS-2'
+        encoded = text.encode('utf-16-be')
+        single_length, part_size = smpplib.consts.UCS2_LENGTH, smpplib.consts.UCS2_PART_SIZE
+        split = _split_ucs2
+
+    if len(encoded) <= single_length:
+        return EncodedMessage([encoded], data_coding, smpplib.consts.SMPP_MSGTYPE_DEFAULT, encoding, 1, [{}])
+
+    chunks = split(encoded, part_size)
+    if len(chunks) > 255:
+        raise smpplib.exceptions.MessageTooLong()
+    total = len(chunks)
+
+    if concat_mode == 'sar':
+        reference = random.randint(0, 0xFFFF) if reference is None else reference & 0xFFFF
+        sar = [
+            {'sar_msg_ref_num': reference, 'sar_total_segments': total, 'sar_segment_seqnum': number}
+            for number in range(1, total + 1)
+        ]
+        return EncodedMessage(chunks, data_coding, smpplib.consts.SMPP_MSGTYPE_DEFAULT, encoding, total, sar)
+
+    # UDH de concatenação com referência de 8 bits (IEI 0x00)
+    reference = random.randint(0, 0xFF) if reference is None else reference & 0xFF
+    parts = [
+        bytes((0x05, smpplib.consts.SMPP_UDHIEIE_CONCATENATED, 0x03, reference, total, number)) + chunk
+        for number, chunk in enumerate(chunks, start=1)
+    ]
+    return EncodedMessage(parts, data_coding, smpplib.consts.SMPP_GSMFEAT_UDHI, encoding, total, [{}] * total)
+
+
+def count_segments(text):
+    """Quantidade de segmentos (submit_sm) necessários para o texto"""
+    return encode_message(text).segments
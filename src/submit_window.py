@@ -0,0 +1,275 @@
+"""
+Janela de submit_sm em voo por bind SMPP, com tamanho adaptativo
+"""
+import os
+import sys
+import time
+import threading
+from collections import OrderedDict, deque
+from datetime import datetime
+from sqlalchemy import update
+import smpplib.consts
+
+# Adiciona o diretório src ao path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from models import db, Message
+from task_stream import ENTRY_FIELD
+
+# Chaves das linhas de resultado que não são colunas de Message
+_RESULT_EXTRA_KEYS = ('smpp_message_ids', ENTRY_FIELD)
+
+# Status de submit_sm_resp que indicam excesso de tráfego no SMSC
+THROTTLING_STATUSES = (smpplib.consts.SMPP_ESME_RTHROTTLED, smpplib.consts.SMPP_ESME_RMSGQFUL)
+
+# Período usado no cálculo de TPS
+TPS_PERIOD = 10
+
+
+class PendingSubmit:
+    """Tarefa de envio cujos segmentos (um submit_sm cada) aguardam submit_sm_resp"""
+
+    def __init__(self, task, segments):
+        self.task = task
+        self.segments = segments
+        self.answered = 0
+        self.accepted = 0
+        self.throttled = 0
+        self.message_ids = []
+        self.partial = False
+        self.closed = False
+        self._lock = threading.Lock()
+
+    def record(self, status, smpp_message_id, throttled=False):
+        """Registra a resposta de um segmento; True quando todos os segmentos foram respondidos"""
+        with self._lock:
+            if self.closed:
+                return False
+            self.answered += 1
+            if status == 0:
+                self.accepted += 1
+                self.message_ids.append(smpp_message_id)
+            elif throttled:
+                self.throttled += 1
+            if self.answered < self.segments:
+                return False
+            self.closed = True
+            return True
+
+    def truncate(self, sent):
+        """Envio interrompido após sent segmentos: aguarda só as respostas deles; True se já respondidos"""
+        with self._lock:
+            if self.closed:
+                return False
+            self.segments = sent
+            self.partial = True
+            if self.answered < self.segments:
+                return False
+            self.closed = True
+            return True
+
+    def result(self):
+        """Linha de resultado da mensagem; um envio parcial é gravado como falha"""
+        return submit_result(
+            self.task,
+            self.message_ids[0] if self.message_ids else None,
+            'sent' if self.accepted == self.segments and not self.partial else 'failed',
+            self.segments,
+            self.message_ids
+        )
+
+    def close(self):
+        """Encerra a espera (timeout/bind perdido); True apenas na primeira vez"""
+        with self._lock:
+            if self.closed:
+                return False
+            self.closed = True
+            return True
+
+
+def close_pending(entries):
+    """Tarefas das entradas removidas da janela, uma vez por mensagem"""
+    return [entry.task for entry in entries if entry.close()]
+
+
+class SubmitWindow:
+    """submit_sm pendentes por número de sequência; cresce com respostas rápidas e encolhe com lentidão/throttling"""
+
+    def __init__(self, initial=None, minimum=None, maximum=None, timeout=None, target_latency=None):
+        self.minimum = minimum or int(os.getenv('SUBMIT_WINDOW_MIN', '1'))
+        self.maximum = maximum or int(os.getenv('SUBMIT_WINDOW_MAX', '100'))
+        self.size = float(initial or int(os.getenv('SUBMIT_WINDOW_INITIAL', '10')))
+        self.timeout = timeout or float(os.getenv('SUBMIT_TIMEOUT', '30'))
+        self.target_latency = target_latency or float(os.getenv('SUBMIT_TARGET_LATENCY_MS', '500')) / 1000
+        self.max_attempts = int(os.getenv('SUBMIT_MAX_ATTEMPTS', '3'))
+
+        self.latency = None     # média móvel exponencial da latência do submit_sm_resp
+        self.submitted = 0
+        self.acked = 0
+        self.throttled = 0
+        self.timeouts = 0
+
+        self._outstanding = OrderedDict()   # sequence_number -> (entry, enviado_em)
+        self._acked_at = deque()
+        self._cond = threading.Condition()
+
+    def __len__(self):
+        return len(self._outstanding)
+
+    def free_slots(self):
+        """Quantidade de submit_sm que ainda cabem na janela"""
+        return max(0, int(self.size) - len(self._outstanding))
+
+    def acquire(self, timeout=None):
+        """Aguarda espaço na janela; False se o tempo acabar"""
+        with self._cond:
+            return self._cond.wait_for(self.free_slots, timeout)
+
+    def add(self, sequence_number, entry):
+        """Registra um submit_sm antes do envio, para que a resposta sempre o encontre"""
+        with self._cond:
+            self._outstanding[sequence_number] = (entry, time.monotonic())
+            self.submitted += 1
+
+    def discard(self, sequence_number):
+        """Remove um submit_sm registrado que não chegou a ser enviado"""
+        with self._cond:
+            if self._outstanding.pop(sequence_number, None) is not None:
+                self.submitted -= 1
+            self._cond.notify_all()
+
+    def complete(self, sequence_number, throttled=False):
+        """Correlaciona o submit_sm_resp; retorna (entry, latência) ou (None, None) se desconhecido"""
+        now = time.monotonic()
+        with self._cond:
+            item = self._outstanding.pop(sequence_number, None)
+            if item is None:
+                return None, None
+
+            entry, sent_at = item
+            elapsed = now - sent_at
+            self.acked += 1
+            self._acked_at.append(now)
+            while self._acked_at and now - self._acked_at[0] > TPS_PERIOD:
+                self._acked_at.popleft()
+
+            self.latency = elapsed if self.latency is None else self.latency * 0.9 + elapsed * 0.1
+            if throttled:
+                self.throttled += 1
+                self._shrink()
+            elif self.latency > self.target_latency:
+                self.size = max(self.minimum, self.size - 1)
+            else:
+                # Crescimento aditivo: cerca de +1 por janela completa confirmada
+                self.size = min(self.maximum, self.size + 1 / self.size)
+
+            self._cond.notify_all()
+            return entry, elapsed
+
+    def expire(self):
+        """Remove e retorna as entradas sem resposta além do timeout"""
+        deadline = time.monotonic() - self.timeout
+        expired = []
+        with self._cond:
+            for sequence_number, (entry, sent_at) in list(self._outstanding.items()):
+                if sent_at > deadline:
+                    break
+                del self._outstanding[sequence_number]
+                expired.append(entry)
+
+            if expired:
+                self.timeouts += len(expired)
+                self._shrink()
+                self._cond.notify_all()
+        return expired
+
+    def drain(self):
+        """Remove e retorna todas as entradas pendentes (ex: bind perdido)"""
+        with self._cond:
+            entries = [entry for entry, _ in self._outstanding.values()]
+            self._outstanding.clear()
+            self._cond.notify_all()
+        return entries
+
+    def _shrink(self):
+        self.size = max(self.minimum, self.size / 2)
+
+    def tps(self):
+        """submit_sm confirmados por segundo nos últimos TPS_PERIOD segundos"""
+        now = time.monotonic()
+        with self._cond:
+            while self._acked_at and now - self._acked_at[0] > TPS_PERIOD:
+                self._acked_at.popleft()
+            return len(self._acked_at) / TPS_PERIOD
+
+    def stats(self):
+        """Estatísticas da janela"""
+        return {
+            'in_flight': len(self._outstanding),
+            'window': int(self.size),
+            'tps': self.tps(),
+            'latency_ms': (self.latency or 0.0) * 1000,
+            'submitted': self.submitted,
+            'acked': self.acked,
+            'throttled': self.throttled,
+            'timeouts': self.timeouts
+        }
+
+
+def fetch_send_tasks(stream, count, timeout=1):
+    """Lê até count tarefas do stream de envio em uma ida ao Redis (bloqueia se estiver vazio)"""
+    return stream.fetch(count, block_ms=int(timeout * 1000))
+
+
+def requeue_send_tasks(stream, tasks):
+    """Republica tarefas para nova tentativa, confirmando as entradas originais"""
+    stream.requeue(tasks)
+
+
+def pop_all(items):
+    """Retira todos os itens de uma deque alimentada por outra thread"""
+    popped = []
+    while items:
+        popped.append(items.popleft())
+    return popped
+
+
+def apply_submit_results(app, results, correlator=None, stream=None):
+    """Grava em um único UPDATE por chave primária os resultados de submit_sm_resp acumulados"""
+    rows = pop_all(results)
+    if not rows:
+        return 0
+
+    try:
+        with app.app_context():
+            db.session.execute(update(Message), [
+                {key: value for key, value in row.items() if key not in _RESULT_EXTRA_KEYS} for row in rows
+            ])
+            db.session.commit()
+    except Exception:
+        # Mantém os resultados para a próxima tentativa
+        results.extendleft(reversed(rows))
+        raise
+
+    # Só depois de gravado: um DLR correlacionado nunca se adianta ao resultado do envio no banco
+    if correlator:
+        correlator.record([
+            (smpp_message_id, row['id']) for row in rows for smpp_message_id in row['smpp_message_ids']
+        ])
+    # A tarefa só sai do stream de envio com o resultado gravado
+    if stream:
+        stream.ack([row[ENTRY_FIELD] for row in rows])
+    return len(rows)
+
+
+def submit_result(task, smpp_message_id, status, segments=None, smpp_message_ids=None):
+    """Linha de atualização de Message para um submit_sm_resp (smpp_message_ids: ids de todos os segmentos)"""
+    return {
+        'id': task['message_id'],
+        'smpp_message_id': smpp_message_id,
+        'status': status,
+        'segments': segments,
+        'processed_at': datetime.utcnow(),
+        'smpp_message_ids': smpp_message_ids or ([smpp_message_id] if smpp_message_id else []),
+        ENTRY_FIELD: task.get(ENTRY_FIELD)
+    }
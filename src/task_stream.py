@@ -0,0 +1,227 @@
+"""
+Filas de tarefas em Redis Streams com grupos de consumidores (entrega pelo menos uma vez)
+
+Cada tarefa é uma entrada {'task': json}; o consumidor confirma (XACK + XDEL) depois de processá-la.
+Entradas pendentes de consumidores mortos são reivindicadas após TASK_STREAM_CLAIM_IDLE_MS e, depois de
+TASK_STREAM_MAX_DELIVERIES entregas, vão para <stream>:dead.
+"""
+import os
+import sys
+import json
+import time
+import redis
+
+# Adiciona o diretório src ao path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from metrics import instance_id
+
+MESSAGE_STREAM = 'stream:message_queue'
+SEND_STREAM = 'stream:send_queue'
+
+# Grupos: workers de classificação/entrega e conectores SMPP
+WORKER_GROUP = 'workers'
+SENDER_GROUP = 'senders'
+
+# Campo da tarefa com o id da entrada do stream (não faz parte do conteúdo)
+ENTRY_FIELD = 'stream_id'
+
+
+class TaskStream:
+    """Stream de tarefas consumido por um grupo; cada processo é um consumidor (host:pid)"""
+
+    def __init__(self, redis_client, stream, group, consumer=None):
+        self.redis = redis_client
+        self.stream = stream
+        self.group = group
+        self.consumer = consumer or instance_id()
+        self.dead_letter = f'{stream}:dead'
+
+        self.claim_idle_ms = int(os.getenv('TASK_STREAM_CLAIM_IDLE_MS', '60000'))
+        self.max_deliveries = int(os.getenv('TASK_STREAM_MAX_DELIVERIES', '5'))
+        self.claim_interval = self.claim_idle_ms / 1000 / 2
+        self._next_claim = 0.0
+        self._group_ready = False
+
+        # Estatísticas
+        self.read = 0
+        self.acked = 0
+        self.claimed = 0
+        self.dead_lettered = 0
+
+    def ensure_group(self):
+        """Cria o stream e o grupo (a partir do início) se ainda não existirem"""
+        if self._group_ready:
+            return
+        try:
+            self.redis.xgroup_create(self.stream, self.group, id='0', mkstream=True)
+        except redis.ResponseError as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+        self._group_ready = True
+
+    def add(self, task, pipeline=None):
+        """Publica uma tarefa (opcionalmente dentro de um pipeline do chamador)"""
+        target = pipeline or self.redis
+        payload = {key: value for key, value in task.items() if key != ENTRY_FIELD}
+        return target.xadd(self.stream, {'task': json.dumps(payload)})
+
+    def add_many(self, tasks):
+        """Publica várias tarefas em uma ida ao Redis"""
+        if not tasks:
+            return
+        pipeline = self.redis.pipeline(transaction=False)
+        for task in tasks:
+            self.add(task, pipeline)
+        pipeline.execute()
+
+    def fetch(self, count, block_ms=1000):
+        """Até count tarefas: primeiro as reivindicadas de consumidores mortos, depois novas (XREADGROUP)"""
+        self.ensure_group()
+        tasks = self.reclaim(count)
+        if len(tasks) < count:
+            response = self.redis.xreadgroup(
+                self.group, self.consumer, {self.stream: '>'},
+                count=count - len(tasks), block=None if tasks else block_ms
+            )
+            for _, entries in response or []:
+                tasks.extend(self._decode(entries))
+        self.read += len(tasks)
+        return tasks
+
+    def reclaim(self, count):
+        """Assume entradas pendentes há mais de claim_idle_ms (consumidor morto ou travado)"""
+        now = time.monotonic()
+        if now < self._next_claim:
+            return []
+        self._next_claim = now + self.claim_interval
+
+        pending = self.redis.xpending_range(self.stream, self.group, '-', '+', count, idle=self.claim_idle_ms)
+        if not pending:
+            return []
+
+        exhausted = [entry['message_id'] for entry in pending if entry['times_delivered'] >= self.max_deliveries]
+        retry = [entry['message_id'] for entry in pending if entry['times_delivered'] < self.max_deliveries]
+
+        if exhausted:
+            self._dead_letter(exhausted)
+
+        tasks = []
+        if retry:
+            tasks = self._decode(self.redis.xclaim(self.stream, self.group, self.consumer, self.claim_idle_ms, retry))
+            self.claimed += len(tasks)
+        return tasks
+
+    def _dead_letter(self, entry_ids):
+        """Move entradas que falharam repetidamente para o stream de mensagens mortas"""
+        entries = self.redis.xclaim(self.stream, self.group, self.consumer, self.claim_idle_ms, entry_ids)
+        # Só as entradas que o XCLAIM devolveu são nossas; as demais já foram reivindicadas por outro consumidor
+        claimed_ids = [entry_id for entry_id, fields in entries]
+        if not claimed_ids:
+            return
+        pipeline = self.redis.pipeline(transaction=True)
+        for entry_id, fields in entries:
+            if fields:
+                pipeline.xadd(self.dead_letter, dict(fields, original_id=entry_id))
+        pipeline.xack(self.stream, self.group, *claimed_ids)
+        pipeline.xdel(self.stream, *claimed_ids)
+        pipeline.execute()
+        self.dead_lettered += len(claimed_ids)
+
+    def _decode(self, entries):
+        tasks = []
+        for entry_id, fields in entries:
+            if not fields:
+                # Entrada apagada enquanto pendente: apenas confirma
+                self.ack([entry_id])
+                continue
+            task = json.loads(fields['task'])
+            task[ENTRY_FIELD] = entry_id
+            tasks.append(task)
+        return tasks
+
+    def ack(self, entry_ids):
+        """Confirma e remove as entradas processadas"""
+        entry_ids = [entry_id for entry_id in entry_ids if entry_id]
+        if not entry_ids:
+            return 0
+        pipeline = self.redis.pipeline(transaction=True)
+        pipeline.xack(self.stream, self.group, *entry_ids)
+        pipeline.xdel(self.stream, *entry_ids)
+        pipeline.execute()
+        self.acked += len(entry_ids)
+        return len(entry_ids)
+
+    def touch(self, entry_ids):
+        """Zera o tempo ocioso de entradas ainda em processamento, para que não sejam reivindicadas"""
+        entry_ids = [entry_id for entry_id in entry_ids if entry_id]
+        if entry_ids:
+            self.redis.xclaim(self.stream, self.group, self.consumer, 0, entry_ids, justid=True)
+
+    def ack_tasks(self, tasks):
+        return self.ack([task.get(ENTRY_FIELD) for task in tasks])
+
+    def requeue(self, tasks):
+        """Republica tarefas para nova tentativa e confirma as entradas originais, atomicamente"""
+        if not tasks:
+            return
+        entry_ids = [task[ENTRY_FIELD] for task in tasks if task.get(ENTRY_FIELD)]
+        pipeline = self.redis.pipeline(transaction=True)
+        for task in tasks:
+            self.add(task, pipeline)
+        if entry_ids:
+            pipeline.xack(self.stream, self.group, *entry_ids)
+            pipeline.xdel(self.stream, *entry_ids)
+        pipeline.execute()
+        for task in tasks:
+            task.pop(ENTRY_FIELD, None)
+
+    def migrate_list(self, list_key):
+        """Move para o stream as tarefas que sobraram na fila em lista usada antes dos streams"""
+        moved = 0
+        with self.redis.pipeline() as pipeline:
+            while True:
+                try:
+                    # RPOP e XADD na mesma transação: a tarefa não se perde se o processo cair entre os dois
+                    pipeline.watch(list_key)
+                    raw = pipeline.lindex(list_key, -1)
+                    if raw is None:
+                        return moved
+                    pipeline.multi()
+                    pipeline.rpop(list_key)
+                    pipeline.xadd(self.stream, {'task': raw})
+                    pipeline.execute()
+                    moved += 1
+                except redis.WatchError:
+                    # Outro processo mexeu na lista; tenta de novo
+                    continue
+
+    def stats(self):
+        """Tamanho, pendentes e atraso (entradas ainda não lidas) do grupo, mais contadores deste processo"""
+        result = {
+            'stream': self.stream,
+            'group': self.group,
+            'length': 0,
+            'pending': 0,
+            'lag': 0,
+            'consumers': 0,
+            'dead_letter': 0,
+            'read': self.read,
+            'acked': self.acked,
+            'claimed': self.claimed,
+            'dead_lettered': self.dead_lettered
+        }
+        try:
+            result['length'] = self.redis.xlen(self.stream)
+            result['dead_letter'] = self.redis.xlen(self.dead_letter)
+            for group in self.redis.xinfo_groups(self.stream):
+                if group['name'] != self.group:
+                    continue
+                result['pending'] = group['pending']
+                result['consumers'] = group['consumers']
+                # Redis < 7 não informa lag; como as entradas confirmadas são apagadas, lag = total - pendentes
+                lag = group.get('lag')
+                result['lag'] = lag if lag is not None else max(0, result['length'] - group['pending'])
+        except redis.ResponseError:
+            pass
+        return result
@@ -0,0 +1,63 @@
+"""
+Cache LRU de resultados de classificação por template de mensagem
+"""
+import os
+import threading
+from collections import OrderedDict
+
+# Troca cada dígito ASCII por '0': mantém tamanho e classe dos caracteres,
+# então spans e confiança continuam idênticos para regex que não olham o valor dos dígitos
+_DIGIT_MASK = str.maketrans('123456789', '000000000')
+
+_MISSING = object()
+
+
+def template_key(message_text):
+    """Forma normalizada do texto com os códigos numéricos mascarados"""
+    return message_text.translate(_DIGIT_MASK)
+
+
+class TemplateCache:
+    """Cache LRU limitado, com contadores de acerto (cada catálogo de serviços tem o seu)"""
+
+    def __init__(self, max_size=None):
+        self.max_size = max_size or int(os.getenv('CLASSIFIER_CACHE_SIZE', '10000'))
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Busca um resultado, marcando-o como usado recentemente"""
+        with self._lock:
+            value = self._entries.get(key, _MISSING)
+            if value is _MISSING:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """Armazena um resultado, descartando o menos usado se estiver cheio"""
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Remove todos os resultados"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Retorna estatísticas do cache"""
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': (self.hits / lookups * 100) if lookups > 0 else 0
+        }
@@ -0,0 +1,718 @@
+"""
+Entrega concorrente de webhooks aos clientes, fora da thread que consome a fila de mensagens
+"""
+import os
+import sys
+import json
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from sqlalchemy import insert, update, bindparam, text
+
+# Adiciona o diretório src ao path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from models import db, MessageDelivery, SystemLog
+from metrics import MetricsPublisher, percentile, instance_id
+from webhook_retry import WebhookRetryScheduler
+from circuit_breaker import CircuitBreaker, CLOSED, OPEN, HALF_OPEN
+
+# Tamanho máximo da resposta do cliente guardada em MessageDelivery.webhook_response
+RESPONSE_MAX_LENGTH = 1000
+
+# Estado dos circuit breakers por cliente (HASH client_id -> json), lido pela página de clientes e pelos
+# demais workers: o spool é compartilhado, então só quem abriu o circuito o drena enquanto ele não fecha
+BREAKER_STATE_KEY = 'webhook:breakers'
+
+# Jobs de clientes com o circuito aberto: LIST por cliente e SET dos clientes com spool
+SPOOL_PREFIX = 'webhook:spool'
+SPOOL_CLIENTS_KEY = 'webhook:spool:clients'
+
+
+def read_breakers(redis_client):
+    """Estado publicado dos circuit breakers e quantidade de jobs em spool por cliente"""
+    breakers = {
+        int(client_id): json.loads(raw) for client_id, raw in redis_client.hgetall(BREAKER_STATE_KEY).items()
+    }
+    spooled = sorted(int(client_id) for client_id in redis_client.smembers(SPOOL_CLIENTS_KEY))
+    pipeline = redis_client.pipeline(transaction=False)
+    for client_id in spooled:
+        pipeline.llen(f'{SPOOL_PREFIX}:{client_id}')
+    for client_id, length in zip(spooled, pipeline.execute()):
+        breakers.setdefault(client_id, {'state': CLOSED})['spooled'] = length
+    return breakers
+
+
+class DeliveryTicket:
+    """
+    Jobs de webhook de uma tarefa do stream; on_settled é chamado quando todos estão gravados
+
+    Um job está gravado quando seu MessageDelivery foi salvo (e a nova tentativa agendada, se houver) ou quando
+    foi guardado no spool do Redis. Até lá a tarefa não é confirmada: se o processo cair, outro worker a reivindica.
+    """
+
+    def __init__(self, on_settled):
+        self.on_settled = on_settled
+        self._open = 1      # reserva de quem cria os jobs, liberada em seal()
+        self._lock = threading.Lock()
+
+    def add(self):
+        with self._lock:
+            self._open += 1
+
+    def settle(self):
+        with self._lock:
+            self._open -= 1
+            done = self._open == 0
+        if done:
+            self.on_settled()
+
+    def seal(self):
+        """Todos os jobs da tarefa foram criados"""
+        self.settle()
+
+
+class WebhookJob:
+    """Um POST de webhook de uma mensagem para um cliente"""
+
+    __slots__ = ('message_id', 'client_id', 'webhook_url', 'payload', 'attempt', 'delivery_id', 'queued_at', 'ticket')
+
+    def __init__(self, message_id, client_id, webhook_url, payload, attempt=1, delivery_id=None, ticket=None):
+        self.message_id = message_id
+        self.client_id = client_id
+        self.webhook_url = webhook_url
+        self.payload = payload
+        self.attempt = attempt
+        # Id do MessageDelivery do job (primeira tentativa ou spool já gravados): o resultado atualiza essa linha
+        self.delivery_id = delivery_id
+        self.queued_at = time.monotonic()
+        self.ticket = ticket
+        if ticket:
+            ticket.add()
+
+    @property
+    def recorded(self):
+        return self.delivery_id is not None
+
+    def settle(self):
+        """Avisa a tarefa de origem que este job está gravado (uma única vez)"""
+        ticket, self.ticket = self.ticket, None
+        if ticket:
+            ticket.settle()
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['message_id'], data['client_id'], data['webhook_url'], data['payload'],
+                   attempt=data['attempt'], delivery_id=data.get('delivery_id'))
+
+    def to_dict(self, attempt=None):
+        return {
+            'message_id': self.message_id,
+            'client_id': self.client_id,
+            'webhook_url': self.webhook_url,
+            'payload': self.payload,
+            'attempt': attempt or self.attempt,
+            'delivery_id': self.delivery_id
+        }
+
+
+class WebhookDeliveryEngine:
+    """
+    Pool de threads com conexões keep-alive por host e uma fila (lane) por cliente
+
+    As lanes são atendidas em round-robin ponderado (client_weight(client_id) requisições por vez), com limite de
+    requisições simultâneas por cliente. Cada cliente tem um circuit breaker: com o circuito aberto os jobs
+    vão para um spool no Redis e voltam quando as requisições de teste (half-open) passam.
+
+    Clientes com entrega em lote (client_batching(client_id) -> (máximo de mensagens, espera máxima em segundos))
+    recebem um único POST com um array JSON quando a lane junta o máximo ou o job mais antigo espera o tempo limite.
+    """
+
+    def __init__(self, app, redis_client, module='delivery', client_weight=None, client_batching=None):
+        self.app = app
+        self.redis = redis_client
+        self.module = module
+        # Chamados com o lock do motor: devem ser apenas consultas em memória
+        self.client_weight = client_weight or (lambda client_id: 1)
+        self.client_batching = client_batching or (lambda client_id: None)
+
+        self.concurrency = int(os.getenv('WEBHOOK_CONCURRENCY', '200'))
+        self.client_concurrency = int(os.getenv('WEBHOOK_CLIENT_CONCURRENCY', '10'))
+        self.host_pool_size = int(os.getenv('WEBHOOK_HOST_POOL_SIZE', '20'))
+        self.max_pending = int(os.getenv('WEBHOOK_QUEUE_SIZE', '10000'))
+        self.connect_timeout = float(os.getenv('WEBHOOK_CONNECT_TIMEOUT', '5'))
+        self.timeout = float(os.getenv('WEBHOOK_TIMEOUT', '30'))
+        self.flush_interval = float(os.getenv('WEBHOOK_FLUSH_MS', '200')) / 1000
+        self.spool_batch = int(os.getenv('WEBHOOK_SPOOL_BATCH', '200'))
+        # Circuito aberto por outro worker sem mudança de estado há mais que isso: o worker é dado como morto
+        self.breaker_stale = float(os.getenv('WEBHOOK_BREAKER_STALE_SECONDS', '120'))
+
+        self.executor = None
+        self._sessions = {}         # scheme://host:porta -> Session com pool de conexões próprio
+        self._lanes = {}            # client_id -> deque de jobs aguardando vaga do cliente
+        self._ring = deque()        # clientes com jobs e vaga, na ordem do round-robin
+        self._ringed = set()
+        self._credit = {}           # client_id -> jobs que o cliente ainda pode enviar na vez atual
+        self._in_flight = {}        # client_id -> requisições em andamento
+        self._total_in_flight = 0
+        self._pending = 0           # jobs aceitos e ainda não concluídos
+        self._breakers = {}         # client_id -> CircuitBreaker
+        self._published = {}        # client_id -> último estado publicado no Redis
+        self._shared = {}           # client_id -> estado publicado por qualquer worker (lido a cada ciclo)
+        self._cond = threading.Condition()
+        self._sessions_lock = threading.Lock()
+
+        self._results = deque()     # (linha de MessageDelivery, job) a gravar em lote
+        self.retries = WebhookRetryScheduler(redis_client, self)
+        self.latencies = deque(maxlen=1024)
+        self.metrics = MetricsPublisher(redis_client, 'delivery')
+        self.running = False
+        self.thread = None
+        self.batch_thread = None
+
+        # Passo do AUTO_INCREMENT do servidor, lido na primeira inserção
+        self._autoinc_step = None
+
+        # Estatísticas
+        self.batches = 0
+        self.submitted = 0
+        self.delivered = 0
+        self.failed = 0
+        self.recorded = 0
+        self.retried = 0
+        self.spooled = 0
+        self.unspooled = 0
+        self.flushes = 0
+        self.failures = 0
+
+    def log_system(self, level, message, module=None):
+        """Registra log no sistema"""
+        try:
+            with self.app.app_context():
+                log_entry = SystemLog(level=level, message=message, module=module or self.module)
+                db.session.add(log_entry)
+                db.session.commit()
+        except Exception as e:
+            print(f"Erro ao registrar log: {e}")
+
+    def start(self):
+        """Inicia o pool de entrega e a thread de gravação dos resultados"""
+        if self.running:
+            return
+        self.running = True
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='webhook')
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        self.batch_thread = threading.Thread(target=self._release_batches, daemon=True)
+        self.batch_thread.start()
+        self.retries.start()
+
+    def stop(self, timeout=30):
+        """
+        Aguarda as entregas aceitas (até timeout), grava os resultados e encerra
+
+        Jobs que ainda estiverem na fila são descartados sem confirmar a tarefa de origem, que fica pendente
+        no stream para ser reivindicada.
+        """
+        self.retries.stop()
+        with self._cond:
+            self._cond.wait_for(lambda: self._pending == 0, timeout)
+        self.running = False
+        with self._cond:
+            self._cond.notify_all()
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+        if self.thread:
+            self.thread.join(timeout)
+        for session in self._sessions.values():
+            session.close()
+
+    def submit(self, job, timeout=None):
+        """Aceita um job sem esperar a entrega; bloqueia apenas com a fila cheia (False se o tempo acabar)"""
+        with self._cond:
+            parked = self._breaker(job.client_id).current() == OPEN or self._open_elsewhere(job.client_id)
+            if not parked:
+                if not self._cond.wait_for(lambda: self._pending < self.max_pending, timeout):
+                    return False
+                self._pending += 1
+                self.submitted += 1
+                self._lanes.setdefault(job.client_id, deque()).append(job)
+                self._enqueue_lane(job.client_id)
+                self._pump()
+                if self.client_batching(job.client_id):
+                    # Acorda a thread dos lotes para considerar o prazo do novo job
+                    self._cond.notify_all()
+        if parked:
+            # Cliente com o circuito aberto: o job espera no spool sem ocupar a fila do motor
+            self._spool(job.client_id, [job])
+        return True
+
+    def resubmit(self, data):
+        """Nova tentativa vinda do agendador; nunca espera vaga na fila (False se estiver cheia)"""
+        return self.submit(WebhookJob.from_dict(data), timeout=0)
+
+    def pending(self):
+        """Jobs aceitos e ainda não concluídos"""
+        return self._pending
+
+    def backlog_room(self):
+        """Vagas na fila para novas tentativas e jobs do spool; o resto fica reservado ao tráfego novo"""
+        return int(self.max_pending * self.retries.queue_share) - self._pending
+
+    def _open_elsewhere(self, client_id):
+        """Circuito do cliente aberto (ou em teste) por outro worker que ainda está ativo"""
+        shared = self._shared.get(client_id)
+        if not shared or shared.get('state') == CLOSED or shared.get('instance') == instance_id():
+            return False
+        return time.time() - shared.get('changed_at', 0) < self.breaker_stale
+
+    def _breaker(self, client_id):
+        breaker = self._breakers.get(client_id)
+        if breaker is None:
+            breaker = self._breakers[client_id] = CircuitBreaker()
+        return breaker
+
+    def _enqueue_lane(self, client_id):
+        """Coloca o cliente no fim do round-robin se ele tiver jobs e ainda não estiver lá (com o lock)"""
+        if client_id not in self._ringed and self._lanes.get(client_id):
+            self._ring.append(client_id)
+            self._ringed.add(client_id)
+
+    def _pump(self):
+        """Distribui as vagas livres do pool entre as lanes em round-robin ponderado (deficit round-robin, com o lock)"""
+        while self._ring and self._total_in_flight < self.concurrency:
+            client_id = self._ring[0]
+            lane = self._lanes.get(client_id)
+            in_flight = self._in_flight.get(client_id, 0)
+            limit = self._breaker(client_id).limit(self.client_concurrency)
+
+            # Lote incompleto e dentro do prazo não sai: a lane espera _release_batches a recolocar
+            batching = self.client_batching(client_id)
+            ready = lambda: lane and (not batching or self._batch_ready(lane, batching))
+
+            if ready() and in_flight < limit:
+                # Na sua vez o cliente envia até `peso` requisições, mesmo que as vagas liberem uma a uma
+                credit = self._credit.get(client_id) or self.client_weight(client_id)
+                while ready() and credit and in_flight < limit and self._total_in_flight < self.concurrency:
+                    if batching:
+                        jobs = [lane.popleft() for _ in range(min(batching[0], len(lane)))]
+                        self.executor.submit(self._deliver_batch, jobs)
+                    else:
+                        self.executor.submit(self._deliver, lane.popleft())
+                    in_flight += 1
+                    self._total_in_flight += 1
+                    credit -= 1
+                self._in_flight[client_id] = in_flight
+                if credit and ready() and in_flight < limit:
+                    # Acabaram as vagas do pool: continua na frente com o crédito restante
+                    self._credit[client_id] = credit
+                    break
+
+            self._ring.popleft()
+            self._ringed.discard(client_id)
+            self._credit.pop(client_id, None)
+            if not lane:
+                self._lanes.pop(client_id, None)
+            elif in_flight < limit and ready():
+                self._enqueue_lane(client_id)
+            # Senão o cliente espera uma requisição sua terminar ou o prazo do lote (e volta ao round-robin)
+
+    @staticmethod
+    def _batch_ready(lane, batching):
+        max_size, max_wait = batching
+        return len(lane) >= max_size or time.monotonic() - lane[0].queued_at >= max_wait
+
+    def _release_batches(self):
+        """Recoloca no round-robin as lanes em lote cujo job mais antigo atingiu a espera máxima"""
+        with self._cond:
+            while self.running:
+                now = time.monotonic()
+                next_due = None
+                for client_id, lane in self._lanes.items():
+                    batching = self.client_batching(client_id)
+                    if not batching or not lane or client_id in self._ringed:
+                        continue
+                    due = lane[0].queued_at + batching[1]
+                    if due <= now:
+                        self._enqueue_lane(client_id)
+                    elif next_due is None or due < next_due:
+                        next_due = due
+                self._pump()
+                self._cond.wait(next_due - now if next_due else 1.0)
+
+    def _finished(self, jobs, success, elapsed):
+        """Conclusão de uma requisição (um job ou um lote do mesmo cliente)"""
+        parked = []
+        client_id = jobs[0].client_id
+        with self._cond:
+            self._pending -= len(jobs)
+            self._total_in_flight -= 1
+            self._in_flight[client_id] -= 1
+            if not self._in_flight[client_id]:
+                del self._in_flight[client_id]
+
+            if success is not None and self._breaker(client_id).record(success, elapsed) == OPEN:
+                # Circuito aberto: o que esperava na lane vai para o spool
+                lane = self._lanes.pop(client_id, None)
+                if lane:
+                    parked = list(lane)
+                    self._pending -= len(parked)
+
+            self._enqueue_lane(client_id)
+            self._pump()
+            self._cond.notify_all()
+
+        if parked:
+            self._spool(client_id, parked)
+
+    def _spool(self, client_id, jobs):
+        """Guarda no Redis os jobs de um cliente com o circuito aberto"""
+        self._record_spooled(jobs)
+        try:
+            pipeline = self.redis.pipeline(transaction=False)
+            pipeline.rpush(f'{SPOOL_PREFIX}:{client_id}', *[json.dumps(job.to_dict()) for job in jobs])
+            pipeline.sadd(SPOOL_CLIENTS_KEY, client_id)
+            pipeline.execute()
+            self.spooled += len(jobs)
+            for job in jobs:
+                job.settle()
+        except Exception as e:
+            # Jobs não gravados: a tarefa de origem fica sem confirmação e será reivindicada
+            self.log_system('ERROR', f'Erro ao guardar {len(jobs)} webhooks do cliente {client_id} no spool: {e}')
+
+    def _record_spooled(self, jobs):
+        """Grava como 'spooled' a primeira tentativa dos jobs estacionados, para que apareçam antes da entrega"""
+        first = [job for job in jobs if not job.recorded]
+        if not first:
+            return
+        now = datetime.utcnow()
+        try:
+            with self.app.app_context():
+                delivery_ids = self._insert_deliveries([{
+                    'message_id': job.message_id,
+                    'client_id': job.client_id,
+                    'webhook_url': job.webhook_url,
+                    'webhook_status': 'spooled',
+                    'webhook_attempts': 0,
+                    'created_at': now
+                } for job in first])
+                db.session.commit()
+        except Exception as e:
+            # Sem a linha o resultado da entrega a insere depois, como numa primeira tentativa comum
+            self.log_system('ERROR', f'Erro ao registrar {len(first)} webhooks em spool: {e}')
+            return
+        for job, delivery_id in zip(first, delivery_ids):
+            job.delivery_id = delivery_id
+
+    def _insert_deliveries(self, rows):
+        """
+        Um INSERT multi-linha; retorna os ids gerados, na ordem das linhas
+
+        Um INSERT com a lista de valores é um "simple insert" para o InnoDB: os ids são reservados de uma vez,
+        consecutivos (passo auto_increment_increment) a partir do lastrowid, mesmo com inserções concorrentes.
+        """
+        result = db.session.execute(insert(MessageDelivery).values(rows))
+        if self._autoinc_step is None:
+            self._autoinc_step = int(db.session.execute(text('SELECT @@auto_increment_increment')).scalar() or 1)
+        first_id = result.lastrowid
+        return [first_id + index * self._autoinc_step for index in range(len(rows))]
+
+    def drain_spool(self):
+        """
+        Devolve ao motor os jobs em spool de clientes cujo circuito fechou (ou de teste, se half-open)
+
+        O estado publicado pelos demais workers vale sobre o breaker local: enquanto outro worker mantém o
+        circuito do cliente aberto, só ele drena o spool (com as requisições de teste do half-open).
+        """
+        for raw_client_id in self.redis.smembers(SPOOL_CLIENTS_KEY):
+            client_id = int(raw_client_id)
+            with self._cond:
+                breaker = self._breaker(client_id)
+                state = breaker.current()
+                if self._open_elsewhere(client_id):
+                    count = 0
+                elif state == HALF_OPEN:
+                    # Só as requisições de teste; o resto espera o circuito fechar
+                    busy = self._in_flight.get(client_id, 0) + len(self._lanes.get(client_id, ()))
+                    count = breaker.probes - busy
+                elif state == CLOSED:
+                    count = min(self.spool_batch, self.backlog_room())
+                else:
+                    count = 0
+            if count <= 0:
+                continue
+
+            key = f'{SPOOL_PREFIX}:{client_id}'
+            # LRANGE + LTRIM em um MULTI equivale ao LPOP com count, que só existe a partir do Redis 6.2
+            pipeline = self.redis.pipeline(transaction=True)
+            pipeline.lrange(key, 0, count - 1)
+            pipeline.ltrim(key, count, -1)
+            items = pipeline.execute()[0]
+            if len(items) < count:
+                self.redis.srem(SPOOL_CLIENTS_KEY, client_id)
+                # Outro processo pode ter acabado de adicionar ao spool
+                if self.redis.llen(key):
+                    self.redis.sadd(SPOOL_CLIENTS_KEY, client_id)
+
+            returned = []
+            for raw in items:
+                job = WebhookJob.from_dict(json.loads(raw))
+                if not self.submit(job, timeout=0):
+                    returned.append(raw)
+            if returned:
+                self.redis.lpush(key, *reversed(returned))
+                self.redis.sadd(SPOOL_CLIENTS_KEY, client_id)
+            self.unspooled += len(items) - len(returned)
+
+    def publish_breakers(self):
+        """Publica no Redis os breakers que mudaram de estado e lê o estado publicado pelos demais workers"""
+        with self._cond:
+            changed = {
+                client_id: breaker.snapshot() for client_id, breaker in self._breakers.items()
+                if breaker.current() != self._published.get(client_id, CLOSED)
+            }
+        if changed:
+            self._publish_breakers(changed)
+        self._shared = {
+            int(client_id): json.loads(raw) for client_id, raw in self.redis.hgetall(BREAKER_STATE_KEY).items()
+        }
+
+    def _publish_breakers(self, changed):
+        pipeline = self.redis.pipeline(transaction=False)
+        for client_id, snapshot in changed.items():
+            snapshot['instance'] = instance_id()
+            pipeline.hset(BREAKER_STATE_KEY, client_id, json.dumps(snapshot))
+        pipeline.execute()
+
+        for client_id, snapshot in changed.items():
+            self._published[client_id] = snapshot['state']
+            if snapshot['state'] == OPEN:
+                self.log_system('WARNING', f'Webhook do cliente {client_id} suspenso após {snapshot["failures"]} falhas seguidas')
+            elif snapshot['state'] == CLOSED:
+                self.log_system('INFO', f'Webhook do cliente {client_id} restabelecido')
+
+    def _session(self, webhook_url):
+        """Session keep-alive do host de destino (um pool de conexões por host)"""
+        parts = urlsplit(webhook_url)
+        key = f'{parts.scheme}://{parts.netloc}'
+        session = self._sessions.get(key)
+        if session is None:
+            with self._sessions_lock:
+                session = self._sessions.get(key)
+                if session is None:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.host_pool_size)
+                    session.mount('http://', adapter)
+                    session.mount('https://', adapter)
+                    self._sessions[key] = session
+        return session
+
+    def post(self, webhook_url, payload):
+        """POST do webhook; retorna (sucesso, resposta ou erro)"""
+        try:
+            response = self._session(webhook_url).post(
+                webhook_url,
+                json=payload,
+                timeout=(self.connect_timeout, self.timeout),
+                headers={'Content-Type': 'application/json'}
+            )
+        except requests.exceptions.Timeout:
+            return False, 'timeout'
+        except requests.exceptions.RequestException as e:
+            return False, str(e)
+        return response.status_code in (200, 201, 202), f'{response.status_code} {response.text}'
+
+    def post_batch(self, webhook_url, payloads):
+        """
+        POST de um lote (array JSON); retorna (sucesso, resposta ou erro, {message_id: (sucesso, detalhe)})
+
+        Uma resposta 2xx confirma o lote inteiro, exceto as mensagens que o cliente listar com erro no corpo:
+        [{"message_id": "...", "status": "error", "error": "..."}] ou {"results": [...]}.
+        """
+        try:
+            response = self._session(webhook_url).post(
+                webhook_url,
+                json=payloads,
+                timeout=(self.connect_timeout, self.timeout),
+                headers={'Content-Type': 'application/json'}
+            )
+        except requests.exceptions.Timeout:
+            return False, 'timeout', {}
+        except requests.exceptions.RequestException as e:
+            return False, str(e), {}
+        if response.status_code not in (200, 201, 202):
+            return False, f'{response.status_code} {response.text}', {}
+
+        try:
+            body = response.json() if response.content else None
+        except ValueError:
+            body = None
+        results = body.get('results') if isinstance(body, dict) else body
+        outcomes = {}
+        for item in results if isinstance(results, list) else []:
+            if isinstance(item, dict) and item.get('message_id') is not None:
+                failed = str(item.get('status', 'ok')).lower() == 'error'
+                outcomes[str(item['message_id'])] = (not failed, item.get('error') or item.get('status', 'ok'))
+        return True, f'{response.status_code} {response.text}', outcomes
+
+    def _record(self, job, success, response, elapsed):
+        """Resultado de um job, gravado em lote pela thread de gravação"""
+        if success:
+            self.delivered += 1
+            status = 'sent'
+        else:
+            self.failed += 1
+            status = 'retrying' if self.retries.should_retry(job.attempt) else 'failed'
+        now = datetime.utcnow()
+        self._results.append(({
+            'message_id': job.message_id,
+            'client_id': job.client_id,
+            'webhook_url': job.webhook_url,
+            'webhook_status': status,
+            'webhook_response': str(response)[:RESPONSE_MAX_LENGTH],
+            'webhook_attempts': job.attempt,
+            'latency_ms': elapsed * 1000,
+            'created_at': now,
+            'sent_at': now if success else None
+        }, job))
+
+    def _deliver(self, job):
+        success, elapsed = None, 0.0
+        try:
+            started = time.perf_counter()
+            success, response = self.post(job.webhook_url, job.payload)
+            elapsed = time.perf_counter() - started
+
+            self.latencies.append(elapsed)
+            self._record(job, success, response, elapsed)
+        except Exception as e:
+            self.log_system('ERROR', f'Erro ao entregar mensagem {job.message_id} para cliente {job.client_id}: {e}')
+        finally:
+            self._finished([job], success, elapsed)
+
+    def _deliver_batch(self, jobs):
+        success, elapsed = None, 0.0
+        try:
+            started = time.perf_counter()
+            success, response, outcomes = self.post_batch(jobs[0].webhook_url, [job.payload for job in jobs])
+            elapsed = time.perf_counter() - started
+
+            self.latencies.append(elapsed)
+            self.batches += 1
+            for job in jobs:
+                # Sem resultado individual, vale o resultado do lote
+                job_success, detail = outcomes.get(str(job.payload.get('message_id')), (success, response))
+                self._record(job, job_success, detail, elapsed)
+        except Exception as e:
+            self.log_system('ERROR', f'Erro ao entregar lote de {len(jobs)} mensagens para cliente {jobs[0].client_id}: {e}')
+        finally:
+            self._finished(jobs, success, elapsed)
+
+    def _run(self):
+        backoff = 1
+        while self.running or self._results:
+            time.sleep(self.flush_interval)
+            self.metrics.maybe_publish(self.stats)
+            try:
+                self.publish_breakers()
+                self.drain_spool()
+            except Exception as e:
+                self.log_system('ERROR', f'Erro ao atualizar circuit breakers/spool de webhooks: {e}')
+
+            rows = []
+            while self._results:
+                rows.append(self._results.popleft())
+            if not rows:
+                continue
+
+            try:
+                self.flush(rows)
+                backoff = 1
+            except Exception as e:
+                self.failures += 1
+                self._results.extendleft(reversed(rows))
+                self.log_system('ERROR', f'Erro ao gravar {len(rows)} entregas de webhook: {e}')
+                if not self.running:
+                    return
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+
+    def flush(self, results):
+        """Um INSERT para as primeiras tentativas e um UPDATE da linha existente (nova tentativa ou spool) para as demais"""
+        first_jobs = [job for row, job in results if not job.recorded]
+        first = [row for row, job in results if not job.recorded]
+        retried = [dict(row, b_id=job.delivery_id) for row, job in results if job.recorded]
+
+        with self.app.app_context():
+            delivery_ids = self._insert_deliveries(first) if first else []
+            if retried:
+                # Pela chave primária: uma tarefa reivindicada cria outra linha para o mesmo message_id/client_id
+                table = MessageDelivery.__table__
+                db.session.execute(
+                    update(table)
+                    .where(table.c.id == bindparam('b_id'))
+                    .values(
+                        webhook_status=bindparam('webhook_status'),
+                        webhook_response=bindparam('webhook_response'),
+                        webhook_attempts=bindparam('webhook_attempts'),
+                        latency_ms=bindparam('latency_ms'),
+                        sent_at=bindparam('sent_at')
+                    ),
+                    retried
+                )
+            db.session.commit()
+        for job, delivery_id in zip(first_jobs, delivery_ids):
+            job.delivery_id = delivery_id
+
+        # Só depois de gravada a linha: a próxima tentativa sempre encontra o MessageDelivery para atualizar
+        retry_jobs = [job for row, job in results if row['webhook_status'] == 'retrying']
+        try:
+            self.retries.schedule(retry_jobs)
+        except Exception as e:
+            # As linhas já foram gravadas: não devolve o lote, apenas registra
+            self.retries.errors += 1
+            self.log_system('ERROR', f'Erro ao agendar {len(retry_jobs)} novas tentativas de webhook: {e}')
+
+        for row, job in results:
+            job.settle()
+
+        self.flushes += 1
+        self.recorded += len(first)
+        self.retried += len(retried)
+        failed = sum(1 for row, job in results if row['webhook_status'] == 'failed')
+        if failed:
+            self.log_system('WARNING', f'{len(results)} entregas de webhook gravadas ({failed} falharam em definitivo)')
+
+    def stats(self):
+        """Estatísticas do motor de entrega, com a latência por requisição"""
+        latencies = list(self.latencies)
+        with self._cond:
+            waiting_clients = len(self._lanes)
+            breakers = {CLOSED: 0, OPEN: 0, HALF_OPEN: 0}
+            for breaker in self._breakers.values():
+                breakers[breaker.current()] += 1
+        return {
+            'pending': self._pending,
+            'in_flight': self._total_in_flight,
+            'waiting_clients': waiting_clients,
+            'breakers': breakers,
+            'batches': self.batches,
+            'spooled': self.spooled,
+            'unspooled': self.unspooled,
+            'hosts': len(self._sessions),
+            'submitted': self.submitted,
+            'delivered': self.delivered,
+            'failed': self.failed,
+            'recorded': self.recorded,
+            'retried': self.retried,
+            'retry': self.retries.stats(),
+            'flushes': self.flushes,
+            'failures': self.failures,
+            'latency_p50_ms': percentile(latencies, 0.5) * 1000,
+            'latency_p99_ms': percentile(latencies, 0.99) * 1000
+        }
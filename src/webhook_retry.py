@@ -0,0 +1,147 @@
+"""
+Agendamento de novas tentativas de webhook em um sorted set do Redis ordenado pelo horário da tentativa
+"""
+import os
+import sys
+import json
+import time
+import threading
+
+# Adiciona o diretório src ao path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from backoff import jittered_backoff
+
+# ZSET message_id:client_id -> horário (epoch) da próxima tentativa; HASH com o job de cada membro
+RETRY_SCHEDULE_KEY = 'webhook:retry:schedule'
+RETRY_JOBS_KEY = 'webhook:retry:jobs'
+
+
+class WebhookRetryScheduler:
+    """Reagenda entregas que falharam com backoff exponencial e as devolve ao motor quando vencem"""
+
+    def __init__(self, redis_client, engine):
+        self.redis = redis_client
+        self.engine = engine
+
+        self.max_attempts = int(os.getenv('WEBHOOK_RETRY_ATTEMPTS', '3'))
+        self.base_delay = float(os.getenv('WEBHOOK_RETRY_BASE', '5'))
+        self.max_delay = float(os.getenv('WEBHOOK_RETRY_MAX', '600'))
+        self.poll_interval = float(os.getenv('WEBHOOK_RETRY_POLL_MS', '500')) / 1000
+        self.batch_size = int(os.getenv('WEBHOOK_RETRY_BATCH', '200'))
+        # Fração da fila do motor que as novas tentativas podem ocupar; o resto fica para o tráfego novo
+        self.queue_share = float(os.getenv('WEBHOOK_RETRY_QUEUE_SHARE', '0.5'))
+
+        self.running = False
+        self.thread = None
+
+        # Estatísticas
+        self.scheduled = 0
+        self.promoted = 0
+        self.deferred = 0
+        self.errors = 0
+
+    def should_retry(self, attempt):
+        return attempt < self.max_attempts
+
+    def schedule(self, jobs):
+        """Agenda a próxima tentativa de cada job (job.attempt é a tentativa que acabou de falhar)"""
+        if not jobs:
+            return
+        now = time.time()
+        self._enqueue([
+            (job.to_dict(attempt=job.attempt + 1), now + jittered_backoff(job.attempt, self.base_delay, self.max_delay))
+            for job in jobs
+        ])
+        self.scheduled += len(jobs)
+
+    def _enqueue(self, entries):
+        # MULTI: o job e seu horário aparecem juntos para o poll de outros workers
+        pipeline = self.redis.pipeline(transaction=True)
+        for data, due_at in entries:
+            member = f"{data['message_id']}:{data['client_id']}"
+            pipeline.hset(RETRY_JOBS_KEY, member, json.dumps(data))
+            pipeline.zadd(RETRY_SCHEDULE_KEY, {member: due_at})
+        pipeline.execute()
+
+    def start(self):
+        """Inicia a thread que promove as tentativas vencidas"""
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=5):
+        """Para a promoção; o que estiver agendado continua no Redis"""
+        self.running = False
+        if self.thread:
+            self.thread.join(timeout)
+
+    def _run(self):
+        while self.running:
+            try:
+                promoted = self.poll()
+            except Exception as e:
+                self.errors += 1
+                self.engine.log_system('ERROR', f'Erro ao promover novas tentativas de webhook: {e}')
+                promoted = 0
+            if promoted < self.batch_size:
+                time.sleep(self.poll_interval)
+
+    def poll(self):
+        """Devolve ao motor um lote de tentativas vencidas, sem ocupar a vaga do tráfego novo"""
+        room = min(self.batch_size, self.engine.backlog_room())
+        if room <= 0:
+            return 0
+
+        members = self.redis.zrangebyscore(RETRY_SCHEDULE_KEY, '-inf', time.time(), start=0, num=room)
+        if not members:
+            return 0
+
+        # ZREM, HGET e HDEL em um MULTI: uma queda não deixa job sem agendamento, e só quem removeu
+        # o membro do ZSET faz a tentativa (o HDEL de quem perdeu a disputa já não encontra nada)
+        pipeline = self.redis.pipeline(transaction=True)
+        for member in members:
+            pipeline.zrem(RETRY_SCHEDULE_KEY, member)
+            pipeline.hget(RETRY_JOBS_KEY, member)
+            pipeline.hdel(RETRY_JOBS_KEY, member)
+        replies = pipeline.execute()
+        raw_jobs = [raw for removed, raw in zip(replies[0::3], replies[1::3]) if removed]
+        if not raw_jobs:
+            return 0
+
+        promoted = 0
+        deferred = []
+        for raw in raw_jobs:
+            if raw is None:
+                continue
+            data = json.loads(raw)
+            if self.engine.resubmit(data):
+                promoted += 1
+            else:
+                deferred.append(data)
+
+        if deferred:
+            # Fila do motor cheia: volta ao agendamento para o próximo ciclo, sem contar como tentativa
+            self._enqueue([(data, time.time() + self.poll_interval) for data in deferred])
+            self.deferred += len(deferred)
+        self.promoted += promoted
+        return promoted
+
+    def stats(self):
+        """Estatísticas do agendador (scheduled/due consultados no Redis)"""
+        result = {
+            'scheduled': 0,
+            'due': 0,
+            'rescheduled': self.scheduled,
+            'promoted': self.promoted,
+            'deferred': self.deferred,
+            'errors': self.errors
+        }
+        try:
+            result['scheduled'] = self.redis.zcard(RETRY_SCHEDULE_KEY)
+            result['due'] = self.redis.zcount(RETRY_SCHEDULE_KEY, '-inf', time.time())
+        except Exception:
+            pass
+        return result
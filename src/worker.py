@@ -3,10 +3,8 @@ Worker para processamento assíncrono de mensagens
 """
 import os
 import sys
-import json
 import time
-import requests
-import re
+import threading
 from datetime import datetime
 from flask import Flask
 from dotenv import load_dotenv
@@ -14,7 +12,11 @@ from dotenv import load_dotenv
 # Adiciona o diretório src ao path
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from models import db, Message, Service, MessageDelivery, SystemLog
+from models import db, Message, SystemLog
+from service_cache import ServiceCache
+from routing_index import RoutingIndex
+from task_stream import TaskStream, MESSAGE_STREAM, SEND_STREAM, WORKER_GROUP, SENDER_GROUP, ENTRY_FIELD
+from webhook_delivery import WebhookDeliveryEngine, WebhookJob, DeliveryTicket
 import redis
 
 # Carrega variáveis de ambiente
@@ -36,13 +38,67 @@ app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
 db.init_app(app)
 
+# Catálogo de serviços compilado, compartilhado pelas threads do worker
+service_cache = ServiceCache(app, redis_client)
+
+# Roteamento DID → cliente em memória
+routing_index = RoutingIndex(app, redis_client)
+
+# Filas de tarefas (Redis Streams com grupos de consumidores); o worker só lê o stream de mensagens,
+# o de envio é usado apenas na migração das filas em lista
+message_stream = TaskStream(redis_client, MESSAGE_STREAM, WORKER_GROUP)
+send_stream = TaskStream(redis_client, SEND_STREAM, SENDER_GROUP)
+
+# Tarefas lidas do stream por ida ao Redis
+WORKER_BATCH_SIZE = int(os.getenv('WORKER_BATCH_SIZE', '50'))
+
+# Webhooks entregues em paralelo, sem bloquear a classificação
+delivery_engine = WebhookDeliveryEngine(
+    app, redis_client,
+    client_weight=routing_index.client_weight,
+    client_batching=routing_index.client_batching
+)
+
+# Tarefas com webhooks ainda não gravados (entry_id -> lida em): confirmadas pelo motor de entrega e
+# renovadas no stream até lá; passado WORKER_SETTLE_TIMEOUT deixam de ser renovadas e outro worker as reivindica
+pending_entries = {}
+pending_lock = threading.Lock()
+WORKER_SETTLE_TIMEOUT = float(os.getenv('WORKER_SETTLE_TIMEOUT', '600'))
+
+
+def task_ticket(task):
+    """Ticket que confirma a tarefa no stream quando todos os seus webhooks estiverem gravados"""
+    entry_id = task.get(ENTRY_FIELD)
+    with pending_lock:
+        pending_entries[entry_id] = time.monotonic()
+
+    def settled():
+        message_stream.ack_tasks([task])
+        with pending_lock:
+            pending_entries.pop(entry_id, None)
+
+    return DeliveryTicket(settled)
+
+
+def release_task(task):
+    """Deixa de renovar uma tarefa que falhou: ela continua pendente e é reivindicada (ou vai para o dead letter)"""
+    with pending_lock:
+        pending_entries.pop(task.get(ENTRY_FIELD), None)
+
+
+def touch_pending_entries():
+    """Evita que as tarefas aguardando o motor de entrega sejam reivindicadas por outro worker"""
+    deadline = time.monotonic() - WORKER_SETTLE_TIMEOUT
+    with pending_lock:
+        for entry_id in [entry_id for entry_id, read_at in pending_entries.items() if read_at < deadline]:
+            del pending_entries[entry_id]
+        entry_ids = list(pending_entries)
+    message_stream.touch(entry_ids)
+
+
 class MessageProcessor:
     """Processador de mensagens"""
     
-    def __init__(self):
-        self.webhook_timeout = int(os.getenv('WEBHOOK_TIMEOUT', '30'))
-        self.webhook_retry_attempts = int(os.getenv('WEBHOOK_RETRY_ATTEMPTS', '3'))
-    
     def log_system(self, level, message, module='worker'):
         """Registra log no sistema"""
         try:
@@ -56,18 +112,7 @@ class MessageProcessor:
     def classify_message(self, message_text):
         """Classifica mensagem por serviço baseado em regex"""
         try:
-            with app.app_context():
-                services = Service.query.filter_by(is_active=True).all()
-                
-                for service in services:
-                    try:
-                        if re.search(service.regex_pattern, message_text, re.IGNORECASE):
-                            return service
-                    except re.error as e:
-                        self.log_system('ERROR', f'Erro na regex do serviço {service.name}: {e}', 'classifier')
-                        continue
-                
-                return None
+            return service_cache.get_matcher().match_first(message_text)
         except Exception as e:
             self.log_system('ERROR', f'Erro ao classificar mensagem: {e}', 'classifier')
             return None
@@ -83,11 +128,11 @@ class MessageProcessor:
                 
                 # Classifica a mensagem se ainda não foi classificada
                 if not message.service_id:
-                    service = self.classify_message(message.short_message)
-                    if service:
-                        message.service_id = service.id
+                    match = self.classify_message(message.short_message)
+                    if match:
+                        message.service_id = match.service_id
                         message.status = 'classified'
-                        self.log_system('INFO', f'Mensagem {message.message_id} classificada como {service.name}', 'processor')
+                        self.log_system('INFO', f'Mensagem {message.message_id} classificada como {match.name}', 'processor')
                     else:
                         message.status = 'unclassified'
                         self.log_system('INFO', f'Mensagem {message.message_id} não classificada', 'processor')
@@ -101,77 +146,24 @@ class MessageProcessor:
             self.log_system('ERROR', f'Erro ao processar classificação da mensagem {message_id}: {e}', 'processor')
             return False
     
-    def deliver_to_client(self, message_id, client_id, webhook_url):
-        """Entrega mensagem para cliente via webhook"""
-        try:
-            with app.app_context():
-                message = Message.query.get(message_id)
-                if not message:
-                    return False
-                
-                # Prepara payload para webhook
-                payload = {
-                    'message_id': message.message_id,
-                    'source_addr': message.source_addr,
-                    'destination_addr': message.destination_addr,
-                    'short_message': message.short_message,
-                    'message_type': message.message_type,
-                    'service_name': message.service.name if message.service else None,
-                    'created_at': message.created_at.isoformat(),
-                    'timestamp': int(datetime.utcnow().timestamp())
-                }
-                
-                # Tenta entregar via webhook
-                success = self.send_webhook(webhook_url, payload)
-                
-                # Registra tentativa de entrega
-                delivery = MessageDelivery(
-                    message_id=message_id,
-                    client_id=client_id,
-                    webhook_url=webhook_url,
-                    webhook_status='sent' if success else 'failed',
-                    webhook_attempts=1
-                )
-                
-                if success:
-                    delivery.sent_at = datetime.utcnow()
-                    self.log_system('INFO', f'Mensagem {message.message_id} entregue para cliente {client_id}', 'delivery')
-                else:
-                    self.log_system('WARNING', f'Falha ao entregar mensagem {message.message_id} para cliente {client_id}', 'delivery')
-                
-                db.session.add(delivery)
-                db.session.commit()
-                
-                return success
-                
-        except Exception as e:
-            self.log_system('ERROR', f'Erro ao entregar mensagem {message_id} para cliente {client_id}: {e}', 'delivery')
-            return False
+    def webhook_payload(self, message):
+        """Payload do webhook de uma mensagem (o mesmo para todos os clientes)"""
+        return {
+            'message_id': message.message_id,
+            'source_addr': message.source_addr,
+            'destination_addr': message.destination_addr,
+            'short_message': message.short_message,
+            'message_type': message.message_type,
+            'service_name': message.service.name if message.service else None,
+            'created_at': message.created_at.isoformat(),
+            'timestamp': int(datetime.utcnow().timestamp())
+        }
     
-    def send_webhook(self, webhook_url, payload):
-        """Envia webhook para cliente"""
-        try:
-            response = requests.post(
-                webhook_url,
-                json=payload,
-                timeout=self.webhook_timeout,
-                headers={'Content-Type': 'application/json'}
-            )
-            
-            if response.status_code in [200, 201, 202]:
-                return True
-            else:
-                self.log_system('WARNING', f'Webhook retornou status {response.status_code}: {response.text}', 'webhook')
-                return False
-                
-        except requests.exceptions.Timeout:
-            self.log_system('WARNING', f'Timeout ao enviar webhook para {webhook_url}', 'webhook')
-            return False
-        except requests.exceptions.RequestException as e:
-            self.log_system('WARNING', f'Erro ao enviar webhook para {webhook_url}: {e}', 'webhook')
-            return False
+    def deliver_to_client(self, message_id, payload, client_id, webhook_url, ticket=None):
+        """Entrega mensagem para cliente via webhook (o motor de entrega grava o MessageDelivery)"""
+        return delivery_engine.submit(WebhookJob(message_id, client_id, webhook_url, payload, ticket=ticket))
     
-    def process_message_delivery(self, message_id):
+    def process_message_delivery(self, message_id, ticket=None):
         """Processa entrega de mensagem para clientes"""
         try:
             with app.app_context():
@@ -181,26 +173,30 @@ class MessageProcessor:
                 
                 # Busca clientes que devem receber esta mensagem
                 # (baseado no DID ou configuração global)
-                from models import PhoneNumber, Client
+                
+                payload = self.webhook_payload(message)
                 
                 # Se a mensagem tem um DID associado, entrega apenas para o cliente dono do DID
                 if message.phone_number_id:
-                    phone_number = PhoneNumber.query.get(message.phone_number_id)
-                    if phone_number and phone_number.client.webhook_url:
+                    route = routing_index.get(message.phone_number_id)
+                    if route and route.webhook_url:
                         self.deliver_to_client(
                             message_id,
-                            phone_number.client_id,
-                            phone_number.client.webhook_url
+                            payload,
+                            route.client_id,
+                            route.webhook_url,
+                            ticket
                         )
                 else:
                     # Se não tem DID específico, entrega para todos os clientes ativos
-                    clients = Client.query.filter_by(is_active=True).all()
-                    for client in clients:
+                    for client in routing_index.active_clients():
                         if client.webhook_url:
                             self.deliver_to_client(
                                 message_id,
-                                client.id,
-                                client.webhook_url
+                                payload,
+                                client.client_id,
+                                client.webhook_url,
+                                ticket
                             )
                 
                 return True
@@ -212,32 +208,45 @@ class MessageProcessor:
 def process_message_queue():
     """Processa fila de mensagens"""
     processor = MessageProcessor()
+    next_touch = 0.0
     
     while True:
         try:
-            # Busca mensagem na fila (bloqueia por 5 segundos se vazia)
-            result = redis_client.brpop('message_queue', timeout=5)
+            if time.monotonic() >= next_touch:
+                touch_pending_entries()
+                next_touch = time.monotonic() + message_stream.claim_interval
             
-            if result:
-                queue_name, data = result
-                task = json.loads(data)
-                
+            # Busca tarefas no stream (bloqueia por 5 segundos se vazio)
+            tasks = message_stream.fetch(WORKER_BATCH_SIZE, block_ms=5000)
+            
+            for task in tasks:
                 message_id = task.get('message_id')
                 action = task.get('action')
                 
+                # Confirma só depois de processada e com os webhooks gravados: se o worker cair antes,
+                # outro reivindica a tarefa
+                ticket = task_ticket(task)
+                
+                processed = True
                 if action == 'classify_and_deliver':
-                    # Classifica a mensagem
-                    processor.process_message_classification(message_id)
-                    
-                    # Processa entrega
-                    processor.process_message_delivery(message_id)
+                    # Classifica a mensagem e processa a entrega
+                    processed = (processor.process_message_classification(message_id)
+                                 and processor.process_message_delivery(message_id, ticket))
                     
                 elif action == 'classify_only':
-                    processor.process_message_classification(message_id)
+                    processed = processor.process_message_classification(message_id)
                     
                 elif action == 'deliver_only':
-                    processor.process_message_delivery(message_id)
+                    processed = processor.process_message_delivery(message_id, ticket)
+                
+                if not processed:
+                    # Sem selar o ticket a entrada nunca é confirmada, mesmo que já tenha webhooks gravados
+                    release_task(task)
+                    processor.log_system('WARNING', f'Task {action} para mensagem {message_id} falhou; '
+                                                    f'fica pendente para nova tentativa', 'worker')
+                    continue
                 
+                ticket.seal()
                 processor.log_system('INFO', f'Task processada: {action} para mensagem {message_id}', 'worker')
             
         except KeyboardInterrupt:
@@ -247,59 +256,30 @@ def process_message_queue():
             processor.log_system('ERROR', f'Erro no worker: {e}', 'worker')
             time.sleep(5)  # Aguarda antes de tentar novamente
 
-def process_send_queue():
-    """Processa fila de envio de SMS"""
-    processor = MessageProcessor()
-    
-    while True:
-        try:
-            # Busca mensagem na fila de envio
-            result = redis_client.brpop('send_queue', timeout=5)
-            
-            if result:
-                queue_name, data = result
-                task = json.loads(data)
-                
-                message_id = task.get('message_id')
-                destination_addr = task.get('destination_addr')
-                short_message = task.get('short_message')
-                
-                # Aqui você integraria com o conector SMPP
-                # Por enquanto, apenas marca como enviado
-                with app.app_context():
-                    message = Message.query.get(message_id)
-                    if message:
-                        message.status = 'sent'
-                        message.processed_at = datetime.utcnow()
-                        db.session.commit()
-                        processor.log_system('INFO', f'SMS {message.message_id} enviado para {destination_addr}', 'sender')
-            
-        except KeyboardInterrupt:
-            processor.log_system('INFO', 'Sender worker interrompido pelo usuário', 'worker')
-            break
-        except Exception as e:
-            processor.log_system('ERROR', f'Erro no sender worker: {e}', 'worker')
-            time.sleep(5)
-
 def main():
     """Função principal do worker"""
-    import threading
-    
     processor = MessageProcessor()
     processor.log_system('INFO', 'Worker iniciado', 'worker')
+    routing_index.load()
+    
+    # Tarefas que ficaram nas filas em lista de versões anteriores
+    for stream, list_key in ((message_stream, 'message_queue'), (send_stream, 'send_queue')):
+        moved = stream.migrate_list(list_key)
+        if moved:
+            processor.log_system('INFO', f'{moved} tarefas migradas de {list_key} para {stream.stream}', 'worker')
     
-    # Inicia threads para diferentes filas
+    # Inicia a thread da fila de mensagens (o stream de envio é consumido pelos conectores SMPP)
     message_thread = threading.Thread(target=process_message_queue, daemon=True)
-    send_thread = threading.Thread(target=process_send_queue, daemon=True)
     
+    delivery_engine.start()
     message_thread.start()
-    send_thread.start()
     
     try:
         # Mantém o worker rodando
         while True:
             time.sleep(1)
     except KeyboardInterrupt:
+        delivery_engine.stop()
         processor.log_system('INFO', 'Worker finalizado', 'worker')
 
 if __name__ == '__main__':